@@ -0,0 +1,297 @@
+"""Offline stand-ins for Discord and the upstream APIs, shared by the benches.
+
+FakeBot is a real commands.Bot that never logs in: cogs load into it as
+usual, and the channels, users and interactions they see are the small
+fakes below, which record what was sent after an optional simulated
+REST latency. StubUpstream serves ESI, zKillboard and an RSS feed from
+127.0.0.1 and points the bot's modules at it.
+"""
+import asyncio
+import itertools
+import sys
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+import discord
+from aiohttp import web
+from discord.ext import commands
+from utils.clock import Clock
+from utils.cluster import Cluster
+from utils.outbound import OutboundQueue
+from utils.settings import GuildSettings
+from utils.snapshot import Snapshot
+
+GUILD_ID = 1000
+BOT_USER_ID = 1
+# Fake DM channel ids are the user id offset by this, clear of every other fake id.
+DM_CHANNEL_BASE = 10 ** 15
+ADMIN_USER_ID = 2
+REGION_ID = 10000002
+
+message_ids = itertools.count(10 ** 17)
+
+class FakeMessage:
+    def __init__(self, channel, id=None):
+        self.channel = channel
+        self.id = id or next(message_ids)
+
+    async def add_reaction(self, emoji):
+        await self.channel.bot.rest_call()
+
+    async def remove_reaction(self, emoji, member):
+        await self.channel.bot.rest_call()
+
+    async def reply(self, *args, **kwargs):
+        return await self.channel.send(*args, **kwargs)
+
+class FakeChannel:
+    def __init__(self, bot, id, guild_id=GUILD_ID):
+        self.bot = bot
+        self.id = id
+        self.guild_id = guild_id
+        self.mention = f"<#{id}>"
+
+    async def send(self, *args, **kwargs):
+        await self.bot.rest_call()
+        self.bot.delivered(self, args, kwargs)
+        return FakeMessage(self)
+
+    async def fetch_message(self, message_id):
+        await self.bot.rest_call()
+        return FakeMessage(self, message_id)
+
+    def get_partial_message(self, message_id):
+        return FakeMessage(self, message_id)
+
+class FakeUser:
+    def __init__(self, bot, id):
+        self.bot = bot
+        self.id = id
+        self.name = f"pilot{id}"
+        self.display_name = f"Pilot {id}"
+        self.mention = f"<@{id}>"
+        self.guild_permissions = discord.Permissions.none()
+        # Its presence makes utils.outbound route sends to this user as DMs.
+        self.dm_channel = None
+
+    def __str__(self):
+        return self.name
+
+    async def send(self, *args, **kwargs):
+        await self.bot.rest_call()
+        self.bot.delivered(self, args, kwargs)
+        return FakeMessage(FakeChannel(self.bot, self.id, None))
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self.done = False
+
+    def is_done(self):
+        return self.done
+
+    async def _respond(self, *args, **kwargs):
+        if self.done:
+            raise discord.InteractionResponded(self.interaction)
+        self.done = True
+        await self.interaction.client.rest_call()
+
+    send_message = defer = edit_message = send_modal = _respond
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, *args, **kwargs):
+        await self.interaction.client.rest_call()
+
+class FakeInteraction:
+    def __init__(self, bot, command, user, channel, options=None):
+        self.client = bot
+        self.command = command
+        self.user = user
+        self.channel = channel
+        self.channel_id = channel.id
+        self.guild_id = channel.guild_id
+        self.guild = None
+        self.data = {'options': [{'name': name, 'value': value} for name, value in (options or {}).items()]}
+        self.extras = {}
+        self.created_at = datetime.now(timezone.utc)
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+class FakeBot(commands.Bot):
+    """A bot with the attributes ChuckBot gives its cogs, and no gateway."""
+
+    def __init__(self, send_latency=0.0, snapshot_path='cache_snapshot.bin', clock=None):
+        super().__init__(command_prefix='!', intents=discord.Intents(guilds=True))
+        self.send_latency = send_latency
+        self.sent = 0
+        # Called as on_send(destination, args, kwargs) for every message sent, if set.
+        self.on_send = None
+        self.fake_channels = {}
+        self.fake_users = {}
+        self.ready = None
+        self.clock = clock or Clock()
+        self.cluster = Cluster(shard_count=0)
+        self.settings = GuildSettings('chuck.db', GUILD_ID)
+        self.outbound = OutboundQueue()
+        self.snapshot = Snapshot(snapshot_path, interval=0)
+        self._connection.user = discord.ClientUser(state=self._connection, data={
+            'id': str(BOT_USER_ID), 'username': 'Chuck', 'discriminator': '0', 'avatar': None})
+
+    async def setup(self):
+        # What login() would do: bind the client to the running loop.
+        await self._async_setup_hook()
+        self.ready = asyncio.Event()
+        self.outbound.start()
+
+    def delivered(self, destination, args, kwargs):
+        self.sent += 1
+        if self.on_send:
+            self.on_send(destination, args, kwargs)
+
+    async def rest_call(self):
+        if self.send_latency:
+            await asyncio.sleep(self.send_latency)
+
+    async def wait_until_ready(self):
+        await self.ready.wait()
+
+    def channel(self, channel_id, guild_id=GUILD_ID):
+        channel = self.fake_channels.get(channel_id)
+        if channel is None:
+            channel = self.fake_channels[channel_id] = FakeChannel(self, channel_id, guild_id)
+        return channel
+
+    def get_channel(self, channel_id):
+        return self.channel(channel_id)
+
+    def get_partial_messageable(self, channel_id, **kwargs):
+        return self.channel(channel_id)
+
+    def get_user(self, user_id):
+        user = self.fake_users.get(user_id)
+        if user is None:
+            user = self.fake_users[user_id] = FakeUser(self, user_id)
+        return user
+
+    async def fetch_user(self, user_id):
+        await self.rest_call()
+        return self.get_user(user_id)
+
+    async def create_dm(self, user):
+        await self.rest_call()
+        return self.channel(DM_CHANNEL_BASE + user.id, None)
+
+    async def close(self):
+        await self.outbound.stop()
+        await super().close()
+        self.settings.close()
+
+async def invoke(bot, name, user, channel, /, **options):
+    """Run an app command the way the tree would: checks, then the callback."""
+    command = bot.tree.get_command(name)
+    interaction = FakeInteraction(bot, command, user, channel, options)
+    if not await command._check_can_run(interaction):
+        raise discord.app_commands.CheckFailure(f"/{name} check failed")
+    await command.callback(command.binding, interaction, **options)
+    return interaction
+
+def reaction_payload(user_id, channel_id, message_id, emoji):
+    return SimpleNamespace(user_id=user_id, channel_id=channel_id, message_id=message_id, guild_id=GUILD_ID,
+                           emoji=discord.PartialEmoji(name=emoji), member=None)
+
+class StubUpstream:
+    """ESI, zKillboard and an RSS feed on 127.0.0.1, producing a few new kills and articles per poll."""
+
+    def __init__(self, kills_per_poll=3):
+        self.kills_per_poll = kills_per_poll
+        self.kill_ids = itertools.count(100000000)
+        self.articles = 0
+        self.requests = 0
+        self.runner = None
+        self.base = None
+
+    async def start(self):
+        app = web.Application(middlewares=[self.count])
+        app.router.add_get('/latest/status/', self.status)
+        app.router.add_get('/api/kills/regionID/{region_id}/', self.region_kills)
+        app.router.add_get('/latest/killmails/{kill_id}/{hash}/', self.killmail)
+        app.router.add_get('/latest/universe/systems/{id}/', self.system)
+        app.router.add_get('/latest/universe/constellations/{id}/', self.constellation)
+        app.router.add_get('/latest/{path:.+}/{id}/', self.named)
+        app.router.add_get('/feed.xml', self.feed)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base = f"http://127.0.0.1:{port}"
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    @web.middleware
+    async def count(self, request, handler):
+        self.requests += 1
+        return await handler(request)
+
+    def patch_modules(self):
+        """Point the loaded cogs and utils at this server instead of the real APIs."""
+        from utils import killfeed
+        esi = f"{self.base}/latest"
+        killfeed.ESI_URL = esi
+        killfeed.ZKILL_REGION_URL = f"{self.base}/api/kills/regionID/{{region_id}}/"
+        killfeed.NAME_URLS.update({
+            'type': esi + "/universe/types/{id}/",
+            'character': esi + "/characters/{id}/",
+            'corporation': esi + "/corporations/{id}/",
+            'alliance': esi + "/alliances/{id}/",
+            'system': esi + "/universe/systems/{id}/",
+            'region': esi + "/universe/regions/{id}/"
+        })
+        time_cog = sys.modules.get('cogs.time_cog')
+        if time_cog:
+            time_cog.STATUS_URL = esi + "/status/"
+
+    @property
+    def feed_url(self):
+        return f"{self.base}/feed.xml"
+
+    async def status(self, request):
+        expires = (datetime.now(timezone.utc) + timedelta(seconds=30)).strftime('%a, %d %b %Y %H:%M:%S GMT')
+        return web.json_response({'players': 23000, 'server_version': '2500000', 'vip': False}, headers={'Expires': expires})
+
+    async def region_kills(self, request):
+        kills = sorted((next(self.kill_ids) for _ in range(self.kills_per_poll)), reverse=True)
+        return web.json_response([{'killmail_id': kill_id, 'zkb': {'hash': f"h{kill_id}", 'totalValue': 2_000_000_000}}
+                                  for kill_id in kills])
+
+    async def killmail(self, request):
+        kill_id = int(request.match_info['kill_id'])
+        return web.json_response({
+            'killmail_id': kill_id,
+            'killmail_time': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'solar_system_id': 30000142,
+            'victim': {'ship_type_id': 670, 'character_id': 90000000 + kill_id % 1000, 'corporation_id': 98000001},
+            'attackers': [{'character_id': 91000000 + i, 'corporation_id': 98000002, 'ship_type_id': 587,
+                           'final_blow': i == 0} for i in range(5)]
+        })
+
+    async def system(self, request):
+        return web.json_response({'name': 'Jita', 'constellation_id': 20000020})
+
+    async def constellation(self, request):
+        return web.json_response({'region_id': REGION_ID})
+
+    async def named(self, request):
+        return web.json_response({'name': f"{request.match_info['path'].split('/')[-1]} {request.match_info['id']}"})
+
+    async def feed(self, request):
+        self.articles += 1
+        items = ''.join(f"<item><title>Patch notes {n}</title><link>https://example.invalid/news/{n}</link>"
+                        f"<pubDate>Mon, 01 Jan 2024 00:00:00 GMT</pubDate></item>"
+                        for n in range(self.articles, max(0, self.articles - 10), -1))
+        return web.Response(text=f'<?xml version="1.0"?><rss version="2.0"><channel><title>Stub</title>{items}</channel></rss>',
+                            content_type='application/rss+xml')
@@ -0,0 +1,226 @@
+"""Offline load test of the real cogs under a configurable command mix.
+
+Loads the cogs into a FakeBot in a temporary directory with its own
+chuck.db, points ESI, zKillboard and the news feed at a local stub, and
+fires commands and reaction votes at a fixed rate. Arrivals are scheduled
+up front (open loop), so latency includes any time spent waiting behind
+a slow event loop. Reports throughput, p50/p95/p99 latency and SQLite
+time per command, and event loop lag.
+
+    python bench/load_test.py --rate 300 --duration 20 --mix time=4,jokeschuck=3,remind=2,vote=3
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Read by the cogs and utils at import time.
+os.environ.setdefault('GUILD_ID', '1000')
+os.environ.setdefault('KILL_INGEST_MODE', 'inline')
+os.environ.setdefault('METRICS_ENABLED', 'True')
+
+from discord import app_commands
+from bench.fakes import ADMIN_USER_ID, GUILD_ID, REGION_ID, FakeBot, StubUpstream, invoke, reaction_payload
+from utils import metrics
+
+COGS = ['cogs.ratelimit_cog', 'cogs.time_cog', 'cogs.remind_cog', 'cogs.news_cog', 'cogs.poll_cog',
+        'cogs.chuck_jokes_cog', 'cogs.zkillboard_cog', 'cogs.timer_cog', 'cogs.settings_cog']
+COMMAND_CHANNEL_ID = 5000
+KILLS_CHANNEL_ID = 5001
+NEWS_CHANNEL_ID = 5002
+POLLS = 20
+POLL_EMOJIS = ['1️⃣', '2️⃣', '3️⃣', '4️⃣']
+ZONES = ['Europe/Berlin', 'US Eastern', 'AEST', 'UTC']
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.bot = None
+        self.upstream = StubUpstream()
+        self.polls = []
+        self.results = {}
+        self.lag = []
+        self.in_flight = set()
+
+    async def setup(self):
+        self.bot = FakeBot(send_latency=self.args.send_latency / 1000)
+        await self.bot.setup()
+        settings = self.bot.settings
+        settings.set(GUILD_ID, 'admin_user_id', str(ADMIN_USER_ID))
+        settings.set(GUILD_ID, 'kills_channel_id', str(KILLS_CHANNEL_ID))
+        settings.set(GUILD_ID, 'region_ids', str(REGION_ID))
+        settings.set(GUILD_ID, 'min_value', '0')
+
+        for cog in COGS:
+            await self.bot.load_extension(cog)
+        await self.upstream.start()
+        self.upstream.patch_modules()
+        self.bot.ready.set()
+
+        admin = self.bot.get_user(ADMIN_USER_ID)
+        channel = self.bot.channel(COMMAND_CHANNEL_ID)
+        await invoke(self.bot, 'add_feed', admin, channel, source='stub', url=self.upstream.feed_url,
+                     channel=self.bot.channel(NEWS_CHANNEL_ID))
+        poll_cog = self.bot.get_cog('PollCog')
+        for n in range(POLLS):
+            await invoke(self.bot, 'create_poll', self.bot.get_user(3 + n), channel, duration='1h',
+                         question=f"Question {n}?", option1='Yes', option2='No', option3='Maybe', option4='Later')
+        poll_cog.cursor.execute('SELECT message_id FROM polls')
+        self.polls = [row['message_id'] for row in poll_cog.cursor.fetchall()]
+
+    def user(self):
+        return self.bot.get_user(10_000 + self.rng.randrange(self.args.users))
+
+    def request(self, kind, sequence):
+        """A coroutine factory for one operation of the given kind."""
+        bot = self.bot
+        channel = bot.channel(COMMAND_CHANNEL_ID)
+        user = self.user()
+        if kind == 'time':
+            return lambda: invoke(bot, 'time', user, channel)
+        if kind == 'time_zone':
+            return lambda: invoke(bot, 'time', user, channel, zone=self.rng.choice(ZONES))
+        if kind == 'jokeschuck':
+            return lambda: invoke(bot, 'jokeschuck', user, channel)
+        if kind == 'remind':
+            return lambda: invoke(bot, 'remind', user, channel, time=f"{self.rng.randint(1, 48)}h", message=f"Reminder {sequence}")
+        if kind == 'vote':
+            payload = reaction_payload(user.id, COMMAND_CHANNEL_ID, self.rng.choice(self.polls), self.rng.choice(POLL_EMOJIS))
+            return lambda: bot.get_cog('PollCog').on_raw_reaction_add(payload)
+        raise ValueError(f"Unknown operation {kind!r}")
+
+    async def run_one(self, kind, scheduled, call):
+        spent = [0.0, 0]
+        token = metrics.db_time.set(spent)
+        try:
+            await call()
+            status = 'ok'
+        except app_commands.CheckFailure:
+            status = 'throttled'
+        except Exception as e:
+            logging.debug(f"{kind} failed: {e}")
+            status = 'error'
+        finally:
+            metrics.db_time.reset(token)
+        result = self.results.setdefault(kind, {'latency': [], 'db': [], 'ok': 0, 'throttled': 0, 'error': 0})
+        result[status] += 1
+        result['latency'].append(time.perf_counter() - scheduled)
+        result['db'].append(spent[0])
+
+    async def sample_lag(self, interval=0.01):
+        while True:
+            expected = time.perf_counter() + interval
+            await asyncio.sleep(interval)
+            self.lag.append(max(0.0, time.perf_counter() - expected))
+
+    async def fire(self):
+        mix = parse_mix(self.args.mix)
+        kinds, weights = list(mix), list(mix.values())
+        total = int(self.args.rate * self.args.duration)
+        started = time.perf_counter()
+        for sequence in range(total):
+            scheduled = started + sequence / self.args.rate
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            kind = self.rng.choices(kinds, weights)[0]
+            task = asyncio.create_task(self.run_one(kind, scheduled, self.request(kind, sequence)))
+            self.in_flight.add(task)
+            task.add_done_callback(self.in_flight.discard)
+        if self.in_flight:
+            await asyncio.wait(self.in_flight, timeout=self.args.drain)
+        return time.perf_counter() - started
+
+    async def run(self):
+        workdir = tempfile.mkdtemp(prefix='chuck-load-')
+        shutil.copy(os.path.join(ROOT, 'chuck_norris_jokes.db'), workdir)
+        os.chdir(workdir)
+        try:
+            await self.setup()
+            lag_task = asyncio.create_task(self.sample_lag())
+            elapsed = await self.fire()
+            lag_task.cancel()
+            return self.report(elapsed)
+        finally:
+            await self.upstream.stop()
+            if self.bot:
+                for cog in list(self.bot.extensions):
+                    await self.bot.unload_extension(cog)
+                await self.bot.close()
+            os.chdir(ROOT)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def report(self, elapsed):
+        completed = sum(len(result['latency']) for result in self.results.values())
+        return {
+            'rate': self.args.rate,
+            'duration': round(elapsed, 2),
+            'throughput': round(completed / elapsed, 1),
+            'loop_lag_ms': {'p50': round(percentile(self.lag, 0.5) * 1000, 2), 'p99': round(percentile(self.lag, 0.99) * 1000, 2),
+                            'max': round(max(self.lag, default=0) * 1000, 2)},
+            'upstream_requests': self.upstream.requests,
+            'messages_sent': self.bot.sent,
+            'commands': {kind: {
+                'count': len(result['latency']),
+                'ok': result['ok'], 'throttled': result['throttled'], 'errors': result['error'],
+                'p50_ms': round(percentile(result['latency'], 0.5) * 1000, 2),
+                'p95_ms': round(percentile(result['latency'], 0.95) * 1000, 2),
+                'p99_ms': round(percentile(result['latency'], 0.99) * 1000, 2),
+                'db_ms_mean': round(sum(result['db']) / len(result['db']) * 1000, 3)
+            } for kind, result in sorted(self.results.items())}
+        }
+
+def print_report(report):
+    print(f"Offered {report['rate']}/s for {report['duration']}s, completed {report['throughput']}/s; "
+          f"{report['upstream_requests']} stub upstream requests, {report['messages_sent']} messages sent")
+    lag = report['loop_lag_ms']
+    print(f"Event loop lag: p50 {lag['p50']} ms, p99 {lag['p99']} ms, max {lag['max']} ms")
+    print(f"{'command':<12} {'count':>7} {'ok':>7} {'throttled':>9} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'db ms':>7}")
+    for kind, result in report['commands'].items():
+        print(f"{kind:<12} {result['count']:>7} {result['ok']:>7} {result['throttled']:>9} {result['errors']:>6} "
+              f"{result['p50_ms']:>8} {result['p95_ms']:>8} {result['p99_ms']:>8} {result['db_ms_mean']:>7}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rate', type=float, default=200, help="Operations per second")
+    parser.add_argument('--duration', type=float, default=10, help="Seconds to fire for")
+    parser.add_argument('--mix', default='time=4,jokeschuck=3,remind=2,vote=3',
+                        help="Weighted operations: time, time_zone, jokeschuck, remind, vote")
+    parser.add_argument('--users', type=int, default=5000, help="Distinct simulated users")
+    parser.add_argument('--send-latency', type=float, default=20, help="Simulated Discord REST latency in ms")
+    parser.add_argument('--drain', type=float, default=30, help="Seconds to wait for in-flight operations at the end")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON, for comparing versions")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    report = asyncio.run(LoadTest(args).run())
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+if __name__ == '__main__':
+    main()
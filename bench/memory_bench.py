@@ -0,0 +1,149 @@
+"""Resident memory of the gateway cache under each cache profile.
+
+Feeds discord.py's connection state the events a guild of N members would
+send: GUILD_CREATE, member chunks when the profile chunks, then a stream
+of messages, reactions and typing events. Only events the profile's
+intents subscribe to are delivered, as the gateway would. Each profile
+runs in its own process so the RSS numbers don't mix.
+
+    python bench/memory_bench.py --members 50000 --messages 20000
+"""
+import argparse
+import asyncio
+import gc
+import glob
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import discord
+from utils import gateway
+
+GUILD_ID = 1000
+BOT_ID = 1
+CHANNELS = 50
+EMOJIS = 200
+VOICE_SHARE = 0.02
+TIMESTAMP = '2024-01-01T00:00:00+00:00'
+
+def rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Peak rather than current, but the best we get outside Linux.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def all_cogs():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return sorted(f"cogs.{os.path.basename(path)[:-3]}" for path in glob.glob(os.path.join(root, 'cogs', '*.py'))
+                  if not path.endswith('__init__.py'))
+
+def user(user_id):
+    return {'id': str(user_id), 'username': f'pilot{user_id}', 'discriminator': '0', 'global_name': f'Pilot {user_id}', 'avatar': None}
+
+def member(user_id):
+    return {'user': user(user_id), 'roles': [], 'joined_at': TIMESTAMP, 'deaf': False, 'mute': False, 'flags': 0}
+
+def guild_create(members, intents):
+    voice_ids = range(BOT_ID + 1, BOT_ID + 1 + int(members * VOICE_SHARE)) if intents.voice_states else ()
+    return {
+        'id': str(GUILD_ID), 'name': 'Simulated', 'owner_id': str(BOT_ID + 1), 'member_count': members,
+        'large': members > 250, 'unavailable': False, 'features': [], 'premium_tier': 0,
+        'roles': [{'id': str(GUILD_ID), 'name': '@everyone', 'permissions': '0', 'position': 0, 'color': 0,
+                   'hoist': False, 'managed': False, 'mentionable': False}],
+        'channels': [{'id': str(GUILD_ID + 1 + i), 'type': 0, 'name': f'channel-{i}', 'position': i,
+                      'permission_overwrites': []} for i in range(CHANNELS)],
+        'emojis': [{'id': str(GUILD_ID + 10000 + i), 'name': f'emoji{i}', 'roles': [], 'require_colons': True,
+                    'managed': False, 'animated': False, 'available': True} for i in range(EMOJIS)],
+        # Without the presences intent only the bot itself and members in voice are sent.
+        'members': [member(BOT_ID)] + [member(user_id) for user_id in voice_ids],
+        'voice_states': [{'user_id': str(user_id), 'channel_id': str(GUILD_ID + 1), 'session_id': 'x', 'deaf': False,
+                          'mute': False, 'self_deaf': False, 'self_mute': False, 'suppress': False} for user_id in voice_ids],
+        'threads': [], 'stickers': [], 'stage_instances': [], 'guild_scheduled_events': []
+    }
+
+def message_create(message_id, author_id):
+    return {
+        'id': str(message_id), 'channel_id': str(GUILD_ID + 1 + message_id % CHANNELS), 'guild_id': str(GUILD_ID),
+        'author': user(author_id), 'member': {key: value for key, value in member(author_id).items() if key != 'user'},
+        'content': 'o7 ' * 20, 'timestamp': TIMESTAMP, 'edited_timestamp': None, 'tts': False, 'mention_everyone': False,
+        'mentions': [], 'mention_roles': [], 'attachments': [], 'embeds': [], 'pinned': False, 'type': 0
+    }
+
+async def simulate(profile, members, messages):
+    options = gateway.client_options(all_cogs(), profile)
+    client = discord.Client(**options)
+    state = client._connection
+    intents = state.intents
+    state.user = discord.ClientUser(state=state, data=user(BOT_ID))
+    gc.collect()
+    baseline = rss_mb()
+
+    state.parse_guild_create(guild_create(members, intents))
+    guild = state._get_guild(GUILD_ID)
+    # What a startup chunk request would bring back, when the profile chunks.
+    if intents.members and state._chunk_guilds and state.member_cache_flags.joined:
+        for user_id in range(BOT_ID + 1, BOT_ID + 1 + members):
+            guild._add_member(discord.Member(data=member(user_id), guild=guild, state=state))
+
+    rng = random.Random(0)
+    for message_id in range(1, messages + 1):
+        author_id = rng.randint(BOT_ID + 1, BOT_ID + members)
+        channel_id = str(GUILD_ID + 1 + message_id % CHANNELS)
+        if intents.guild_messages:
+            state.parse_message_create(message_create(message_id, author_id))
+        if intents.guild_reactions and message_id % 4 == 0:
+            state.parse_message_reaction_add({'user_id': str(author_id), 'channel_id': channel_id, 'message_id': str(message_id),
+                                              'guild_id': str(GUILD_ID), 'emoji': {'id': None, 'name': '👍'}, 'type': 0,
+                                              'burst': False, 'member': member(author_id)})
+        if intents.guild_typing and message_id % 2 == 0:
+            state.parse_typing_start({'user_id': str(author_id), 'channel_id': channel_id, 'guild_id': str(GUILD_ID),
+                                      'timestamp': 0, 'member': member(author_id)})
+        if message_id % 1000 == 0:
+            await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    gc.collect()
+
+    return {
+        'profile': profile,
+        'intents': [name for name, enabled in intents if enabled],
+        'rss_mb': round(rss_mb(), 1),
+        'cache_mb': round(rss_mb() - baseline, 1),
+        'cached_members': len(guild._members),
+        'cached_users': len(state._users),
+        'cached_messages': len(state._messages) if state._messages is not None else 0
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--members', type=int, default=50000)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--profiles', default='lean,full', help="Comma separated cache profiles to compare")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(simulate(args.child, args.members, args.messages))))
+        return
+
+    print(f"Simulated guild: {args.members:,} members, {args.messages:,} messages")
+    print(f"{'profile':<8} {'RSS MB':>8} {'cache MB':>9} {'members':>8} {'users':>8} {'messages':>9}  intents")
+    for profile in args.profiles.split(','):
+        output = subprocess.run([sys.executable, __file__, '--child', profile, '--members', str(args.members),
+                                 '--messages', str(args.messages)], capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{result['profile']:<8} {result['rss_mb']:>8} {result['cache_mb']:>9} {result['cached_members']:>8} "
+              f"{result['cached_users']:>8} {result['cached_messages']:>9}  {', '.join(result['intents'])}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+"""Timer, reminder and poll schedulers under a large backlog, in virtual time.
+
+Loads the timer, remind and poll cogs into a FakeBot running on a
+VirtualClock, bulk-inserts the backlog into a temporary chuck.db with due
+times spread over the horizon, then fast-forwards through it by calling
+check_timers, check_reminders and check_expired_polls at their loop
+intervals. Real time spent inside a check is added to the virtual clock,
+so a check that can't keep up delays the next one as tasks.loop would.
+Outbound sends go straight to the fakes, bypassing the rate-limit pacing.
+A share of the timers and reminders can repeat (--recurring), to check
+that rows are rescheduled in place rather than piling up. Reports
+dispatch throughput, lateness against each item's due time, resident
+memory, SQLite statements per check and the rows left at the end.
+
+    python bench/scheduler_bench.py --timers 1000000 --reminders 1000000 --hours 24
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('GUILD_ID', '1000')
+os.environ.setdefault('METRICS_ENABLED', 'True')
+
+from bench.fakes import FakeBot
+from bench.memory_bench import rss_mb
+from bench.load_test import percentile
+from utils import metrics
+from utils.clock import VirtualClock
+from utils.outbound import OutboundQueue
+from utils.recurrence import Recurrence
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp()
+CHANNEL_ID = 5000
+BATCH = 50000
+# The due time, and the interval of repeating items, travel in the label,
+# message or question, so a delivery can be matched to its occurrence.
+DUE = re.compile(r'due=(\d+)(?: every=(\d+))?')
+
+class DirectOutbound:
+    """OutboundQueue's interface without the pacing: every send happens immediately."""
+
+    def __init__(self):
+        self.dm_channels = OrderedDict()
+
+    # Opens and caches DM channels the same way, then sends through submit() below.
+    send_dm = OutboundQueue.send_dm
+
+    def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def send(self, kind, destination, *args, **kwargs):
+        return await destination.send(*args, **kwargs)
+
+    async def submit(self, kind, route, send):
+        return await send()
+
+class Check:
+    def __init__(self, kind, cog, loop, interval):
+        self.kind = kind
+        self.cog = cog
+        self.loop = loop
+        self.interval = interval
+        self.next_at = START + interval
+        self.runs = 0
+        self.seconds = []
+        self.statements = []
+        self.db_seconds = 0.0
+
+class SchedulerBench:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.clock = VirtualClock(START)
+        self.bot = None
+        self.checks = []
+        self.lateness = {'timer': [], 'reminder': [], 'poll': []}
+        self.tick_started = 0.0
+
+    def on_send(self, destination, args, kwargs):
+        embed = kwargs.get('embed')
+        if embed is not None:
+            text = ' '.join([embed.description or ''] + [field.value for field in embed.fields])
+            kind = 'poll' if embed.title == "Poll Results" else 'timer'
+        else:
+            text, kind = args[0], 'reminder'
+        match = DUE.search(text)
+        if match:
+            # Virtual time at the tick plus real time spent in it so far.
+            sent_at = self.clock.time() + time.perf_counter() - self.tick_started
+            late = sent_at - int(match.group(1))
+            if match.group(2):
+                late %= int(match.group(2))
+            self.lateness[kind].append(late)
+
+    def due_times(self, count):
+        horizon = self.args.hours * 3600
+        return (int(START + self.rng.uniform(1, horizon)) for _ in range(count))
+
+    def insert(self, conn, sql, rows):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= BATCH:
+                conn.executemany(sql, batch)
+                batch.clear()
+        if batch:
+            conn.executemany(sql, batch)
+        conn.commit()
+
+    def recurring(self, n, count):
+        """The label suffix and recurrence column for the nth of count items."""
+        if n >= count * self.args.recurring:
+            return '', None
+        return f" every={self.args.repeat_every}", Recurrence(every=self.args.repeat_every).dumps()
+
+    def load_backlog(self):
+        users = self.args.users
+        conn = self.bot.get_cog('TimerCog').conn
+        started = time.perf_counter()
+        naive = lambda due: datetime.fromtimestamp(due, timezone.utc).replace(tzinfo=None)
+        timers, reminders = self.args.timers, self.args.reminders
+        self.insert(conn, '''INSERT INTO timers (user_id, channel_id, duration, start_time, end_time, label, recurrence)
+                             VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                    ((10_000 + n % users, CHANNEL_ID, int(due - START), naive(START), naive(due), f"due={due}{suffix}", recurrence)
+                     for n, due in enumerate(self.due_times(timers)) for suffix, recurrence in [self.recurring(n, timers)]))
+        self.insert(conn, 'INSERT INTO reminders (user_id, channel_id, message, remind_time, dm, recurrence) VALUES (?, ?, ?, ?, ?, ?)',
+                    ((10_000 + n % users, None, f"due={due}{suffix}", datetime.fromtimestamp(due, timezone.utc), True, recurrence)
+                     for n, due in enumerate(self.due_times(reminders)) for suffix, recurrence in [self.recurring(n, reminders)]))
+        options = str({'1️⃣': 'Yes', '2️⃣': 'No'})
+        self.insert(conn, '''INSERT INTO polls (creator_id, question, options, created_at, expires_at, message_id, channel_id)
+                             VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                    ((10_000 + n % users, f"due={due}", options, naive(START), naive(due), 10 ** 17 + n, CHANNEL_ID)
+                     for n, due in enumerate(self.due_times(self.args.polls))))
+        self.insert(conn, 'INSERT INTO votes (poll_id, user_id, option) VALUES (?, ?, ?)',
+                    ((poll_id, 10_000 + voter, 'Yes' if voter % 3 else 'No')
+                     for poll_id in range(1, self.args.polls + 1) for voter in range(self.args.votes)))
+        return time.perf_counter() - started
+
+    async def setup(self):
+        self.bot = FakeBot(clock=self.clock)
+        self.bot.outbound = DirectOutbound()
+        self.bot.on_send = self.on_send
+        await self.bot.setup()
+        # The loops wait for a ready that never comes; the bench drives the checks itself.
+        for cog in ('cogs.timer_cog', 'cogs.remind_cog', 'cogs.poll_cog'):
+            await self.bot.load_extension(cog)
+        timer, remind, poll = (self.bot.get_cog(name) for name in ('TimerCog', 'RemindCog', 'PollCog'))
+        self.checks = [
+            Check('timer', timer, timer.check_timers, timer.check_timers.seconds + 60 * timer.check_timers.minutes),
+            Check('reminder', remind, remind.check_reminders, 60 * remind.check_reminders.minutes),
+            Check('poll', poll, poll.check_expired_polls, 60 * poll.check_expired_polls.minutes)
+        ]
+
+    async def fast_forward(self):
+        end = START + self.args.hours * 3600 + max(check.interval for check in self.checks)
+        while True:
+            check = min(self.checks, key=lambda check: check.next_at)
+            if check.next_at > end:
+                return
+            self.clock.set(max(self.clock.time(), check.next_at))
+            spent = [0.0, 0]
+            token = metrics.db_time.set(spent)
+            self.tick_started = time.perf_counter()
+            try:
+                await check.loop()
+            finally:
+                metrics.db_time.reset(token)
+            elapsed = time.perf_counter() - self.tick_started
+            self.clock.advance(elapsed)
+            check.runs += 1
+            check.seconds.append(elapsed)
+            check.statements.append(spent[1])
+            check.db_seconds += spent[0]
+            # An overrunning check runs again straight away rather than skipping ahead.
+            check.next_at = max(check.next_at + check.interval, self.clock.time())
+
+    async def run(self):
+        workdir = tempfile.mkdtemp(prefix='chuck-sched-')
+        os.chdir(workdir)
+        try:
+            await self.setup()
+            load_seconds = self.load_backlog()
+            rss_loaded = rss_mb()
+            started = time.perf_counter()
+            await self.fast_forward()
+            return self.report(time.perf_counter() - started, load_seconds, rss_loaded)
+        finally:
+            if self.bot:
+                for cog in list(self.bot.extensions):
+                    await self.bot.unload_extension(cog)
+                await self.bot.close()
+            os.chdir(ROOT)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def rows_left(self):
+        conn = self.bot.get_cog('TimerCog').conn
+        return {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table in ('timers', 'reminders', 'polls')}
+
+    def report(self, wall, load_seconds, rss_loaded):
+        dispatched = sum(len(values) for values in self.lateness.values())
+        return {
+            'backlog': {'timers': self.args.timers, 'reminders': self.args.reminders, 'polls': self.args.polls},
+            'recurring': self.args.recurring,
+            'rows_left': self.rows_left(),
+            'virtual_hours': self.args.hours,
+            'load_seconds': round(load_seconds, 2),
+            'wall_seconds': round(wall, 2),
+            'dispatched': dispatched,
+            'dispatch_per_second': round(dispatched / wall, 1) if wall else 0.0,
+            'rss_mb': {'loaded': round(rss_loaded, 1), 'end': round(rss_mb(), 1)},
+            'checks': {check.kind: {
+                'runs': check.runs,
+                'dispatched': len(self.lateness[check.kind]),
+                'late_p50_s': round(percentile(self.lateness[check.kind], 0.5), 2),
+                'late_p95_s': round(percentile(self.lateness[check.kind], 0.95), 2),
+                'late_p99_s': round(percentile(self.lateness[check.kind], 0.99), 2),
+                'late_max_s': round(max(self.lateness[check.kind], default=0.0), 2),
+                'check_p99_ms': round(percentile(check.seconds, 0.99) * 1000, 2),
+                'check_max_ms': round(max(check.seconds, default=0.0) * 1000, 2),
+                'statements': sum(check.statements),
+                'statements_per_run': round(sum(check.statements) / check.runs, 1) if check.runs else 0.0,
+                'db_seconds': round(check.db_seconds, 2)
+            } for check in self.checks}
+        }
+
+def print_report(report):
+    backlog = report['backlog']
+    print(f"Backlog: {backlog['timers']:,} timers, {backlog['reminders']:,} reminders, {backlog['polls']:,} polls "
+          f"over {report['virtual_hours']}h of virtual time, {report['recurring']:.0%} repeating; loaded in {report['load_seconds']}s")
+    print(f"Dispatched {report['dispatched']:,} in {report['wall_seconds']}s ({report['dispatch_per_second']:,}/s); "
+          f"RSS {report['rss_mb']['loaded']} MB loaded, {report['rss_mb']['end']} MB at the end")
+    print("Rows left: " + ', '.join(f"{count:,} {table}" for table, count in report['rows_left'].items()))
+    print(f"{'check':<9} {'runs':>6} {'sent':>8} {'late p50':>9} {'p95':>7} {'p99':>7} {'max s':>7} "
+          f"{'run p99 ms':>10} {'max ms':>8} {'stmts':>9} {'per run':>8} {'db s':>7}")
+    for kind, check in report['checks'].items():
+        print(f"{kind:<9} {check['runs']:>6} {check['dispatched']:>8} {check['late_p50_s']:>9} {check['late_p95_s']:>7} "
+              f"{check['late_p99_s']:>7} {check['late_max_s']:>7} {check['check_p99_ms']:>10} {check['check_max_ms']:>8} "
+              f"{check['statements']:>9} {check['statements_per_run']:>8} {check['db_seconds']:>7}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--timers', type=int, default=1_000_000)
+    parser.add_argument('--reminders', type=int, default=1_000_000)
+    parser.add_argument('--polls', type=int, default=10_000)
+    parser.add_argument('--recurring', type=float, default=0.0, help="Share of timers and reminders that repeat")
+    parser.add_argument('--repeat-every', type=int, default=6 * 3600, help="Seconds between repeats")
+    parser.add_argument('--votes', type=int, default=5, help="Votes per poll")
+    parser.add_argument('--users', type=int, default=50_000, help="Distinct owners, spread round-robin")
+    parser.add_argument('--hours', type=float, default=24, help="Virtual time the due times are spread over")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON, for comparing versions")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    report = asyncio.run(SchedulerBench(args).run())
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+if __name__ == '__main__':
+    main()
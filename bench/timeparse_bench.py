@@ -0,0 +1,100 @@
+"""Cost of parsing /remind, /start_timer and /create_poll time expressions.
+
+Times utils.timeparse.parse_when over a corpus of realistic inputs,
+uncached (every call compiles the expression) and through the LRU cache.
+Before timing, it checks randomly generated expressions against their
+expected results, so a parser change that is fast but wrong does not pass
+unnoticed.
+
+    python bench/timeparse_bench.py --calls 200000 --checks 20000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytz
+from utils import timeparse
+from utils.timeparse import UNITS, compile_expression, parse_duration, parse_when
+
+CORPUS = ['10m', '1h', '2h30m', '30 minutes', '1 day 4 hours', '90s', '2 weeks', '1h and 15m', 'in 45 min', '3M',
+          'at 18:00 EVE', 'at 19:30', 'tomorrow 11:00', 'after downtime', 'downtime', '8pm CET', 'tomorrow at 9am US TZ',
+          '2030-06-01 20:00 Europe/Berlin']
+ZONES = ['EVE', 'UTC', 'CET', 'US TZ', 'AU TZ', 'Europe/Berlin', 'America/New_York']
+
+def random_now(rng):
+    return datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=rng.randrange(3 * 365 * 86400))
+
+def check_durations(rng, count):
+    """A compound duration in any unit spelling and separator adds up to the sum of its parts."""
+    failures = 0
+    for _ in range(count):
+        parts, expected = [], 0
+        for name in rng.sample(list(UNITS), rng.randint(1, 4)):
+            size, aliases = UNITS[name]
+            value = rng.randint(1, 30)
+            alias = rng.choice(aliases)
+            parts.append(f"{value}{rng.choice(['', ' '])}{alias.upper() if rng.random() < 0.2 and alias != 'm' else alias}")
+            expected += value * size
+        text = rng.choice([' ', '', ', ', ' and ']).join(parts)
+        try:
+            delta, _ = parse_duration(text)
+        except ValueError:
+            if expected <= timeparse.MAX_AHEAD.total_seconds():
+                failures += 1
+            continue
+        failures += delta.total_seconds() != expected
+    return failures
+
+def check_clock_times(rng, count):
+    """An undated time of day is the next occurrence of that wall-clock time in its zone."""
+    failures = 0
+    for _ in range(count):
+        now = random_now(rng)
+        hour, minute, zone = rng.randrange(24), rng.randrange(60), rng.choice(ZONES)
+        at, _ = parse_when(f"at {hour:02d}:{minute:02d} {zone}", now)
+        tz = pytz.timezone(timeparse.ALIASES.get(zone, zone))
+        local = at.astimezone(tz)
+        try:
+            tz.localize(local.replace(hour=hour, minute=minute, tzinfo=None), is_dst=None)
+            exists = True
+        except pytz.exceptions.InvalidTimeError:
+            # Skipped or repeated by a DST change; the parser picks one reading.
+            exists = False
+        in_future = now < at <= now + timedelta(days=1, hours=1)
+        failures += not in_future or (exists and (local.hour, local.minute) != (hour, minute))
+    return failures
+
+def time_calls(parse, calls):
+    started = time.perf_counter()
+    for n in range(calls):
+        parse(CORPUS[n % len(CORPUS)])
+    return (time.perf_counter() - started) / calls * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=200000)
+    parser.add_argument('--checks', type=int, default=20000, help="Random expressions to verify before timing")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    failures = check_durations(rng, args.checks) + check_clock_times(rng, args.checks)
+    print(f"Checked {2 * args.checks:,} random expressions: {failures} failures")
+
+    now = datetime(2024, 3, 30, 12, 36, 48, tzinfo=timezone.utc)
+    uncached = time_calls(compile_expression.__wrapped__, args.calls)
+    compile_expression.cache_clear()
+    cached = time_calls(compile_expression, args.calls)
+    # Resolving against the clock is never cached; this is what a command pays.
+    resolved = time_calls(lambda text: parse_when(text, now), args.calls)
+    print(f"Per expression: {uncached:.2f} us to compile, {cached:.2f} us from the cache, "
+          f"{resolved:.2f} us for parse_when including resolving against the clock")
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -1,60 +1,229 @@
 import discord
 import logging
 import asyncio
+import hashlib
+import importlib
+import json
 import signal
+import time
 from discord.ext import commands
+from discord import app_commands
 from decouple import config
+from utils import gateway, logsetup, loopmon, metrics, profiling
+from utils.clock import Clock
+from utils.cluster import Cluster
+from utils.outbound import OutboundQueue
+from utils.ratelimit import RateLimited
+from utils.settings import GuildSettings
+from utils.snapshot import Snapshot
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+log_listener = logsetup.setup_logging()
 logger = logging.getLogger()
 
 try:
     bot_token = config('BOT_TOKEN')
     guild_id = int(config('GUILD_ID'))
-    allowed_channel_id = int(config('ALLOWED_CHANNEL_ID'))
-    news_channel_id = int(config('NEWS_CHANNEL_ID'))
 except Exception as e:
     logger.error(f"Configuration error: {e}")
     exit(1)
 
-intents = discord.Intents.default()
-intents.message_content = True  
-intents.guilds = True  
-intents.dm_messages = True  
-
-bot = commands.Bot(command_prefix='!', intents=intents)
-
-async def load_cogs():
-    await bot.wait_until_ready()
-    cogs = [
-        'cogs.ping', 
-        'cogs.time_cog', 
-        'cogs.remind_cog', 
-        'cogs.news_cog', 
-        'cogs.poll_cog', 
-        'cogs.help_cog',
-        'cogs.chuck_jokes_cog',
-        'cogs.zkillboard_cog', 
-        'cogs.confess_cog',
-        'cogs.timer_cog'
-    ]
-    for cog in cogs:
-        if cog not in bot.extensions:
+COGS = [
+    'cogs.ratelimit_cog',
+    'cogs.ping', 
+    'cogs.time_cog', 
+    'cogs.remind_cog', 
+    'cogs.news_cog', 
+    'cogs.poll_cog', 
+    'cogs.help_cog',
+    'cogs.chuck_jokes_cog',
+    'cogs.zkillboard_cog', 
+    'cogs.confess_cog',
+    'cogs.timer_cog',
+    'cogs.profile_cog',
+    'cogs.settings_cog'
+]
+
+COMMAND_HASH_FILE = config('COMMAND_HASH_FILE', default='.command_tree_hash')
+
+class ChuckTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction):
+        # Stamp every interaction so completion and error handlers can time it.
+        interaction.extras['started'] = time.perf_counter()
+        command = interaction.command
+        if command is not None:
+            cog = type(command.binding).__name__ if command.binding else 'bot'
+            label = f"{cog}:{command.qualified_name}"
+            loopmon.mark(label)
+            interaction.extras['profile'] = profiling.begin(label)
+        return True
+
+def observe_command(interaction, status):
+    started = interaction.extras.get('started')
+    if started is None or interaction.command is None:
+        return
+    metrics.registry.observe('command_seconds', time.perf_counter() - started,
+                             help_text="Slash command latency", command=interaction.command.qualified_name, status=status)
+
+cluster = Cluster()
+
+# With SHARD_COUNT set, each process runs the shards in SHARD_IDS.
+BotBase = commands.AutoShardedBot if cluster.enabled else commands.Bot
+
+class ChuckBot(BotBase):
+    def __init__(self, *args, cluster, **kwargs):
+        super().__init__(*args, **cluster.bot_options(), **kwargs)
+        self.cluster = cluster
+        # Time-based cogs read the time from here; benches swap in a VirtualClock.
+        self.clock = Clock()
+        self.cog_load_times = {}
+        self.startup_banner_shown = False
+        self.metrics_runner = None
+        self.loop_monitor = None
+        self.outbound = None
+        self.settings = None
+        self.snapshot = None
+        self.leader_sync_task = None
+
+    async def setup_hook(self):
+        # Runs once after login and before the gateway connects, so
+        # reconnects never reload cogs or resync commands.
+        self.cluster.start()
+        if loopmon.LOOP_MONITOR_ENABLED:
+            self.loop_monitor = loopmon.LoopMonitor(registry=metrics.registry)
+            self.loop_monitor.start()
+        metrics.instrument_discord_http(self.http)
+        try:
+            self.metrics_runner = await metrics.start_server()
+        except OSError as e:
+            logger.error(f"Could not start the metrics endpoint: {e}")
+        # Cogs read their configuration and send through these, so they have to exist before they load.
+        self.settings = GuildSettings()
+        self.outbound = OutboundQueue()
+        self.outbound.start()
+        # Read before the cogs load so their caches start warm.
+        self.snapshot = Snapshot()
+        await self.load_cogs()
+        self.snapshot.start()
+        await self.sync_commands()
+        if self.cluster.enabled:
+            self.leader_sync_task = asyncio.create_task(self.sync_on_leadership())
+
+    async def close(self):
+        if self.leader_sync_task:
+            self.leader_sync_task.cancel()
+        # Save while the cogs, and so their caches, are still loaded.
+        if self.snapshot:
+            self.snapshot.stop()
+        if self.outbound:
+            await self.outbound.stop()
+        if self.loop_monitor:
+            self.loop_monitor.stop()
+        if self.metrics_runner:
+            await self.metrics_runner.cleanup()
+        await self.cluster.stop()
+        await super().close()
+        if self.settings:
+            self.settings.close()
+
+    async def load_cogs(self):
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+
+        # Importing is the slow part (feedparser, aiohttp, pytz...). Warm the
+        # module cache in worker threads; the import lock keeps this safe.
+        import_times = {}
+
+        def warm_import(name):
+            import_started = time.perf_counter()
+            try:
+                importlib.import_module(name)
+            except Exception as e:
+                logger.error(f'Error importing {name}: {e}')
+            import_times[name] = time.perf_counter() - import_started
+
+        await asyncio.gather(*(loop.run_in_executor(None, warm_import, cog) for cog in COGS))
+
+        for cog in COGS:
+            if cog in self.extensions:
+                continue
+            load_started = time.perf_counter()
             try:
-                await bot.load_extension(cog)
-                logger.info(f'{cog} loaded')
+                await self.load_extension(cog)
+                self.cog_load_times[cog] = import_times.get(cog, 0) + time.perf_counter() - load_started
+                logger.info(f'{cog} loaded in {self.cog_load_times[cog] * 1000:.0f} ms')
                 print(f'{cog} loaded')
             except Exception as e:
                 logger.error(f'Error loading {cog}: {e}')
                 print(f'Error loading {cog}: {e}')
 
+        logger.info(f'Loaded {len(self.extensions)} cogs in {(time.perf_counter() - started) * 1000:.0f} ms')
+
+    def command_tree_hash(self, guild):
+        payload = sorted((command.to_dict(self.tree) for command in self.tree.get_commands(guild=guild)),
+                         key=lambda command: (command.get('type', 1), command['name']))
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+    async def sync_on_leadership(self):
+        """Sync from whichever node becomes leader; at boot the old leader usually still holds the lease."""
+        while True:
+            await self.cluster.wait_for_change()
+            if self.cluster.is_leader:
+                await self.sync_commands()
+
+    async def sync_commands(self):
+        """Sync slash commands only when the command tree changed since the last sync.
+
+        A single process syncs to GUILD_ID for instant updates. A cluster
+        serves many guilds, so its leader syncs the commands globally.
+        """
+        if self.cluster.enabled:
+            if not self.cluster.is_leader:
+                return
+            guild = None
+            sync_key = 'global'
+        else:
+            guild = discord.Object(id=guild_id)
+            self.tree.copy_global_to(guild=guild)
+            sync_key = str(guild_id)
+        tree_hash = self.command_tree_hash(guild)
+
+        try:
+            with open(COMMAND_HASH_FILE) as f:
+                synced = json.load(f)
+        except (OSError, ValueError):
+            synced = {}
+
+        if synced.get(sync_key) == tree_hash:
+            logger.info("Slash commands unchanged since the last sync, skipping sync.")
+            return
+
+        try:
+            await self.tree.sync(guild=guild)
+            print(f"Slash commands registered for {'all servers' if guild is None else f'server: {guild_id}'}")
+        except Exception as e:
+            logger.error(f"Error registering slash commands: {e}")
+            return
+
+        synced[sync_key] = tree_hash
+        try:
+            with open(COMMAND_HASH_FILE, 'w') as f:
+                json.dump(synced, f)
+        except OSError as e:
+            logger.error(f"Could not record the command tree hash: {e}")
+
+# Intents and caches are trimmed to what COGS need; see utils/gateway.py.
+bot = ChuckBot(command_prefix='!', **gateway.client_options(COGS), tree_cls=ChuckTree, cluster=cluster)
+
 @bot.event
 async def on_ready():
     logger.info(f'Logged in as {bot.user.name}')
     print(f'Logged in as {bot.user.name}')
 
-    await load_cogs()
-    
+    if bot.startup_banner_shown:
+        logger.info("Reconnected to the gateway.")
+        return
+    bot.startup_banner_shown = True
+
     ascii_art = """
        _____ _    _ _    _  _____ _  __  _   _  ____  _____  _____  _____  _____ 
       / ____| |  | | |  | |/ ____| |/ / | \\ | |/ __ \\|  __ \\|  __ \\|_   _|/ ____|
@@ -68,19 +237,35 @@ async def on_ready():
     print(f'Chuck Norris by kaspa v1.06')
     logger.info("Bot is up and running!")
 
-    try:
-        guild = discord.Object(id=guild_id)
-        bot.tree.copy_global_to(guild=guild)
-        await bot.tree.sync(guild=guild)
-        print(f"Slash commands registered for server: {guild_id}")
-    except Exception as e:
-        logger.error(f"Error registering slash commands: {e}")
-
 @bot.event
 async def on_command_error(ctx, error):
     logger.error(f"Error in command {ctx.command}: {error}")
     await ctx.send(f"An error occurred: {error}")
 
+@bot.event
+async def on_app_command_completion(interaction, command):
+    profiling.finish(interaction.extras.get('profile'))
+    observe_command(interaction, 'ok')
+
+@bot.tree.error
+async def on_app_command_error(interaction, error):
+    profiling.finish(interaction.extras.get('profile'))
+    observe_command(interaction, 'throttled' if isinstance(error, RateLimited) else 'error')
+    if isinstance(error, RateLimited):
+        if error.duplicate:
+            message = "You just sent that. Please wait a moment before repeating it."
+        else:
+            message = f"You're doing that too often. Try again in {error.retry_after:.0f} seconds."
+        logger.info(f"{error} (user {interaction.user.id})")
+    else:
+        logger.error(f"Error in app command {interaction.command.name if interaction.command else 'unknown'}: {error}")
+        message = "An error occurred while running this command."
+
+    if interaction.response.is_done():
+        await interaction.followup.send(message, ephemeral=True)
+    else:
+        await interaction.response.send_message(message, ephemeral=True)
+
 async def shutdown():
     logger.info("Shutting down bot...")
     await bot.close()
@@ -91,4 +276,5 @@ def handle_shutdown_signal(*args):
 signal.signal(signal.SIGTERM, handle_shutdown_signal)
 signal.signal(signal.SIGINT, handle_shutdown_signal)
 
-bot.run(bot_token)
+# Logging is already routed through the queue; stop discord.py adding its own handler.
+bot.run(bot_token, log_handler=None)
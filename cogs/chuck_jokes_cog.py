@@ -1,24 +1,85 @@
 import discord
+import random
 import sqlite3
 import logging
-from discord.ext import commands
+from array import array
+from discord.ext import commands, tasks
 from discord import app_commands
+from datetime import datetime
+from utils.pagination import KeysetPageView, PAGE_SIZE, fts_query
+from utils.ratelimit import rate_limited
+from utils import metrics
+
+class JokeDeck:
+    """A no-repeat shuffled deck over a shared id array.
+
+    Uses a lazy Fisher-Yates shuffle: each draw swaps one slot, and only
+    the swapped slots are remembered, so drawing is O(1) and the deck never
+    copies the id array.
+    """
+
+    def __init__(self, ids):
+        self.ids = ids
+        self.position = 0
+        self.swaps = {}
+
+    def draw(self):
+        if self.position >= len(self.ids):
+            self.position = 0
+            self.swaps.clear()
+
+        pick = random.randrange(self.position, len(self.ids))
+        joke_id = self.swaps.get(pick, self.ids[pick])
+        self.swaps[pick] = self.swaps.pop(self.position, self.ids[self.position])
+        self.position += 1
+        return joke_id
+
+class SubmissionReviewView(KeysetPageView):
+    """Review page for pending submissions with batch approve/reject."""
+
+    def __init__(self, cog, author_id):
+        super().__init__(author_id, "Pending Joke Submissions", cog._fetch_pending_page,
+                         lambda row: row[0], lambda row: f"**#{row[0]}** by {row[1]}: {row[2]}")
+        self.cog = cog
+
+    async def _resolve(self, interaction, approve):
+        ids = [row[0] for row in self.rows]
+        count = self.cog._resolve_submissions(ids, approve)
+        logging.info(f"{interaction.user} {'approved' if approve else 'rejected'} {count} joke submissions.")
+        # The page's rows are gone from the queue, so reload from the same cursor.
+        self.load()
+        await interaction.response.edit_message(content=f"{'Approved' if approve else 'Rejected'} {count} submissions.", embed=self.embed(), view=self)
+
+    @discord.ui.button(label="Approve page", style=discord.ButtonStyle.success)
+    async def approve_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._resolve(interaction, True)
+
+    @discord.ui.button(label="Reject page", style=discord.ButtonStyle.danger)
+    async def reject_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._resolve(interaction, False)
 
 class ChuckJokesCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.jokes_db = 'chuck_norris_jokes.db' 
         self.stats_db = 'chuck.db' 
+        self.settings = bot.settings
 
         try:
-            self.conn_jokes = sqlite3.connect(self.jokes_db)
+            self.conn_jokes = metrics.connect(self.jokes_db)
             self.cursor_jokes = self.conn_jokes.cursor()
+            self._create_search_tables()
             logging.info("Connected to the Chuck Norris jokes database successfully.")
         except sqlite3.Error as e:
             logging.error(f"Database connection error (jokes): {e}")
 
+        self.joke_ids = array('q')
+        self.jokes_version = None
+        self.decks = {}
+        self._reload_jokes_if_changed()
+
         try:
-            self.conn_stats = sqlite3.connect(self.stats_db)
+            self.conn_stats = metrics.connect(self.stats_db)
             self.cursor_stats = self.conn_stats.cursor()
 
             self.cursor_stats.execute('''
@@ -28,27 +89,170 @@ class ChuckJokesCog(commands.Cog):
                     request_count INTEGER DEFAULT 0
                 )
             ''')
+            self.cursor_stats.execute('CREATE INDEX IF NOT EXISTS idx_joke_requests_count ON joke_requests(request_count DESC)')
+            self.cursor_stats.execute('''
+                CREATE TABLE IF NOT EXISTS joke_totals (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    total_requests INTEGER NOT NULL
+                )
+            ''')
+            # Seed the running total from existing per-user counts the first time.
+            self.cursor_stats.execute('INSERT OR IGNORE INTO joke_totals (id, total_requests) SELECT 1, COALESCE(SUM(request_count), 0) FROM joke_requests')
             self.conn_stats.commit()
             logging.info("Connected to the statistics database successfully.")
         except sqlite3.Error as e:
             logging.error(f"Database connection error (stats): {e}")
 
+        # user_id -> [username, requests not yet written]
+        self.pending_requests = {}
+        metrics.registry.gauge_callback('queue_depth', lambda: len(self.pending_requests), queue='joke_requests')
+        self.flush_stats.start()
+
     def cog_unload(self):
         try:
+            self.flush_stats.cancel()
+            self._flush_requests()
             self.conn_jokes.close()
             self.conn_stats.close()
             logging.info("Database connections closed.")
         except Exception as e:
             logging.error(f"Error during database connection close: {e}")
 
+    def _create_search_tables(self):
+        """Create the FTS5 index over jokes and the submission queue."""
+        self.cursor_jokes.execute("SELECT 1 FROM sqlite_master WHERE name = 'jokes_fts'")
+        fts_exists = self.cursor_jokes.fetchone() is not None
+
+        self.cursor_jokes.executescript('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS jokes_fts USING fts5(joke, content='jokes', content_rowid='id');
+            CREATE TRIGGER IF NOT EXISTS jokes_fts_insert AFTER INSERT ON jokes BEGIN
+                INSERT INTO jokes_fts(rowid, joke) VALUES (new.id, new.joke);
+            END;
+            CREATE TRIGGER IF NOT EXISTS jokes_fts_delete AFTER DELETE ON jokes BEGIN
+                INSERT INTO jokes_fts(jokes_fts, rowid, joke) VALUES ('delete', old.id, old.joke);
+            END;
+            CREATE TRIGGER IF NOT EXISTS jokes_fts_update AFTER UPDATE ON jokes BEGIN
+                INSERT INTO jokes_fts(jokes_fts, rowid, joke) VALUES ('delete', old.id, old.joke);
+                INSERT INTO jokes_fts(rowid, joke) VALUES (new.id, new.joke);
+            END;
+            CREATE TABLE IF NOT EXISTS joke_submissions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                username TEXT,
+                joke TEXT NOT NULL,
+                submitted_at DATETIME,
+                status TEXT DEFAULT 'pending'
+            );
+            CREATE INDEX IF NOT EXISTS idx_joke_submissions_pending ON joke_submissions(status, id);
+        ''')
+        if not fts_exists:
+            self.cursor_jokes.execute("INSERT INTO jokes_fts(jokes_fts) VALUES ('rebuild')")
+            logging.info("Built the full-text index over jokes.")
+        self.conn_jokes.commit()
+
+    def _fetch_search_page(self, query, cursor):
+        score, joke_id = cursor if cursor else (float('-inf'), 0)
+        self.cursor_jokes.execute('''
+            SELECT hits.id, hits.score, jokes.joke FROM (
+                SELECT rowid AS id, rank AS score FROM jokes_fts WHERE jokes_fts MATCH ?
+            ) AS hits JOIN jokes ON jokes.id = hits.id
+            WHERE hits.score > ? OR (hits.score = ? AND hits.id > ?)
+            ORDER BY hits.score, hits.id LIMIT ?
+        ''', (query, score, score, joke_id, PAGE_SIZE + 1))
+        return self.cursor_jokes.fetchall()
+
+    def _fetch_joke_page(self, cursor):
+        self.cursor_jokes.execute('SELECT id, joke FROM jokes WHERE id > ? ORDER BY id LIMIT ?', (cursor or 0, PAGE_SIZE + 1))
+        return self.cursor_jokes.fetchall()
+
+    def _fetch_pending_page(self, cursor):
+        self.cursor_jokes.execute("SELECT id, username, joke FROM joke_submissions WHERE status = 'pending' AND id > ? ORDER BY id LIMIT ?",
+                                  (cursor or 0, PAGE_SIZE + 1))
+        return self.cursor_jokes.fetchall()
+
+    def _resolve_submissions(self, ids, approve):
+        """Approve or reject a batch of pending submissions in one transaction."""
+        if not ids:
+            return 0
+        placeholders = ','.join('?' * len(ids))
+        with self.conn_jokes:
+            if approve:
+                self.cursor_jokes.execute('SELECT COALESCE(MAX(id), 0) FROM jokes')
+                last_id = self.cursor_jokes.fetchone()[0]
+                self.cursor_jokes.execute(f"INSERT INTO jokes (joke) SELECT joke FROM joke_submissions WHERE status = 'pending' AND id IN ({placeholders}) ORDER BY id", ids)
+            self.cursor_jokes.execute(f"UPDATE joke_submissions SET status = ? WHERE status = 'pending' AND id IN ({placeholders})",
+                                      ['approved' if approve else 'rejected', *ids])
+            count = self.cursor_jokes.rowcount
+        if approve:
+            # Every deck shares the id array, so the new jokes join the undrawn part of each deck in place.
+            self.cursor_jokes.execute('SELECT id FROM jokes WHERE id > ? ORDER BY id', (last_id,))
+            self.joke_ids.extend(row[0] for row in self.cursor_jokes)
+            # Our own commits don't move data_version, so only the table's size and last id change.
+            if self.jokes_version:
+                self.cursor_jokes.execute('SELECT COUNT(*), COALESCE(MAX(id), 0) FROM jokes')
+                self.jokes_version = (self.jokes_version[0], *self.cursor_jokes.fetchone())
+        return count
+
+    def _jokes_version(self):
+        """What identifies the current contents of the jokes table.
+
+        PRAGMA data_version only moves when another connection commits, and
+        the jokes table's own size and last id tell a change to the jokes
+        apart from one to joke_submissions, which shares the file.
+        """
+        self.cursor_jokes.execute('PRAGMA data_version')
+        data_version = self.cursor_jokes.fetchone()[0]
+        if self.jokes_version and self.jokes_version[0] == data_version:
+            return self.jokes_version
+        self.cursor_jokes.execute('SELECT COUNT(*), COALESCE(MAX(id), 0) FROM jokes')
+        return (data_version, *self.cursor_jokes.fetchone())
+
+    def _reload_jokes_if_changed(self):
+        """Reload the joke id array when another process has changed the jokes table."""
+        try:
+            version = self._jokes_version()
+        except sqlite3.Error as e:
+            logging.error(f"Unable to check the jokes table for changes: {e}")
+            return
+        if version == self.jokes_version:
+            return
+        if self.jokes_version and version[1:] == self.jokes_version[1:]:
+            # Only joke_submissions changed; keep the ids and every guild's deck.
+            self.jokes_version = version
+            return
+
+        self.cursor_jokes.execute('SELECT id FROM jokes')
+        self.joke_ids = array('q', (row[0] for row in self.cursor_jokes))
+        self.jokes_version = version
+        self.decks.clear()
+        logging.info(f"Loaded {len(self.joke_ids)} joke ids from {self.jokes_db}.")
+
+    def _draw_joke(self, deck_key):
+        """Draw the next joke for a guild or DM channel without repeating until its deck runs out."""
+        self._reload_jokes_if_changed()
+        if not self.joke_ids:
+            return None
+
+        deck = self.decks.get(deck_key)
+        if deck is None:
+            deck = self.decks[deck_key] = JokeDeck(self.joke_ids)
+
+        # A joke deleted since the ids were loaded just means we draw again.
+        for _ in range(3):
+            self.cursor_jokes.execute('SELECT joke FROM jokes WHERE id = ?', (deck.draw(),))
+            joke_row = self.cursor_jokes.fetchone()
+            if joke_row:
+                return joke_row
+        return None
+
     @app_commands.command(name="jokeschuck", description="Get a random Chuck Norris joke.")
+    @rate_limited(dedupe=False)
     async def jokes_chuck(self, interaction: discord.Interaction):
         user_id = interaction.user.id
         username = str(interaction.user) 
 
         try:
-            self.cursor_jokes.execute('SELECT joke FROM jokes ORDER BY RANDOM() LIMIT 1')
-            joke_row = self.cursor_jokes.fetchone()
+            joke_row = self._draw_joke(interaction.guild_id or interaction.channel_id)
 
             if joke_row:
                 joke = joke_row[0]
@@ -65,19 +269,9 @@ class ChuckJokesCog(commands.Cog):
                     logging.warning(f"Interaction expired before sending the response for user {username}.")
                     return
 
-                self.cursor_stats.execute('SELECT request_count FROM joke_requests WHERE user_id = ?', (user_id,))
-                user_request = self.cursor_stats.fetchone()
-
-                if user_request:
-                    new_count = user_request[0] + 1
-                    self.cursor_stats.execute('UPDATE joke_requests SET request_count = ?, username = ? WHERE user_id = ?', (new_count, username, user_id))
-                    logging.info(f"Updated joke request count for {username}: new count is {new_count}.")
-                else:
-                    self.cursor_stats.execute('INSERT INTO joke_requests (user_id, username, request_count) VALUES (?, ?, ?)', (user_id, username, 1))
-                    logging.info(f"Inserted new joke request record for {username} with count 1.")
-
-                self.conn_stats.commit()
-                logging.info(f"Joke request recorded successfully for {username}.")
+                pending = self.pending_requests.setdefault(user_id, [username, 0])
+                pending[0] = username
+                pending[1] += 1
             else:
                 if not interaction.response.is_done():
                     await interaction.response.send_message("Sorry, no jokes found in the database.", ephemeral=True)
@@ -88,10 +282,54 @@ class ChuckJokesCog(commands.Cog):
             if not interaction.response.is_done():
                 await interaction.response.send_message("An error occurred while fetching a joke. Please try again later.", ephemeral=True)
 
+    def _flush_requests(self):
+        """Write buffered request counts with one UPSERT batch and bump the global total."""
+        if not self.pending_requests:
+            return
+        pending, self.pending_requests = self.pending_requests, {}
+        rows = [(user_id, username, count) for user_id, (username, count) in pending.items()]
+        try:
+            with self.conn_stats:
+                self.cursor_stats.executemany('''INSERT INTO joke_requests (user_id, username, request_count) VALUES (?, ?, ?)
+                                                 ON CONFLICT(user_id) DO UPDATE SET
+                                                     request_count = request_count + excluded.request_count,
+                                                     username = excluded.username''', rows)
+                self.cursor_stats.execute('UPDATE joke_totals SET total_requests = total_requests + ? WHERE id = 1',
+                                          (sum(count for _, _, count in rows),))
+            logging.info(f"Flushed joke request counts for {len(rows)} users.")
+        except sqlite3.Error as e:
+            logging.error(f"Failed to flush joke request counts: {e}")
+            # Put the counts back so they are retried on the next flush.
+            for user_id, username, count in rows:
+                entry = self.pending_requests.setdefault(user_id, [username, 0])
+                entry[1] += count
+
+    @tasks.loop(seconds=60)
+    @metrics.timed_loop('flush_stats')
+    async def flush_stats(self):
+        self._flush_requests()
+
     @app_commands.command(name="jokestats", description="Show the number of joke requests.")
-    async def joke_stats(self, interaction: discord.Interaction):
+    @app_commands.describe(view="'me' for the totals, 'top' for the leaderboard")
+    @app_commands.choices(view=[
+        app_commands.Choice(name="me", value="me"),
+        app_commands.Choice(name="top", value="top")
+    ])
+    async def joke_stats(self, interaction: discord.Interaction, view: str = "me"):
         try:
-            self.cursor_stats.execute('SELECT COUNT(*) FROM joke_requests')
+            self._flush_requests()
+
+            if view == "top":
+                self.cursor_stats.execute('SELECT username, request_count FROM joke_requests ORDER BY request_count DESC LIMIT 10')
+                leaders = self.cursor_stats.fetchall()
+                embed = discord.Embed(title="Top Chuck Norris Fans", color=0x3498db)
+                embed.description = "\n".join(f"**{rank}.** {username}: {count}" for rank, (username, count) in enumerate(leaders, start=1)) or "Nobody has asked for a joke yet."
+                if not interaction.response.is_done():
+                    await interaction.response.send_message(embed=embed, ephemeral=True)
+                logging.info(f"Displayed joke leaderboard for {interaction.user}.")
+                return
+
+            self.cursor_stats.execute('SELECT total_requests FROM joke_totals WHERE id = 1')
             total_requests = self.cursor_stats.fetchone()[0]
 
             user_id = interaction.user.id
@@ -100,8 +338,8 @@ class ChuckJokesCog(commands.Cog):
             user_requests = user_request[1] if user_request else 0
             username = user_request[0] if user_request else "Unknown User"
 
-            stats_message = (f"Total Chuck Norris jokes requested: {total_requests}\n")
-                           
+            stats_message = (f"Total Chuck Norris jokes requested: {total_requests}\n"
+                             f"Jokes requested by you: {user_requests}")
 
             if not interaction.response.is_done():
                 await interaction.response.send_message(stats_message, ephemeral=True)
@@ -112,52 +350,74 @@ class ChuckJokesCog(commands.Cog):
             if not interaction.response.is_done():
                 await interaction.response.send_message("An error occurred while fetching the joke stats. Please try again later.", ephemeral=True)
 
+    @app_commands.command(name="joke", description="Search the Chuck Norris jokes.")
+    @app_commands.describe(search="Words to search for")
+    async def joke_search(self, interaction: discord.Interaction, search: str):
+        query = fts_query(search)
+        if not query:
+            await interaction.response.send_message("Please give me something to search for.", ephemeral=True)
+            return
+
+        view = KeysetPageView(interaction.user.id, f"Jokes matching '{search}'"[:256],
+                              lambda cursor: self._fetch_search_page(query, cursor),
+                              lambda row: (row[1], row[0]), lambda row: f"**#{row[0]}** {row[2]}")
+        try:
+            view.load()
+        except sqlite3.Error as e:
+            logging.error(f"Joke search error for '{search}': {e}")
+            await interaction.response.send_message("An error occurred while searching jokes. Please try again later.", ephemeral=True)
+            return
+
+        await interaction.response.send_message(embed=view.embed(), view=view, ephemeral=True)
+        logging.info(f"Joke search '{search}' by {interaction.user}.")
+
+    @app_commands.command(name="listjokes", description="Browse all Chuck Norris jokes.")
+    async def list_jokes(self, interaction: discord.Interaction):
+        view = KeysetPageView(interaction.user.id, "All Chuck Norris Jokes", self._fetch_joke_page,
+                              lambda row: row[0], lambda row: f"**#{row[0]}** {row[1]}")
+        try:
+            view.load()
+        except sqlite3.Error as e:
+            logging.error(f"Database query error: {e}")
+            await interaction.response.send_message("An error occurred while listing the jokes. Please try again later.", ephemeral=True)
+            return
+
+        await interaction.response.send_message(embed=view.embed(), view=view, ephemeral=True)
+
+    @app_commands.command(name="addjoke", description="Submit a Chuck Norris joke for review.")
+    @app_commands.describe(joke="The joke to submit")
+    async def add_joke(self, interaction: discord.Interaction, joke: str):
+        try:
+            self.cursor_jokes.execute('INSERT INTO joke_submissions (user_id, username, joke, submitted_at) VALUES (?, ?, ?, ?)',
+                                      (interaction.user.id, str(interaction.user), joke, datetime.utcnow()))
+            self.conn_jokes.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Database insert error: {e}")
+            await interaction.response.send_message("An error occurred while submitting the joke. Please try again later.", ephemeral=True)
+            return
+
+        logging.info(f"Joke submission from {interaction.user} queued for review.")
+        await interaction.response.send_message("Thanks! Your joke has been queued for review.", ephemeral=True)
+
+    @app_commands.command(name="review_jokes", description="Approve or reject submitted jokes in batches (Admin only)")
+    async def review_jokes(self, interaction: discord.Interaction):
+        if not self.settings.is_bot_admin(interaction.user.id):
+            await interaction.response.send_message("You do not have permission to review jokes.", ephemeral=True)
+            return
+
+        view = SubmissionReviewView(self, interaction.user.id)
+        try:
+            view.load()
+        except sqlite3.Error as e:
+            logging.error(f"Database query error: {e}")
+            await interaction.response.send_message("An error occurred while loading submissions.", ephemeral=True)
+            return
+
+        await interaction.response.send_message(embed=view.embed(), view=view, ephemeral=True)
+
     @commands.Cog.listener()
     async def on_ready(self):
         logging.info("ChuckJokesCog is ready.")
 
-# Remove the add_joke and list_jokes commands
-# @app_commands.command(name="addjoke", description="Add a new Chuck Norris joke to the database.")
-# @app_commands.describe(joke="The joke to add to the database")
-# async def add_joke(self, interaction: discord.Interaction, joke: str):
-#     try:
-#         self.cursor_jokes.execute('INSERT INTO jokes (joke) VALUES (?)', (joke,))
-#         self.conn_jokes.commit()
-#         if not interaction.response.is_done():
-#             await interaction.response.send_message("Joke added successfully.", ephemeral=True)
-#         logging.info(f"Added new joke to the database: {joke}")
-
-#     except sqlite3.Error as e:
-#         logging.error(f"Database insert error: {e}")
-#         if not interaction.response.is_done():
-#             await interaction.response.send_message("An error occurred while adding the joke. Please try again later.", ephemeral=True)
-
-# @app_commands.command(name="listjokes", description="List all Chuck Norris jokes in the database.")
-# async def list_jokes(self, interaction: discord.Interaction):
-#     try:
-#         self.cursor_jokes.execute('SELECT joke FROM jokes')
-#         jokes = self.cursor_jokes.fetchall()
-
-#         if jokes:
-#             joke_list = "\n".join([joke[0] for joke in jokes])
-#             embed = discord.Embed(
-#                 title="All Chuck Norris Jokes",
-#                 description=joke_list,
-#                 color=0x3498db
-#             )
-
-#             if not interaction.response.is_done():
-#                 await interaction.response.send_message(embed=embed)
-#             logging.info("Listed all Chuck Norris jokes successfully.")
-#         else:
-#             if not interaction.response.is_done():
-#                 await interaction.response.send_message("No jokes found in the database.", ephemeral=True)
-#             logging.warning("No jokes found to list.")
-
-#     except sqlite3.Error as e:
-#         logging.error(f"Database query error: {e}")
-#         if not interaction.response.is_done():
-#             await interaction.response.send_message("An error occurred while listing the jokes. Please try again later.", ephemeral=True)
-
 async def setup(bot):
     await bot.add_cog(ChuckJokesCog(bot))
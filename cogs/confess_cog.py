@@ -1,26 +1,54 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
-from decouple import config
 import sqlite3
 import logging
 from datetime import datetime
 import traceback
+from utils.pagination import KeysetPageView, PAGE_SIZE, fts_query
+from utils.ratelimit import rate_limited
+from utils.outbound import QueueFull
+from utils import metrics
 
 log = logging.getLogger(__name__)
 
+class ConfessionBrowserView(KeysetPageView):
+    """Admin browser over confessions, newest first, with bulk delete of the current page."""
+
+    def __init__(self, cog, author_id, search=None):
+        title = f"Confessions matching '{search}'"[:256] if search else "Confessions"
+        super().__init__(author_id, title, lambda cursor: cog._fetch_confession_page(cursor, search),
+                         lambda row: (row['submitted_at'], row['id']),
+                         lambda row: f"**#{row['id']}** ({row['submitted_at']}): {row['confession'][:300]}")
+        self.cog = cog
+
+    def load(self):
+        super().load()
+        self.delete_select.options = [
+            discord.SelectOption(label=f"#{row['id']}", description=row['confession'][:100], value=str(row['id']))
+            for row in self.rows
+        ] or [discord.SelectOption(label="Nothing to delete", value="0")]
+        self.delete_select.max_values = max(1, len(self.rows))
+        self.delete_select.disabled = not self.rows
+
+    @discord.ui.select(placeholder="Select confessions to delete", min_values=1, max_values=1,
+                       options=[discord.SelectOption(label="Nothing to delete", value="0")])
+    async def delete_select(self, interaction: discord.Interaction, select: discord.ui.Select):
+        ids = [int(value) for value in select.values if value != "0"]
+        deleted = self.cog._delete_confessions(ids)
+        log.info(f"Admin {interaction.user.id} bulk-deleted {deleted} confessions: {ids}")
+        # Deleted rows drop out of the page, so reload from the same cursor.
+        self.load()
+        await interaction.response.edit_message(content=f"Deleted {deleted} confessions.", embed=self.embed(), view=self)
+
 class ConfessCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         try:
-            # Validate and log environment variable loading
-            self.allowed_channel_id = int(config('ALLOWED_CHANNEL_ID'))
-            self.admin_user_id = int(config('ADMIN_USER_ID'))
-            log.info(f"Allowed Channel ID: {self.allowed_channel_id}")
-            log.info(f"Admin User ID: {self.admin_user_id}")
+            self.settings = bot.settings
 
             # Attempt database connection
-            self.conn = sqlite3.connect('chuck.db')
+            self.conn = metrics.connect('chuck.db')
             self.conn.row_factory = sqlite3.Row
             self.cursor = self.conn.cursor()
             self.cursor.execute('''CREATE TABLE IF NOT EXISTS confessions (
@@ -29,6 +57,8 @@ class ConfessCog(commands.Cog):
                                    confession TEXT,
                                    submitted_at DATETIME
                                    )''')
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_confessions_submitted_at ON confessions(submitted_at DESC, id DESC)')
+            self._create_search_table()
             self.conn.commit()
             logging.info("Connected to the confessions database successfully.")
         except ValueError as ve:
@@ -48,7 +78,30 @@ class ConfessCog(commands.Cog):
         if self.conn:
             self.conn.close()
 
+    def _create_search_table(self):
+        """Full-text index over confessions, so a search reads only the matches instead of every row."""
+        self.cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'confessions_fts'")
+        fts_exists = self.cursor.fetchone() is not None
+
+        self.cursor.executescript('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS confessions_fts USING fts5(confession, content='confessions', content_rowid='id');
+            CREATE TRIGGER IF NOT EXISTS confessions_fts_insert AFTER INSERT ON confessions BEGIN
+                INSERT INTO confessions_fts(rowid, confession) VALUES (new.id, new.confession);
+            END;
+            CREATE TRIGGER IF NOT EXISTS confessions_fts_delete AFTER DELETE ON confessions BEGIN
+                INSERT INTO confessions_fts(confessions_fts, rowid, confession) VALUES ('delete', old.id, old.confession);
+            END;
+            CREATE TRIGGER IF NOT EXISTS confessions_fts_update AFTER UPDATE ON confessions BEGIN
+                INSERT INTO confessions_fts(confessions_fts, rowid, confession) VALUES ('delete', old.id, old.confession);
+                INSERT INTO confessions_fts(rowid, confession) VALUES (new.id, new.confession);
+            END;
+        ''')
+        if not fts_exists:
+            self.cursor.execute("INSERT INTO confessions_fts(confessions_fts) VALUES ('rebuild')")
+            logging.info("Built the full-text index over confessions.")
+
     @app_commands.command(name="confess", description="Submit an anonymous confession")
+    @rate_limited()
     async def confess(self, interaction: discord.Interaction, *, message: str):
         username = str(interaction.user)
         submitted_at = datetime.utcnow()
@@ -59,7 +112,10 @@ class ConfessCog(commands.Cog):
             self.conn.commit()
             log.info(f"Stored confession from {username}")
 
-            channel = self.bot.get_channel(self.allowed_channel_id)
+            # Confessions sent by DM go to the home server's channel.
+            guild_id = interaction.guild_id or self.settings.home_guild_id
+            channel_id = self.settings.get(guild_id, 'allowed_channel_id')
+            channel = self.bot.get_channel(channel_id) if channel_id else None
             if channel:
                 embed = discord.Embed(
                     title="I Chuck Norris have a confession to make: ",
@@ -69,44 +125,75 @@ class ConfessCog(commands.Cog):
                 )
                 embed.set_footer(text="Posted anonymously")
 
-                await channel.send(embed=embed)
-                await interaction.response.send_message("Your confession has been posted anonymously.", ephemeral=True)
+                # The post may wait behind other outbound traffic, so don't let the interaction expire.
+                await interaction.response.defer(ephemeral=True)
+                try:
+                    await self.bot.outbound.send('confession', channel, embed=embed)
+                except (discord.HTTPException, QueueFull) as e:
+                    log.error(f"Failed to post confession from {username}: {e}")
+                    await interaction.followup.send("Your confession was saved but couldn't be posted right now.", ephemeral=True)
+                    return
+                await interaction.followup.send("Your confession has been posted anonymously.", ephemeral=True)
             else:
                 await interaction.response.send_message("Sorry, I couldn't find the confessions channel.", ephemeral=True)
-                log.error(f"Channel with ID {self.allowed_channel_id} not found.")
+                log.error(f"Confessions channel {channel_id} for guild {guild_id} not found or not configured.")
 
         except sqlite3.Error as e:
             log.error(f"Failed to save confession from {username}: {e}")
             await interaction.response.send_message("An error occurred while processing your confession. Please try again later.", ephemeral=True)
 
-    @app_commands.command(name="view_confessions", description="View all confessions (Admin only)")
-    async def slash_view_confessions(self, interaction: discord.Interaction):
-        if interaction.user.id != self.admin_user_id:
+    @app_commands.command(name="view_confessions", description="Browse confessions (Admin only)")
+    @app_commands.describe(search="Only show confessions containing these words")
+    async def slash_view_confessions(self, interaction: discord.Interaction, search: str = None):
+        if not self.settings.is_bot_admin(interaction.user.id):
             await interaction.response.send_message("You do not have permission to view confessions.", ephemeral=True)
             return
 
-        await self.view_confessions(interaction)
+        await self.view_confessions(interaction, search)
 
     @app_commands.command(name="delete_confession", description="Delete a confession by its ID (Admin only)")
     async def slash_delete_confession(self, interaction: discord.Interaction, confession_id: int):
-        if interaction.user.id != self.admin_user_id:
+        if not self.settings.is_bot_admin(interaction.user.id):
             await interaction.response.send_message("You do not have permission to delete confessions.", ephemeral=True)
             return
 
         await self.delete_confession(interaction, confession_id)
 
-    async def view_confessions(self, interaction: discord.Interaction):
+    def _fetch_confession_page(self, cursor, search=None):
+        """Fetch one page of confessions older than ``cursor``, newest first.
+
+        A search is driven by the full-text index, so it only reads the
+        matching rows; words match whole, the last one as a prefix.
+        """
+        conditions = []
+        params = []
+        source = 'confessions'
+        query = fts_query(search) if search else ''
+        if query:
+            source = 'confessions_fts JOIN confessions ON confessions.id = confessions_fts.rowid'
+            conditions.append('confessions_fts MATCH ?')
+            params.append(query)
+        if cursor:
+            conditions.append('(submitted_at < ? OR (submitted_at = ? AND confessions.id < ?))')
+            params += [cursor[0], cursor[0], cursor[1]]
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        self.cursor.execute(f'SELECT confessions.id, confessions.confession, submitted_at FROM {source} {where} '
+                            'ORDER BY submitted_at DESC, confessions.id DESC LIMIT ?', (*params, PAGE_SIZE + 1))
+        return self.cursor.fetchall()
+
+    def _delete_confessions(self, ids):
+        if not ids:
+            return 0
+        self.cursor.execute(f"DELETE FROM confessions WHERE id IN ({','.join('?' * len(ids))})", ids)
+        self.conn.commit()
+        return self.cursor.rowcount
+
+    async def view_confessions(self, interaction: discord.Interaction, search: str = None):
         try:
-            self.cursor.execute('SELECT id, confession, submitted_at FROM confessions ORDER BY submitted_at DESC')
-            confessions = self.cursor.fetchall()
+            view = ConfessionBrowserView(self, interaction.user.id, search)
+            view.load()
+            await interaction.response.send_message(embed=view.embed(), view=view, ephemeral=True)
 
-            if confessions:
-                confessions_list = "\n".join([f"ID: {id}, Confession: {confession}, Time: {submitted_at}" 
-                                              for id, confession, submitted_at in confessions])
-                await interaction.response.send_message(f"**Confessions:**\n{confessions_list}", ephemeral=True)
-            else:
-                await interaction.response.send_message("No confessions found.", ephemeral=True)
-        
         except sqlite3.Error as e:
             log.error(f"Failed to retrieve confessions: {e}")
             await interaction.response.send_message("An error occurred while fetching confessions.", ephemeral=True)
@@ -16,10 +16,13 @@ class HelpCog(commands.Cog):
         )
 
         embed.add_field(name="/ping", value="Check the bot's responsiveness.", inline=False)
-        embed.add_field(name="/time", value="Get the current date/time across various time zones. Also includes the current pilot count of Eve Online--bot count not included.", inline=False)
+        embed.add_field(name="/time [zone]", value="Get the current date/time across various time zones. Also includes the current pilot count of Eve Online--bot count not included.", inline=False)
+        embed.add_field(name="/convert <time> [to]", value="Convert a time between zones. Example: `/convert \"18:00 ET\" EVE`", inline=False)
         embed.add_field(name="/remind <time> <message>", value="Set a reminder with a specified time and message.", inline=False)
         embed.add_field(name="/create_poll <duration> <question> <option1> <option2> [<option3> <option4>]", value="Create a poll with a question and options. Example: `/create_poll 10m \"Your Question?\" \"Option1\" \"Option2\"`", inline=False)
         embed.add_field(name="/jokeschuck", value="Get a random Chuck Norris joke.", inline=False)
+        embed.add_field(name="/joke <search>", value="Search the Chuck Norris jokes.", inline=False)
+        embed.add_field(name="/addjoke <joke>", value="Submit a new Chuck Norris joke for review.", inline=False)
 
         embed.set_footer(text="Chuck Norris Bot by kaspa, AI included.")
 
@@ -1,18 +1,41 @@
 import discord
 import feedparser
+import hashlib
+import random
 import sqlite3
 import logging
+import time
+from urllib.parse import urlparse
 from discord.ext import commands, tasks
+from discord import app_commands
+from datetime import datetime, timedelta
 from decouple import config
-from datetime import datetime
+from utils import metrics
+from utils.cluster import messageable
+from utils.settings import parse_id
+
+DEFAULT_FEEDS = {
+    'patch-notes': 'https://www.eveonline.com/rss/patch-notes',
+    'dev-blogs': 'https://www.eveonline.com/rss/dev-blogs',
+    'news': 'https://www.eveonline.com/rss/news'
+}
+
+MIN_INTERVAL = 5 * 60
+DEFAULT_INTERVAL = 10 * 60
+MAX_INTERVAL = 6 * 60 * 60
+INITIAL_ARTICLES = 5
+# Only used to seed the feed registry on first run; /add_feed manages it after that.
+NEWS_CHANNEL_ID = config('NEWS_CHANNEL_ID', default='')
 
 class NewsCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.news_channel_id = int(config('NEWS_CHANNEL_ID'))
+        self.settings = bot.settings
+        self.clock = bot.clock
 
         try:
-            self.conn = sqlite3.connect('chuck.db')
+            self.conn = metrics.connect('chuck.db')
+            self.conn.row_factory = sqlite3.Row
             self.cursor = self.conn.cursor()
             self.cursor.execute('''CREATE TABLE IF NOT EXISTS news (
                                    id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -23,110 +46,321 @@ class NewsCog(commands.Cog):
                                    source TEXT,
                                    UNIQUE(title, link)
                                    )''')
+            self.cursor.execute('''CREATE TABLE IF NOT EXISTS news_feeds (
+                                   source TEXT PRIMARY KEY,
+                                   url TEXT NOT NULL,
+                                   channel_ids TEXT NOT NULL,
+                                   interval INTEGER,
+                                   last_checked DATETIME,
+                                   last_new_at DATETIME,
+                                   etag TEXT,
+                                   modified TEXT
+                                   )''')
             self.conn.commit()
             logging.info("Connected to the news database successfully.")
         except sqlite3.Error as e:
             logging.error(f"Database error: {e}")
 
-        self.feeds = {
-            'patch-notes': 'https://www.eveonline.com/rss/patch-notes',
-            'dev-blogs': 'https://www.eveonline.com/rss/dev-blogs',
-            'news': 'https://www.eveonline.com/rss/news'
-        }
+        self.seen = set()
+        # Highest news row id reflected in self.seen.
+        self.seen_max_id = 0
+        self._load_seen(self.bot.snapshot.restore('news_seen'))
+        self.bot.snapshot.register('news_seen', self._snapshot_seen)
+
+        self.feeds = {}
+        self._load_feeds()
 
+        metrics.registry.gauge_callback('news_feeds', lambda: len(self.feeds), help_text="Registered news feeds")
         self.check_news_feed.start()
-        self.hourly_log.start()
 
     def cog_unload(self):
+        self.bot.snapshot.unregister('news_seen')
         try:
             self.check_news_feed.cancel()
-            self.hourly_log.cancel()
+            self._save_feed_state()
+            self.conn.commit()
             self.conn.close()
             logging.info("NewsCog unloaded and database connection closed.")
         except Exception as e:
             logging.error(f"Error during cog unload: {e}")
 
-    @tasks.loop(minutes=10)
-    async def check_news_feed(self):
-        logging.info("Checking for news updates...")
+    @staticmethod
+    def _entry_key(title, link):
+        return hashlib.sha1(f"{title}\n{link}".encode('utf-8')).digest()
+
+    def _load_seen(self, state=None):
+        """Load the keys of known entries, only reading rows newer than the snapshot when there is one."""
+        try:
+            if state:
+                self.cursor.execute('SELECT COALESCE(MAX(id), 0) FROM news')
+                if self.cursor.fetchone()[0] >= state['max_id']:
+                    self.seen = {bytes.fromhex(key) for key in state['keys']}
+                    self.seen_max_id = state['max_id']
+                else:
+                    logging.warning("The news table is older than the snapshot, ignoring the snapshot.")
+            self.cursor.execute('SELECT id, title, link FROM news WHERE id > ?', (self.seen_max_id,))
+            rows = self.cursor.fetchall()
+            self.seen.update(self._entry_key(row['title'], row['link']) for row in rows)
+            self.seen_max_id = max([self.seen_max_id] + [row['id'] for row in rows])
+            logging.info(f"Loaded {len(self.seen)} known news entries ({len(rows)} from the database).")
+        except sqlite3.Error as e:
+            logging.error(f"Failed to load known news entries: {e}")
+
+    def _snapshot_seen(self):
+        return {'max_id': self.seen_max_id, 'keys': [key.hex() for key in self.seen]}
+
+    def _seed_default_feeds(self):
+        try:
+            channel_id = parse_id(NEWS_CHANNEL_ID)
+        except ValueError as e:
+            logging.error(f"Ignoring NEWS_CHANNEL_ID: {e}")
+            return
+        self.cursor.executemany('INSERT INTO news_feeds (source, url, channel_ids, interval) VALUES (?, ?, ?, ?)',
+                                [(source, url, str(channel_id), DEFAULT_INTERVAL) for source, url in DEFAULT_FEEDS.items()])
+        self.conn.commit()
+        logging.info("Seeded the feed registry with the default EVE Online feeds.")
+
+    def _load_feeds(self):
+        """Load the feed registry, seeding it with the official EVE feeds on first run."""
         try:
-            for source, url in self.feeds.items():
-                logging.info(f"Fetching articles from {source} feed: {url}")
-                feed = feedparser.parse(url)
-                if feed.bozo:
-                    logging.error(f"Failed to parse feed {source}: {feed.bozo_exception}")
+            self.cursor.execute('SELECT COUNT(*) FROM news_feeds')
+            if self.cursor.fetchone()[0] == 0 and NEWS_CHANNEL_ID:
+                self._seed_default_feeds()
+
+            self.cursor.execute('SELECT * FROM news_feeds')
+            now = self.clock.utcnow()
+            for row in self.cursor.fetchall():
+                interval = row['interval'] or DEFAULT_INTERVAL
+                self.feeds[row['source']] = {
+                    'url': row['url'],
+                    'channel_ids': [int(channel_id) for channel_id in row['channel_ids'].split(',') if channel_id],
+                    'interval': interval,
+                    'last_checked': row['last_checked'],
+                    'etag': row['etag'],
+                    'modified': row['modified'],
+                    # Spread the first polls out so feeds don't all fire in the same tick.
+                    'next_check': now + timedelta(seconds=random.uniform(0, min(interval, DEFAULT_INTERVAL))),
+                    'dirty': False
+                }
+            logging.info(f"Loaded {len(self.feeds)} news feeds.")
+        except sqlite3.Error as e:
+            logging.error(f"Failed to load the feed registry: {e}")
+
+    def _save_feed_state(self):
+        """Queue scheduler state of feeds polled since the last save; the caller commits."""
+        rows = [(feed['interval'], feed['last_checked'], feed.get('last_new_at'), feed['etag'], feed['modified'], source)
+                for source, feed in self.feeds.items() if feed['dirty']]
+        if not rows:
+            return
+        self.cursor.executemany('UPDATE news_feeds SET interval = ?, last_checked = ?, last_new_at = COALESCE(?, last_new_at), etag = ?, modified = ? WHERE source = ?', rows)
+        for feed in self.feeds.values():
+            feed['dirty'] = False
+
+    def _reschedule(self, feed, found_new, now):
+        """Back off exponentially while a feed is quiet and tighten once it publishes."""
+        if found_new:
+            feed['interval'] = max(MIN_INTERVAL, feed['interval'] // 4)
+            feed['last_new_at'] = now
+        else:
+            feed['interval'] = min(MAX_INTERVAL, feed['interval'] * 2)
+        jitter = random.uniform(0.9, 1.1)
+        feed['next_check'] = now + timedelta(seconds=feed['interval'] * jitter)
+        feed['last_checked'] = now
+        feed['dirty'] = True
+
+    def _new_entries(self, feed):
+        """Return entries newer than the first already-seen one, newest first."""
+        new_entries = []
+        for entry in feed.entries:
+            key = self._entry_key(entry.title, entry.link)
+            if key in self.seen:
+                break
+            new_entries.append((key, entry))
+        return new_entries
+
+    async def _send_entry(self, source, channel_ids, title, link, published):
+        embed = discord.Embed(title=title, url=link, description=f"Source: {source.capitalize()}", timestamp=published, color=0x3498db)
+        embed.set_footer(text="EVE Online News")
+
+        delivered = False
+        for channel_id in channel_ids:
+            try:
+                await self.bot.outbound.send('news', messageable(self.bot, channel_id), embed=embed)
+            except discord.NotFound:
+                logging.warning(f"Channel with ID {channel_id} not found.")
+                continue
+            logging.info("News article '%s' from %s sent to channel: %s", title, source, channel_id,
+                         extra={'source': source, 'channel_id': channel_id})
+            delivered = True
+        return delivered
+
+    async def _fetch(self, feed):
+        # feedparser is blocking; keep it off the event loop and let the
+        # server answer 304 when nothing changed since the last poll.
+        started = time.perf_counter()
+        parsed = await self.bot.loop.run_in_executor(
+            None, lambda: feedparser.parse(feed['url'], etag=feed['etag'], modified=feed['modified']))
+        upstream = urlparse(feed['url']).hostname
+        metrics.registry.observe('http_request_seconds', time.perf_counter() - started, upstream=upstream)
+        metrics.registry.inc('http_requests', upstream=upstream, status=parsed.get('status', 'error'))
+        return parsed
+
+    @tasks.loop(seconds=30)
+    @metrics.timed_loop('check_news_feed')
+    async def check_news_feed(self):
+        if not self.bot.cluster.is_leader:
+            return
+        now = self.clock.utcnow()
+        due = [(source, feed) for source, feed in self.feeds.items() if feed['next_check'] <= now]
+        if not due:
+            return
+
+        rows = []
+        for source, feed in due:
+            found_new = False
+            try:
+                logging.debug("Fetching articles from %s feed: %s", source, feed['url'])
+                parsed = await self._fetch(feed)
+                if parsed.get('status') == 304:
+                    logging.info("Feed %s not modified since the last check.", source, extra={'idle': True})
+                    continue
+                if parsed.bozo:
+                    logging.error(f"Failed to parse feed {source}: {parsed.bozo_exception}")
                     continue
 
-                self.cursor.execute('SELECT COUNT(*) FROM news')
-                if self.cursor.fetchone()[0] == 0:
-                    logging.info("Database is empty, fetching the last 5 articles.")
-                    for entry in feed.entries[:5]:
-                        title = entry.title
-                        link = entry.link
-                        published = datetime(*entry.published_parsed[:6])
-                        try:
-                            self.cursor.execute('INSERT INTO news (title, link, published, sent, source) VALUES (?, ?, ?, ?, ?)', (title, link, published, 1, source))
-                            self.conn.commit()
-                            logging.info(f"Article '{title}' from {source} added to database and sending to channel.")
-
-                            channel = self.bot.get_channel(self.news_channel_id)
-                            if channel:
-                                embed = discord.Embed(title=title, url=link, description=f"Source: {source.capitalize()}", timestamp=published, color=0x3498db)
-                                embed.set_footer(text="EVE Online News")
-                                await channel.send(embed=embed)
-                                logging.info(f"Article '{title}' sent to channel: {channel.name}")
-                            else:
-                                logging.warning(f"Channel with ID {self.news_channel_id} not found.")
-                        except sqlite3.IntegrityError as e:
-                            logging.error(f"Integrity error while inserting news into database: {e}")
-                        except Exception as e:
-                            logging.error(f"Error while sending or inserting news article: {e}")
+                feed['etag'] = parsed.get('etag')
+                feed['modified'] = parsed.get('modified')
 
-                for entry in feed.entries:
+                new_entries = self._new_entries(parsed)
+                first_run = feed['last_checked'] is None
+                if first_run and new_entries:
+                    logging.info(f"First check of {source}, sending the last {INITIAL_ARTICLES} articles.")
+
+                # Post oldest first so the channel reads chronologically.
+                for index, (key, entry) in reversed(list(enumerate(new_entries))):
                     title = entry.title
                     link = entry.link
-                    published = datetime(*entry.published_parsed[:6])
+                    published_parsed = entry.get('published_parsed')
+                    published = datetime(*published_parsed[:6]) if published_parsed else now
 
-                    self.cursor.execute('SELECT * FROM news WHERE title = ? AND link = ?', (title, link))
-                    if not self.cursor.fetchone():
+                    if not first_run or index < INITIAL_ARTICLES:
                         try:
-                            self.cursor.execute('INSERT INTO news (title, link, published, sent, source) VALUES (?, ?, ?, ?, ?)', (title, link, published, 0, source))
-                            self.conn.commit()
-                            logging.info(f"New article '{title}' from {source} added to the database.")
-                        except sqlite3.IntegrityError as e:
-                            logging.error(f"Integrity error while inserting news into database: {e}")
-                        except Exception as e:
-                            logging.error(f"Error while inserting news into database: {e}")
-
-                    self.cursor.execute('SELECT * FROM news WHERE title = ? AND link = ? AND sent = 0', (title, link))
-                    if self.cursor.fetchone():
-                        try:
-                            channel = self.bot.get_channel(self.news_channel_id)
-                            if channel:
-                                embed = discord.Embed(title=title, url=link, description=f"Source: {source.capitalize()}", timestamp=published, color=0x3498db)
-                                embed.set_footer(text="EVE Online News")
-                                await channel.send(embed=embed)
-                                logging.info(f"News article '{title}' from {source} sent to channel: {channel.name}")
-
-                                self.cursor.execute('UPDATE news SET sent = 1 WHERE title = ? AND link = ?', (title, link))
-                                self.conn.commit()
-                            else:
-                                logging.warning(f"Channel with ID {self.news_channel_id} not found.")
+                            if not await self._send_entry(source, feed['channel_ids'], title, link, published):
+                                continue
                         except Exception as e:
                             logging.error(f"Error while sending news article to channel: {e}")
-                    else:
-                        logging.info(f"Article '{title}' from {source} already sent or exists in the database.")
+                            continue
 
-        except Exception as e:
-            logging.error(f"Error during news feed check: {e}")
+                    self.seen.add(key)
+                    rows.append((title, link, published, 1, source))
+                    found_new = True
+            except Exception as e:
+                logging.error(f"Error during news feed check for {source}: {e}")
+            finally:
+                self._reschedule(feed, found_new, now)
+                logging.debug("Next check of %s in %d minutes.", source, feed['interval'] // 60,
+                              extra={'source': source, 'interval': feed['interval']})
 
-    @tasks.loop(hours=1)
-    async def hourly_log(self):
-        logging.info("Hourly check log: Bot is running and checking for news updates.")
+        if rows:
+            try:
+                self.cursor.executemany('INSERT OR IGNORE INTO news (title, link, published, sent, source) VALUES (?, ?, ?, ?, ?)', rows)
+                self._save_feed_state()
+                self.conn.commit()
+                self.cursor.execute('SELECT COALESCE(MAX(id), 0) FROM news')
+                self.seen_max_id = self.cursor.fetchone()[0]
+                logging.info(f"Recorded {len(rows)} new articles in the database.")
+            except sqlite3.Error as e:
+                logging.error(f"Error while inserting news into database: {e}")
 
     @check_news_feed.before_loop
     async def before_check_news_feed(self):
         await self.bot.wait_until_ready()
 
+    @app_commands.command(name="add_feed", description="Register an RSS feed to post into a channel (Admin only)")
+    @app_commands.describe(source="Short name for the feed", url="RSS/Atom feed URL", channel="Channel to post new articles in")
+    async def add_feed(self, interaction: discord.Interaction, source: str, url: str, channel: discord.TextChannel):
+        if not self.settings.is_bot_admin(interaction.user.id):
+            await interaction.response.send_message("You do not have permission to manage news feeds.", ephemeral=True)
+            return
+
+        parsed = urlparse(url)
+        if parsed.scheme not in ('http', 'https') or not parsed.netloc:
+            await interaction.response.send_message("The feed URL must be an http:// or https:// address.", ephemeral=True)
+            return
+
+        feed = self.feeds.get(source)
+        if feed:
+            if feed['url'] != url:
+                await interaction.response.send_message(f"Feed `{source}` is already registered with a different URL.", ephemeral=True)
+                return
+            channel_ids = list(feed['channel_ids'])
+            if channel.id not in channel_ids:
+                channel_ids.append(channel.id)
+        else:
+            channel_ids = [channel.id]
+            feed = {
+                'url': url,
+                'channel_ids': channel_ids,
+                'interval': DEFAULT_INTERVAL,
+                'last_checked': None,
+                'etag': None,
+                'modified': None,
+                'next_check': self.clock.utcnow(),
+                'dirty': False
+            }
+
+        try:
+            self.cursor.execute('''INSERT INTO news_feeds (source, url, channel_ids, interval) VALUES (?, ?, ?, ?)
+                                   ON CONFLICT(source) DO UPDATE SET channel_ids = excluded.channel_ids''',
+                                (source, url, ','.join(str(channel_id) for channel_id in channel_ids), feed['interval']))
+            self.conn.commit()
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            logging.error(f"Failed to register feed {source}: {e}")
+            await interaction.response.send_message("An error occurred while registering the feed.", ephemeral=True)
+            return
+
+        # Only once the row is committed, so a failed write leaves the registry as it was.
+        feed['channel_ids'] = channel_ids
+        self.feeds[source] = feed
+        logging.info(f"Feed {source} ({url}) now posts to channels {feed['channel_ids']}")
+        await interaction.response.send_message(f"Feed `{source}` will post to {channel.mention}.", ephemeral=True)
+
+    @app_commands.command(name="remove_feed", description="Stop polling a registered RSS feed (Admin only)")
+    async def remove_feed(self, interaction: discord.Interaction, source: str):
+        if not self.settings.is_bot_admin(interaction.user.id):
+            await interaction.response.send_message("You do not have permission to manage news feeds.", ephemeral=True)
+            return
+
+        try:
+            self.cursor.execute('DELETE FROM news_feeds WHERE source = ?', (source,))
+            self.conn.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Failed to remove feed {source}: {e}")
+            await interaction.response.send_message("An error occurred while removing the feed.", ephemeral=True)
+            return
+
+        if self.feeds.pop(source, None) is None:
+            await interaction.response.send_message(f"No feed registered as `{source}`.", ephemeral=True)
+            return
+
+        logging.info(f"Feed {source} removed from the registry.")
+        await interaction.response.send_message(f"Feed `{source}` removed.", ephemeral=True)
+
+    @app_commands.command(name="list_feeds", description="List registered RSS feeds and their polling intervals (Admin only)")
+    async def list_feeds(self, interaction: discord.Interaction):
+        if not self.settings.is_bot_admin(interaction.user.id):
+            await interaction.response.send_message("You do not have permission to view news feeds.", ephemeral=True)
+            return
+
+        embed = discord.Embed(title="News Feeds", color=0x3498db)
+        for source, feed in sorted(self.feeds.items())[:25]:
+            channels = ", ".join(f"<#{channel_id}>" for channel_id in feed['channel_ids']) or "None"
+            embed.add_field(name=source, value=f"{feed['url']}\nChannels: {channels}\nEvery {feed['interval'] // 60} min", inline=False)
+        if not self.feeds:
+            embed.description = "No feeds registered."
+
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
 async def setup(bot):
     await bot.add_cog(NewsCog(bot))
@@ -1,18 +1,24 @@
+import ast
 import discord
 import sqlite3
 import logging
 from discord.ext import commands, tasks
 from discord import app_commands
-from datetime import datetime, timedelta
-import re
+from datetime import timezone
 import pytz
+from utils.ratelimit import rate_limited
+from utils.cluster import messageable
+from utils.outbound import DUE_BATCH, QueueFull, is_transient, route_of
+from utils import metrics
+from utils.timeparse import parse_when
 
 class PollCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.clock = bot.clock
 
         try:
-            self.conn = sqlite3.connect('chuck.db')
+            self.conn = metrics.connect('chuck.db')
             self.conn.row_factory = sqlite3.Row  
             self.cursor = self.conn.cursor()
             self.cursor.execute('''CREATE TABLE IF NOT EXISTS polls (
@@ -32,6 +38,7 @@ class PollCog(commands.Cog):
                                    UNIQUE(poll_id, user_id),
                                    FOREIGN KEY(poll_id) REFERENCES polls(id)
                                    )''')
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_polls_expires_at ON polls(expires_at)')
             self.conn.commit()
             logging.info("Connected to the polls database successfully.")
         except sqlite3.Error as e:
@@ -48,12 +55,13 @@ class PollCog(commands.Cog):
             logging.error(f"Error during cog unload: {e}")
 
     @app_commands.command(name="create_poll", description="Create a poll with a question and options.")
-    @app_commands.describe(duration="Duration for the poll (e.g., 10m for 10 minutes, 2h for 2 hours)",
+    @app_commands.describe(duration="How long the poll runs (e.g., 10m, 2h30m) or when it ends (e.g., at 18:00 EVE)",
                            question="The question for the poll",
                            option1="First option for the poll",
                            option2="Second option for the poll",
                            option3="Third option for the poll (optional)",
                            option4="Fourth option for the poll (optional)")
+    @rate_limited()
     async def create_poll(self, interaction: discord.Interaction, duration: str, question: str, option1: str, option2: str, option3: str = None, option4: str = None):
         await interaction.response.defer(ephemeral=True)
 
@@ -63,14 +71,13 @@ class PollCog(commands.Cog):
             await interaction.followup.send("You must provide between 2 and 10 options for the poll.", ephemeral=True)
             return
 
+        created_at = self.clock.utcnow()
         try:
-            duration_delta, duration_str = self.parse_duration(duration)
+            expires_at, duration_str = parse_when(duration, created_at.replace(tzinfo=timezone.utc))
         except ValueError as e:
             await interaction.followup.send(f"Invalid duration format: {e}", ephemeral=True)
             return
-
-        created_at = datetime.utcnow()
-        expires_at = created_at + duration_delta
+        expires_at = expires_at.replace(tzinfo=None)
 
         user_timezone = pytz.timezone('UTC')
         user_time = expires_at.replace(tzinfo=pytz.utc).astimezone(user_timezone)
@@ -106,47 +113,55 @@ class PollCog(commands.Cog):
         await interaction.followup.send("Poll created successfully.", ephemeral=True)
 
     @commands.Cog.listener()
-    async def on_reaction_add(self, reaction, user):
-        if user.bot:
+    async def on_raw_reaction_add(self, payload):
+        # Raw events work without the message cache, which the lean cache profile turns off.
+        if payload.user_id == self.bot.user.id or (payload.member and payload.member.bot):
             return
 
-        message_id = reaction.message.id
-        emoji = str(reaction.emoji)
+        message_id = payload.message_id
+        emoji = str(payload.emoji)
 
         self.cursor.execute('SELECT * FROM polls WHERE message_id = ?', (message_id,))
         poll = self.cursor.fetchone()
         if poll:
             poll_id = poll['id']
-            options = eval(poll['options'])
+            options = ast.literal_eval(poll['options'])
 
             if emoji in options:
-                self.cursor.execute('SELECT * FROM votes WHERE poll_id = ? AND user_id = ?', (poll_id, user.id))
+                self.cursor.execute('SELECT * FROM votes WHERE poll_id = ? AND user_id = ?', (poll_id, payload.user_id))
                 existing_vote = self.cursor.fetchone()
 
                 if existing_vote:
-                   
-                    poll_message = await reaction.message.channel.fetch_message(message_id)
-                    for reaction_item in poll_message.reactions:
-                        async for reacted_user in reaction_item.users():
-                            if reacted_user == user and reaction_item.emoji != emoji:
-                                await reaction_item.remove(user)
-                    
-                    self.cursor.execute('''UPDATE votes SET option = ? WHERE poll_id = ? AND user_id = ?''', (options[emoji], poll_id, user.id))
-                    logging.info(f"User {user.id} changed their vote in poll {poll_id} to {options[emoji]}")
+                    # Take back the reaction for the previous choice only.
+                    previous = next((option_emoji for option_emoji, option in options.items()
+                                     if option == existing_vote['option'] and option_emoji != emoji), None)
+                    if previous:
+                        poll_message = messageable(self.bot, payload.channel_id).get_partial_message(message_id)
+                        try:
+                            await poll_message.remove_reaction(previous, discord.Object(id=payload.user_id))
+                        except discord.HTTPException as e:
+                            logging.warning(f"Could not remove the previous vote reaction in poll {poll_id}: {e}")
+
+                    self.cursor.execute('''UPDATE votes SET option = ? WHERE poll_id = ? AND user_id = ?''', (options[emoji], poll_id, payload.user_id))
+                    logging.info(f"User {payload.user_id} changed their vote in poll {poll_id} to {options[emoji]}")
                 else:
                     
                     self.cursor.execute('''INSERT INTO votes (poll_id, user_id, option)
-                                           VALUES (?, ?, ?)''', (poll_id, user.id, options[emoji]))
-                    logging.info(f"Vote recorded for poll {poll_id} by user {user.id}")
+                                           VALUES (?, ?, ?)''', (poll_id, payload.user_id, options[emoji]))
+                    logging.info(f"Vote recorded for poll {poll_id} by user {payload.user_id}")
 
                 self.conn.commit()
 
     @tasks.loop(minutes=1)
+    @metrics.timed_loop('check_expired_polls')
     async def check_expired_polls(self):
-        now = datetime.utcnow()
-        self.cursor.execute('SELECT * FROM polls WHERE expires_at <= ?', (now,))
+        if not self.bot.cluster.is_leader:
+            return
+        now = self.clock.utcnow()
+        self.cursor.execute('SELECT * FROM polls WHERE expires_at <= ? ORDER BY expires_at LIMIT ?', (now, DUE_BATCH))
         expired_polls = self.cursor.fetchall()
 
+        finished = []
         for poll in expired_polls:
             poll_id = poll['id']
             channel_id = poll['channel_id']
@@ -170,63 +185,28 @@ class PollCog(commands.Cog):
 
             embed.set_footer(text="Chuck Norris had the poll and associated votes deleted from the database.")
 
-            channel = self.bot.get_channel(channel_id)
+            channel = messageable(self.bot, channel_id)
             if channel:
                 try:
                     poll_message = await channel.fetch_message(message_id)
-                    await poll_message.reply(embed=embed)
+                    await self.bot.outbound.submit('poll', route_of(channel), lambda: poll_message.reply(embed=embed))
                     logging.info(f"Poll results for poll {poll_id} sent to channel {channel_id}.")
-                except discord.HTTPException as e:
+                except (discord.HTTPException, QueueFull) as e:
                     logging.error(f"Failed to send poll results for poll {poll_id} to channel {channel_id}: {e}")
-
-            self.cursor.execute('DELETE FROM polls WHERE id = ?', (poll_id,))
-            self.cursor.execute('DELETE FROM votes WHERE poll_id = ?', (poll_id,))
+                    if is_transient(e):
+                        # Not delivered yet; the poll and its votes stay and are retried next tick.
+                        continue
+            finished.append((poll_id,))
+
+        if finished:
+            self.cursor.executemany('DELETE FROM polls WHERE id = ?', finished)
+            self.cursor.executemany('DELETE FROM votes WHERE poll_id = ?', finished)
             self.conn.commit()
-            logging.info(f"Poll {poll_id} and associated votes deleted from the database.")
+            logging.info(f"{len(finished)} expired polls and their votes deleted from the database.")
 
     @check_expired_polls.before_loop
     async def before_check_expired_polls(self):
         await self.bot.wait_until_ready()
 
-    def parse_duration(self, duration_str):
-        duration_regex = r'(?P<value>\d+)\s*(?P<unit>[a-zA-Z]+)'
-        matches = re.findall(duration_regex, duration_str)
-
-        if not matches:
-            raise ValueError("No valid duration units found.")
-
-        total_duration = timedelta()
-        duration_components = []
-
-        for value, unit in matches:
-            value = int(value)
-            unit = unit.lower()
-            if unit in ['s', 'sec', 'second', 'seconds']:
-                total_duration += timedelta(seconds=value)
-                duration_components.append(f"{value} Second{'s' if value > 1 else ''}")
-            elif unit in ['m', 'min', 'minute', 'minutes']:
-                total_duration += timedelta(minutes=value)
-                duration_components.append(f"{value} Minute{'s' if value > 1 else ''}")
-            elif unit in ['h', 'hr', 'hour', 'hours']:
-                total_duration += timedelta(hours=value)
-                duration_components.append(f"{value} Hour{'s' if value > 1 else ''}")
-            elif unit in ['d', 'day', 'days']:
-                total_duration += timedelta(days=value)
-                duration_components.append(f"{value} Day{'s' if value > 1 else ''}")
-            elif unit in ['w', 'week', 'weeks']:
-                total_duration += timedelta(weeks=value)
-                duration_components.append(f"{value} Week{'s' if value > 1 else ''}")
-            elif unit in ['mo', 'month', 'months']:
-                total_duration += timedelta(days=value * 30)  
-                duration_components.append(f"{value} Month{'s' if value > 1 else ''}")
-            elif unit in ['y', 'yr', 'year', 'years']:
-                total_duration += timedelta(days=value * 365)  
-                duration_components.append(f"{value} Year{'s' if value > 1 else ''}")
-            else:
-                raise ValueError(f"Unknown time unit: {unit}")
-
-        duration_str = " ".join(duration_components)
-        return total_duration, duration_str
-
 async def setup(bot):
     await bot.add_cog(PollCog(bot))
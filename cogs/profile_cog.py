@@ -0,0 +1,68 @@
+import discord
+import logging
+from discord.ext import commands
+from discord import app_commands
+from utils import loopmon, profiling
+
+MAX_PROFILE_SECONDS = 600
+
+class ProfileCog(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.settings = bot.settings
+
+    def profile_targets(self):
+        targets = set(self.bot.cogs)
+        targets.update(command.qualified_name for command in self.bot.tree.walk_commands())
+        targets.update(label for label in loopmon.labels if label.startswith('loop:'))
+        return sorted(targets)
+
+    @app_commands.command(name="profile", description="Profile a cog, command or background loop (Admin only)")
+    @app_commands.describe(target="Cog name, command name or loop:<name>",
+                           mode="Sampling attributes time to the target only; cProfile counts every call",
+                           seconds="How long to profile for",
+                           invocations="Stop early after this many runs of the target (0 = no limit)")
+    @app_commands.choices(mode=[app_commands.Choice(name="Sampling", value="sampling"),
+                                app_commands.Choice(name="cProfile", value="cprofile")])
+    async def profile(self, interaction: discord.Interaction, target: str, mode: str = 'sampling',
+                      seconds: int = 30, invocations: int = 0):
+        if not self.settings.is_bot_admin(interaction.user.id):
+            await interaction.response.send_message("You do not have permission to profile the bot.", ephemeral=True)
+            return
+        if not 0 < seconds <= MAX_PROFILE_SECONDS or invocations < 0:
+            await interaction.response.send_message(f"Seconds must be between 1 and {MAX_PROFILE_SECONDS}, invocations 0 or more.", ephemeral=True)
+            return
+        if profiling.session is not None:
+            await interaction.response.send_message(f"Already profiling {profiling.session.target}.", ephemeral=True)
+            return
+
+        await interaction.response.defer(ephemeral=True)
+        logging.info(f"Profiling {target} ({mode}) for {seconds}s, started by {interaction.user.id}")
+        try:
+            session = await profiling.run(target, mode, seconds, invocations)
+        except (RuntimeError, OSError) as e:
+            logging.error(f"Profiling {target} failed: {e}")
+            await interaction.followup.send(f"Profiling failed: {e}", ephemeral=True)
+            return
+
+        if mode == 'sampling':
+            summary = f"{session.sample_count} samples over {session.calls} invocations"
+        else:
+            summary = f"{session.calls} invocations"
+        embed = discord.Embed(title=f"Profile of {target}", description=f"{summary}\nSaved to `{session.path}`", color=0x3498db)
+        top = session.top_functions()
+        for function, detail in top:
+            embed.add_field(name=function[:256], value=detail, inline=False)
+        if not top:
+            embed.add_field(name="No data", value=f"{target} did not run while profiling.", inline=False)
+
+        await interaction.followup.send(embed=embed, ephemeral=True)
+
+    @profile.autocomplete('target')
+    async def target_autocomplete(self, interaction: discord.Interaction, current: str):
+        current = current.lower()
+        return [app_commands.Choice(name=target, value=target)
+                for target in self.profile_targets() if current in target.lower()][:25]
+
+async def setup(bot):
+    await bot.add_cog(ProfileCog(bot))
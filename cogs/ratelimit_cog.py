@@ -0,0 +1,61 @@
+import discord
+import logging
+from discord.ext import commands
+from discord import app_commands
+from utils import metrics
+from utils.ratelimit import RateLimiter, DEFAULT_LIMITS
+
+class RateLimitCog(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.settings = bot.settings
+        self.limiter = RateLimiter()
+        self.bot.rate_limiter = self.limiter
+        metrics.registry.gauge_callback('rate_limit_buckets', lambda: len(self.limiter.buckets), help_text="Active rate limit buckets")
+        logging.info("Rate limiter ready.")
+
+    def cog_unload(self):
+        if getattr(self.bot, 'rate_limiter', None) is self.limiter:
+            del self.bot.rate_limiter
+        self.limiter.close()
+
+    @app_commands.command(name="set_rate_limit", description="Set how often a command may be used per user in this server (Admin only)")
+    @app_commands.describe(command="Command name, e.g. confess",
+                           burst="Uses allowed in a burst (0 restores the default)",
+                           per_seconds="Seconds to refill the whole burst")
+    @app_commands.choices(command=[app_commands.Choice(name=name, value=name) for name in DEFAULT_LIMITS])
+    async def set_rate_limit(self, interaction: discord.Interaction, command: str, burst: int, per_seconds: int = 60):
+        if not self.settings.is_admin(interaction):
+            await interaction.response.send_message("You do not have permission to change rate limits.", ephemeral=True)
+            return
+        if not interaction.guild_id:
+            await interaction.response.send_message("Rate limits can only be set inside a server.", ephemeral=True)
+            return
+        if burst < 0 or per_seconds <= 0:
+            await interaction.response.send_message("Burst must be 0 or more and the refill period must be positive.", ephemeral=True)
+            return
+
+        self.limiter.set_limit(interaction.guild_id, command, burst, per_seconds)
+        burst, per_seconds = self.limiter.limit_for(interaction.guild_id, command)
+        logging.info(f"Rate limit for /{command} in guild {interaction.guild_id} set to {burst} per {per_seconds}s by {interaction.user.id}")
+        await interaction.response.send_message(f"/{command} is now limited to {burst} uses per {per_seconds} seconds per user.", ephemeral=True)
+
+    @app_commands.command(name="rate_limit_stats", description="Show allowed, throttled and duplicate counts per command (Admin only)")
+    async def rate_limit_stats(self, interaction: discord.Interaction):
+        if not self.settings.is_admin(interaction):
+            await interaction.response.send_message("You do not have permission to view rate limit statistics.", ephemeral=True)
+            return
+
+        embed = discord.Embed(title="Rate Limit Statistics", color=0x3498db)
+        for command in sorted({command for command, _ in self.limiter.stats}):
+            allowed = self.limiter.stats[(command, 'allowed')]
+            throttled = self.limiter.stats[(command, 'throttled')]
+            duplicate = self.limiter.stats[(command, 'duplicate')]
+            embed.add_field(name=f"/{command}", value=f"Allowed: {allowed}\nThrottled: {throttled}\nDuplicates: {duplicate}", inline=True)
+        if not self.limiter.stats:
+            embed.description = "No rate-limited commands have been used yet."
+
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+async def setup(bot):
+    await bot.add_cog(RateLimitCog(bot))
@@ -4,14 +4,19 @@ import asyncio
 import logging
 from discord.ext import commands, tasks
 from discord import app_commands
-from datetime import datetime, timedelta
-import re
 import pytz
+from datetime import datetime
+from utils.ratelimit import rate_limited
+from utils.outbound import DUE_BATCH, QueueFull, is_transient
+from utils import metrics
+from utils.recurrence import Recurrence
+from utils.timeparse import parse_when
 
 class RemindCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.conn = sqlite3.connect('chuck.db')
+        self.clock = bot.clock
+        self.conn = metrics.connect('chuck.db')
         self.conn.row_factory = sqlite3.Row
         self.cursor = self.conn.cursor()
         self.cursor.execute('''CREATE TABLE IF NOT EXISTS reminders (
@@ -20,8 +25,13 @@ class RemindCog(commands.Cog):
                                channel_id INTEGER,
                                message TEXT,
                                remind_time DATETIME,
-                               dm BOOLEAN
+                               dm BOOLEAN,
+                               recurrence TEXT
                                )''')
+        self.cursor.execute('PRAGMA table_info(reminders)')
+        if 'recurrence' not in {column['name'] for column in self.cursor.fetchall()}:
+            self.cursor.execute('ALTER TABLE reminders ADD COLUMN recurrence TEXT')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_reminders_remind_time ON reminders(remind_time)')
         self.conn.commit()
         
         logging.info("Connected to the reminders database successfully.")
@@ -33,86 +43,96 @@ class RemindCog(commands.Cog):
         self.conn.close()
 
     @app_commands.command(name="remind", description="Set a reminder with a specified time and message")
-    async def remind(self, interaction: discord.Interaction, time: str, message: str):
-        time_pattern = r'(?P<value>\d+)\s*(?P<unit>s|sec|seconds?|m|mn|min|minutes?|h|hr|hrs?|hours?|d|days?|M|months?|y|years?)'
-        matches = re.findall(time_pattern, time, re.IGNORECASE)
-        if not matches:
-            await interaction.response.send_message("Invalid time format. Use numbers followed by s, sec, m, min, h, hr, d, days, M, months, y, years, etc.", ephemeral=True)
+    @app_commands.describe(time="When to remind you (e.g., 1h30m, at 18:00 EVE, tomorrow 11:00, after downtime)",
+                           repeat="Repeat the reminder (e.g., every 6h, daily, every mon,thu at 19:00 EVE until 2025-12-31)")
+    @rate_limited()
+    async def remind(self, interaction: discord.Interaction, time: str, message: str, repeat: str = None):
+        try:
+            remind_time, _ = parse_when(time, self.clock.now(pytz.UTC))
+            recurrence = Recurrence.parse(repeat).anchored(remind_time) if repeat else None
+        except ValueError as e:
+            await interaction.response.send_message(f"Invalid time: {e}", ephemeral=True)
+            return
+        if recurrence and recurrence.until and recurrence.until <= remind_time:
+            await interaction.response.send_message("Invalid time: the repeat ends before the first reminder.", ephemeral=True)
             return
-
-        remind_time = datetime.now(pytz.UTC) 
-        for value, unit in matches:
-            value = int(value)
-            unit = unit.lower()
-            if unit in ['s', 'sec', 'second', 'seconds']:
-                remind_time += timedelta(seconds=value)
-            elif unit in ['m', 'mn', 'min', 'minute', 'minutes']:
-                remind_time += timedelta(minutes=value)
-            elif unit in ['h', 'hr', 'hrs', 'hour', 'hours']:
-                remind_time += timedelta(hours=value)
-            elif unit in ['d', 'day', 'days']:
-                remind_time += timedelta(days=value)
-            elif unit in ['M', 'month', 'months']:
-                remind_time += timedelta(days=value * 30)
-            elif unit in ['y', 'year', 'years']:
-                remind_time += timedelta(days=value * 365)
 
         dm = True
         channel_id = None
 
-        self.cursor.execute('INSERT INTO reminders (user_id, channel_id, message, remind_time, dm) VALUES (?, ?, ?, ?, ?)',
-                            (interaction.user.id, channel_id, message, remind_time, dm))
+        self.cursor.execute('INSERT INTO reminders (user_id, channel_id, message, remind_time, dm, recurrence) VALUES (?, ?, ?, ?, ?, ?)',
+                            (interaction.user.id, channel_id, message, remind_time, dm, recurrence.dumps() if recurrence else None))
         self.conn.commit()
+        reminder_id = self.cursor.lastrowid
         logging.info(f"Reminder set for user {interaction.user.id} at {remind_time}")
 
-        response = f"Reminder set for {remind_time.strftime('%Y-%m-%d %H:%M:%S')} UTC"
+        response = f"Reminder {reminder_id} set for {remind_time.strftime('%Y-%m-%d %H:%M:%S')} UTC"
+        if recurrence:
+            response += f", repeating {recurrence.describe()}. Stop it with `/cancel_reminder {reminder_id}`."
         await interaction.response.send_message(response, ephemeral=True)
 
+    @app_commands.command(name="cancel_reminder", description="Cancel one of your reminders, including all its repeats.")
+    async def cancel_reminder(self, interaction: discord.Interaction, reminder_id: int):
+        self.cursor.execute('DELETE FROM reminders WHERE id = ? AND user_id = ?', (reminder_id, interaction.user.id))
+        self.conn.commit()
+        if self.cursor.rowcount:
+            logging.info(f"Canceled reminder {reminder_id} for user {interaction.user.id}")
+            await interaction.response.send_message(f"Reminder {reminder_id} canceled.", ephemeral=True)
+        else:
+            await interaction.response.send_message(f"You have no reminder with ID {reminder_id}.", ephemeral=True)
+
     @tasks.loop(minutes=1)
+    @metrics.timed_loop('check_reminders')
     async def check_reminders(self):
-        logging.info("Checking for reminders...")
-        now = datetime.now(pytz.UTC)
-        logging.info(f"Current time for checking: {now}")
-
-        self.cursor.execute('SELECT * FROM reminders')
-        reminders = self.cursor.fetchall()
-        logging.info(f"Total reminders in database: {len(reminders)}")
-
-        self.cursor.execute('SELECT id, user_id, message FROM reminders WHERE remind_time <= ?', (now,))
+        if not self.bot.cluster.is_leader:
+            return
+        now = self.clock.now(pytz.UTC)
+        self.cursor.execute('''SELECT id, user_id, message, remind_time, recurrence FROM reminders
+                               WHERE remind_time <= ? ORDER BY remind_time LIMIT ?''', (now, DUE_BATCH))
         due_reminders = self.cursor.fetchall()
-        logging.info(f"Found {len(due_reminders)} reminders to notify.")
-
-        for reminder in due_reminders:
-            reminder_id = reminder['id']
-            user_id = reminder['user_id']
-            message = reminder['message']
-
-            logging.info(f"Attempting to send reminder {reminder_id} to user {user_id}")
-            user = self.bot.get_user(user_id)
-
-            if user is None:
-                logging.warning(f"User {user_id} not found in cache. Attempting to fetch from API.")
-                try:
-                    user = await self.bot.fetch_user(user_id)
-                    logging.info(f"User {user_id} successfully fetched from API.")
-                except discord.DiscordException as e:
-                    logging.error(f"Failed to fetch user {user_id}: {e}")
-                    continue
-
-            try:
-                if user:
-                    await user.send(f"Reminder: {message}")
-                    logging.info(f"Reminder {reminder_id} sent to user {user_id} via DM.")
-                else:
-                    logging.warning(f"Unable to send reminder to user {user_id}, user object is None.")
-            except discord.Forbidden:
-                logging.error(f"Cannot send DM to user {user_id}. Permission denied.")
-            except discord.HTTPException as e:
-                logging.error(f"Failed to send reminder {reminder_id} to user {user_id}: {e}")
-
-            self.cursor.execute('DELETE FROM reminders WHERE id = ?', (reminder_id,))
-            self.conn.commit()
-            logging.info(f"Reminder {reminder_id} deleted from database.")
+        if not due_reminders:
+            logging.info("No reminders due.", extra={'idle': True})
+            return
+        logging.info("Found %d reminders to notify.", len(due_reminders), extra={'due': len(due_reminders)})
+
+        sent = await asyncio.gather(*(self._send_reminder(reminder, now) for reminder in due_reminders))
+        sent = [result for result in sent if result is not None]
+        # One transaction for the whole batch rather than a commit per reminder.
+        # Repeating reminders move on to their next occurrence; the rest are done.
+        self.cursor.executemany('UPDATE reminders SET remind_time = ? WHERE id = ?',
+                                [(next_time, reminder_id) for reminder_id, next_time in sent if next_time])
+        self.cursor.executemany('DELETE FROM reminders WHERE id = ?', [(reminder_id,) for reminder_id, next_time in sent if not next_time])
+        self.conn.commit()
+
+    def _next_occurrence(self, reminder, now):
+        recurrence = Recurrence.loads(reminder['recurrence'])
+        if recurrence is None:
+            return None
+        return recurrence.next_after(datetime.fromisoformat(reminder['remind_time']), now)
+
+    async def _send_reminder(self, reminder, now):
+        """DM one reminder; returns its ID and next occurrence, if any, once it has been handled, or None to retry it."""
+        reminder_id = reminder['id']
+        user_id = reminder['user_id']
+        message = reminder['message']
+        next_time = self._next_occurrence(reminder, now)
+
+        content = f"Reminder: {message}"
+        if next_time:
+            content += f"\nNext reminder <t:{int(next_time.timestamp())}:R>; stop with `/cancel_reminder {reminder_id}`."
+        try:
+            await self.bot.outbound.send_dm('reminder', self.bot, user_id, content)
+            logging.info("Reminder %s sent to user %s via DM.", reminder_id, user_id,
+                         extra={'reminder_id': reminder_id, 'user_id': user_id})
+        except discord.Forbidden:
+            logging.error(f"Cannot send DM to user {user_id}. Permission denied.")
+        except (discord.HTTPException, QueueFull) as e:
+            logging.error(f"Failed to send reminder {reminder_id} to user {user_id}: {e}")
+            if is_transient(e):
+                # Not delivered yet; the reminder stays due and is retried next tick.
+                return
+
+        return reminder_id, next_time
 
     @check_reminders.before_loop
     async def before_check_reminders(self):
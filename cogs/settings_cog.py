@@ -0,0 +1,80 @@
+import discord
+import logging
+from discord.ext import commands, tasks
+from discord import app_commands
+from utils.settings import SETTINGS, CHANNEL_SETTINGS
+
+class SettingsCog(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.settings = bot.settings
+        self.refresh_settings.start()
+
+    def cog_unload(self):
+        self.refresh_settings.cancel()
+
+    @tasks.loop(seconds=30)
+    async def refresh_settings(self):
+        # Pick up changes made by other cluster nodes.
+        self.settings.refresh_if_changed()
+
+    @staticmethod
+    def _check_channel(interaction, channel_id):
+        """Channel settings must name a text channel of the guild they are set in."""
+        channel = interaction.guild.get_channel(channel_id) if interaction.guild else None
+        if not isinstance(channel, discord.TextChannel):
+            raise ValueError("That is not a text channel in this server.")
+
+    @app_commands.command(name="settings", description="Show this server's bot settings (Admin only)")
+    async def show_settings(self, interaction: discord.Interaction):
+        if not interaction.guild_id:
+            await interaction.response.send_message("Settings can only be viewed inside a server.", ephemeral=True)
+            return
+        if not self.settings.is_admin(interaction):
+            await interaction.response.send_message("You do not have permission to view settings.", ephemeral=True)
+            return
+
+        embed = discord.Embed(title="Server Settings", color=0x3498db)
+        for key, (_, _, fmt, description) in SETTINGS.items():
+            value = self.settings.get(interaction.guild_id, key)
+            embed.add_field(name=key, value=f"{fmt(value) if value is not None else '*not set*'}\n{description}", inline=False)
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @app_commands.command(name="set_setting", description="Change one of this server's bot settings (Admin only)")
+    @app_commands.describe(key="Setting to change", value="New value: an ID, a #channel or @user mention, or comma separated IDs")
+    @app_commands.choices(key=[app_commands.Choice(name=key, value=key) for key in SETTINGS])
+    async def set_setting(self, interaction: discord.Interaction, key: str, value: str):
+        if not interaction.guild_id:
+            await interaction.response.send_message("Settings can only be changed inside a server.", ephemeral=True)
+            return
+        if not self.settings.may_change(interaction, key):
+            await interaction.response.send_message("You do not have permission to change this setting.", ephemeral=True)
+            return
+
+        try:
+            if key in CHANNEL_SETTINGS:
+                self._check_channel(interaction, SETTINGS[key][1](value))
+            stored = self.settings.set(interaction.guild_id, key, value)
+        except ValueError as e:
+            await interaction.response.send_message(f"Invalid value for {key}: {e}", ephemeral=True)
+            return
+
+        logging.info(f"Setting {key} for guild {interaction.guild_id} set to {stored} by {interaction.user.id}")
+        await interaction.response.send_message(f"{key} is now {SETTINGS[key][2](stored)}.", ephemeral=True)
+
+    @app_commands.command(name="reset_setting", description="Clear one of this server's bot settings (Admin only)")
+    @app_commands.choices(key=[app_commands.Choice(name=key, value=key) for key in SETTINGS])
+    async def reset_setting(self, interaction: discord.Interaction, key: str):
+        if not interaction.guild_id:
+            await interaction.response.send_message("Settings can only be changed inside a server.", ephemeral=True)
+            return
+        if not self.settings.may_change(interaction, key):
+            await interaction.response.send_message("You do not have permission to change this setting.", ephemeral=True)
+            return
+
+        self.settings.reset(interaction.guild_id, key)
+        logging.info(f"Setting {key} for guild {interaction.guild_id} cleared by {interaction.user.id}")
+        await interaction.response.send_message(f"{key} has been cleared.", ephemeral=True)
+
+async def setup(bot):
+    await bot.add_cog(SettingsCog(bot))
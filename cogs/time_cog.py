@@ -2,73 +2,346 @@ import discord
 import datetime
 import pytz
 import logging
-import requests 
+import aiohttp
+import asyncio
+import sqlite3
+import re
+from email.utils import parsedate_to_datetime
 from discord.ext import commands
 from discord import app_commands
-from decouple import config
+from utils.tz_index import ZoneIndex
+from utils import loopmon, metrics
+
+STATUS_URL = "https://esi.evetech.net/latest/status/"
+STATUS_MIN_REFRESH = 30
+STATUS_MAX_REFRESH = 300
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+MAX_ZONES = 20
+
+ZONED_TIME_PATTERN = re.compile(
+    r'^(?:(?P<date>\d{4}-\d{2}-\d{2})\s+)?(?P<hour>\d{1,2})(?::(?P<minute>\d{2}))?\s*(?P<ampm>am|pm)?\s*(?P<zone>.*?)\s*$',
+    re.IGNORECASE)
+ZONED_TIME_PREFIX = re.compile(r'^\s*(?P<head>(?:\d{4}-\d{2}-\d{2}\s+)?\d{1,2}(?::\d{2})?\s*(?:am|pm)?)\s*', re.IGNORECASE)
+
+DEFAULT_TIME_ZONES = {
+    'AEST': 'Australia/Sydney',
+    'EST': 'America/New_York',
+    'CST': 'America/Chicago',
+    'MST': 'America/Denver',
+    'PST': 'America/Los_Angeles'
+}
 
 class TimeCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.allowed_channel_id = int(config('ALLOWED_CHANNEL_ID'))
+        self.clock = bot.clock
 
-    @app_commands.command(name="time", description="Get the current date/time across various time zones")
-    async def time(self, interaction: discord.Interaction):
-        current_time_utc = datetime.datetime.utcnow()
-        time_format = '%Y-%m-%d %H:%M:%S'
-
-        utc_timezone = pytz.timezone('UTC')
-        current_time_utc = utc_timezone.localize(current_time_utc)
-        time_str_utc = current_time_utc.strftime(time_format)
-
-        time_zones = {
-            'AEST': 'Australia/Sydney',
-            'EST': 'America/New_York',
-            'CST': 'America/Chicago',
-            'MST': 'America/Denver',
-            'PST': 'America/Los_Angeles'
+        # Last known Tranquility status. /time only ever reads this; the
+        # poller below is the only thing that talks to ESI.
+        self.status = {
+            'players': None,
+            'server_version': None,
+            'vip': False,
+            'fetched_at': None,
+            'stale': True,
+            'version': 0
         }
+        self.status_failures = 0
+        # Wall-clock time of the next scheduled ESI refresh, kept across restarts.
+        self.next_refresh_at = None
+        self._restore_status(self.bot.snapshot.restore('time_status'))
+        self.bot.snapshot.register('time_status', self._snapshot_status)
+
+        # Zone objects are resolved once here instead of on every /time.
+        self.default_zones = [(label, pytz.timezone(tz)) for label, tz in DEFAULT_TIME_ZONES.items()]
+        self.guild_zones = {}
+        self.render_cache = {}
+        self.render_second = None
+        self.zone_index = ZoneIndex()
+
+        try:
+            self.conn = metrics.connect('chuck.db')
+            self.cursor = self.conn.cursor()
+            self.cursor.execute('''CREATE TABLE IF NOT EXISTS guild_time_zones (
+                                   guild_id INTEGER,
+                                   position INTEGER,
+                                   label TEXT,
+                                   tz TEXT,
+                                   PRIMARY KEY(guild_id, position)
+                                   )''')
+            self.conn.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Database error: {e}")
+        self._load_guild_zones()
+
+        self.status_task = self.bot.loop.create_task(self.poll_status())
+
+    def cog_unload(self):
+        self.bot.snapshot.unregister('time_status')
+        if self.status_task:
+            self.status_task.cancel()
+        if self.conn:
+            self.conn.close()
+
+    def _load_guild_zones(self):
+        try:
+            self.cursor.execute('SELECT guild_id, label, tz FROM guild_time_zones ORDER BY guild_id, position')
+            for guild_id, label, tz in self.cursor.fetchall():
+                self.guild_zones.setdefault(guild_id, []).append((label, pytz.timezone(tz)))
+            logging.info(f"Loaded time zone lists for {len(self.guild_zones)} guilds.")
+        except (sqlite3.Error, pytz.UnknownTimeZoneError) as e:
+            logging.error(f"Failed to load guild time zones: {e}")
+
+    def zones_for(self, guild_id):
+        return self.guild_zones.get(guild_id, self.default_zones)
 
+    def render_time_embed(self, guild_id):
+        """Build the /time embed, reusing the render for the same guild, second and status."""
+        now = self.clock.now(pytz.utc).replace(microsecond=0)
+        second = int(now.timestamp())
+        if second != self.render_second:
+            self.render_cache.clear()
+            self.render_second = second
+
+        key = (guild_id, self.status['version'])
+        embed = self.render_cache.get(key)
+        if embed is not None:
+            return embed
+
+        time_str_utc = now.strftime(TIME_FORMAT)
         embed = discord.Embed(
             title="Current Date/Time",
             description=f"**Eve Time:** [**{time_str_utc}**](https://time.is/UTC)",
             color=0x3498db
         )
 
-        for zone, tz in time_zones.items():
-            other_timezone = pytz.timezone(tz)
-            current_time_other_zone = current_time_utc.astimezone(other_timezone)
-            time_str_other_zone = current_time_other_zone.strftime(time_format)
-            embed.add_field(name=zone, value=time_str_other_zone, inline=False)
-
-        # Fetch and add the number of users online in EVE Online
-        users_online = self.fetch_users_online()
-        embed.add_field(
-            name="EVE Online Users Online",
-            value=f"**{users_online}** players",
-            inline=False
+        for zone, tz in self.zones_for(guild_id):
+            embed.add_field(name=zone, value=now.astimezone(tz).strftime(TIME_FORMAT), inline=False)
+
+        self.add_status_field(embed)
+        self.render_cache[key] = embed
+        return embed
+
+    @app_commands.command(name="time", description="Get the current date/time across various time zones")
+    @app_commands.describe(zone="Show the time in a specific zone, e.g. 'Europe/Berlin' or 'AU TZ'")
+    async def time(self, interaction: discord.Interaction, zone: str = None):
+        if zone:
+            tz_name = self.zone_index.resolve(zone)
+            if tz_name is None:
+                await interaction.response.send_message(f"Unknown time zone `{zone}`. Pick one of the suggestions.", ephemeral=True)
+                return
+            embed = self.render_zone_embed(zone, tz_name)
+        else:
+            embed = self.render_time_embed(interaction.guild_id)
+
+        await interaction.response.send_message(embed=embed)
+        # command_seconds already counts uses; this is only for tracing a single user.
+        logging.debug("Time command used by %s in guild %s", interaction.user.id, interaction.guild_id or 'DM')
+
+    def render_zone_embed(self, label, tz_name):
+        now = self.clock.now(pytz.utc).replace(microsecond=0)
+        embed = discord.Embed(
+            title="Current Date/Time",
+            description=f"**Eve Time:** [**{now.strftime(TIME_FORMAT)}**](https://time.is/UTC)",
+            color=0x3498db
         )
+        embed.add_field(name=f"{label} ({tz_name})", value=now.astimezone(pytz.timezone(tz_name)).strftime(TIME_FORMAT), inline=False)
+        return embed
+
+    @time.autocomplete('zone')
+    async def zone_autocomplete(self, interaction: discord.Interaction, current: str):
+        return [app_commands.Choice(name=self._choice_label(label, tz), value=label)
+                for label, tz in self.zone_index.search(current)]
+
+    @staticmethod
+    def _choice_label(label, tz):
+        return label if label == tz else f"{label} ({tz})"
+
+    @app_commands.command(name="convert", description="Convert a time between zones, e.g. '18:00 ET' to EVE")
+    @app_commands.describe(time="Time and zone to convert from, e.g. '18:00 ET' or '2024-06-01 18:00 Europe/Berlin'",
+                           to="Zone to convert to (defaults to EVE time)")
+    async def convert(self, interaction: discord.Interaction, time: str, to: str = 'EVE'):
+        try:
+            source_time = self.parse_zoned_time(time)
+        except ValueError as e:
+            await interaction.response.send_message(f"Could not read `{time}`: {e}", ephemeral=True)
+            return
+
+        target_tz = self.zone_index.resolve(to)
+        if target_tz is None:
+            await interaction.response.send_message(f"Unknown time zone `{to}`. Pick one of the suggestions.", ephemeral=True)
+            return
+
+        converted = source_time.astimezone(pytz.timezone(target_tz))
+        embed = discord.Embed(title="Time Conversion", color=0x3498db)
+        embed.add_field(name="From", value=source_time.strftime('%Y-%m-%d %H:%M %Z'), inline=True)
+        embed.add_field(name=f"To {to}", value=converted.strftime('%Y-%m-%d %H:%M %Z'), inline=True)
+        embed.add_field(name="Your local time", value=f"<t:{int(source_time.timestamp())}:F>", inline=False)
 
         await interaction.response.send_message(embed=embed)
+        logging.info(f"Convert command used by {interaction.user.name}: '{time}' to {to}")
+
+    def parse_zoned_time(self, text):
+        """Parse '[YYYY-MM-DD] HH:MM [zone]' into an aware datetime; the zone defaults to EVE time."""
+        match = ZONED_TIME_PATTERN.match(text.strip())
+        if not match:
+            raise ValueError("expected a time like 18:00 followed by a zone")
+
+        zone = match.group('zone') or 'EVE'
+        tz_name = self.zone_index.resolve(zone)
+        if tz_name is None:
+            raise ValueError(f"unknown time zone '{zone}'")
+        tz = pytz.timezone(tz_name)
+
+        hour, minute = int(match.group('hour')), int(match.group('minute') or 0)
+        if match.group('ampm'):
+            if hour > 12:
+                raise ValueError("hour must be 1-12 with am/pm")
+            hour = hour % 12 + (12 if match.group('ampm').lower() == 'pm' else 0)
+        if hour > 23 or minute > 59:
+            raise ValueError("hour or minute out of range")
+
+        if match.group('date'):
+            day = datetime.datetime.strptime(match.group('date'), '%Y-%m-%d').date()
+        else:
+            day = self.clock.now(tz).date()
+        return tz.localize(datetime.datetime.combine(day, datetime.time(hour, minute)))
+
+    @convert.autocomplete('time')
+    async def convert_time_autocomplete(self, interaction: discord.Interaction, current: str):
+        match = ZONED_TIME_PREFIX.match(current)
+        if not match:
+            return []
+        head, rest = match.group('head').rstrip(), current[match.end():]
+        return [app_commands.Choice(name=f"{head} {self._choice_label(label, tz)}"[:100], value=f"{head} {label}")
+                for label, tz in self.zone_index.search(rest)]
+
+    @convert.autocomplete('to')
+    async def convert_to_autocomplete(self, interaction: discord.Interaction, current: str):
+        return [app_commands.Choice(name=self._choice_label(label, tz), value=label)
+                for label, tz in self.zone_index.search(current)]
+
+    @app_commands.command(name="set_time_zones", description="Set the time zones shown by /time in this server")
+    @app_commands.describe(zones="Comma-separated LABEL=Area/City pairs, e.g. 'EST=America/New_York, CET=Europe/Berlin', or 'default'")
+    async def set_time_zones(self, interaction: discord.Interaction, zones: str):
+        if not interaction.guild or not interaction.user.guild_permissions.manage_guild:
+            await interaction.response.send_message("You need the Manage Server permission to change the time zones.", ephemeral=True)
+            return
 
-        # Log the event
-        logging.info(f"Time command used by {interaction.user.name} in server {interaction.guild.name if interaction.guild else 'DM'}")
+        guild_id = interaction.guild_id
+        parsed = []
+        if zones.strip().lower() != 'default':
+            for item in zones.split(','):
+                label, sep, tz = item.partition('=')
+                label, tz = label.strip(), tz.strip()
+                if not sep or not label or tz not in pytz.all_timezones_set:
+                    await interaction.response.send_message(f"Invalid zone entry `{item.strip()}`. Use LABEL=Area/City with an IANA time zone name.", ephemeral=True)
+                    return
+                parsed.append((label, tz))
+            if not parsed or len(parsed) > MAX_ZONES:
+                await interaction.response.send_message(f"Please provide between 1 and {MAX_ZONES} time zones.", ephemeral=True)
+                return
 
-    def fetch_users_online(self):
-        """
-        Fetch the number of users currently online in EVE Online.
-        """
         try:
-            response = requests.get("https://esi.evetech.net/latest/status/")
-            if response.status_code == 200:
-                data = response.json()
-                return data.get('players', 'N/A')
-            else:
-                logging.error(f"Failed to fetch users online: {response.status_code}")
-                return 'N/A'
-        except requests.RequestException as e:
-            logging.error(f"Error fetching users online: {e}")
-            return 'N/A'
+            self.cursor.execute('DELETE FROM guild_time_zones WHERE guild_id = ?', (guild_id,))
+            self.cursor.executemany('INSERT INTO guild_time_zones (guild_id, position, label, tz) VALUES (?, ?, ?, ?)',
+                                    [(guild_id, position, label, tz) for position, (label, tz) in enumerate(parsed)])
+            self.conn.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Failed to save time zones for guild {guild_id}: {e}")
+            await interaction.response.send_message("An error occurred while saving the time zones.", ephemeral=True)
+            return
+
+        if parsed:
+            self.guild_zones[guild_id] = [(label, pytz.timezone(tz)) for label, tz in parsed]
+        else:
+            self.guild_zones.pop(guild_id, None)
+        self.render_cache.clear()
+
+        logging.info(f"Time zones for guild {guild_id} set to {parsed or 'default'} by {interaction.user.name}")
+        await interaction.response.send_message("Time zones updated.", ephemeral=True)
+
+    def add_status_field(self, embed):
+        """Add the cached Tranquility status to an embed without touching ESI."""
+        status = self.status
+        players = status['players'] if status['players'] is not None else 'N/A'
+        value = f"**{players}** players"
+        if status['vip']:
+            value += " (VIP mode)"
+        if status['server_version']:
+            value += f"\nServer version {status['server_version']}"
+        if status['stale'] and status['fetched_at']:
+            value += f"\n*Stale, last updated {status['fetched_at'].strftime('%H:%M:%S')} UTC*"
+
+        embed.add_field(name="EVE Online Users Online", value=value, inline=False)
+
+    def _snapshot_status(self):
+        status = dict(self.status)
+        status['fetched_at'] = status['fetched_at'].isoformat() if status['fetched_at'] else None
+        return {'status': status, 'next_refresh_at': self.next_refresh_at}
+
+    def _restore_status(self, state):
+        if not state:
+            return
+        status = state['status']
+        status['fetched_at'] = datetime.datetime.fromisoformat(status['fetched_at']) if status['fetched_at'] else None
+        self.status = status
+        self.next_refresh_at = state['next_refresh_at']
+        if not self.next_refresh_at or self.next_refresh_at <= self.clock.time():
+            self.status['stale'] = True
+        logging.info(f"Restored the Tranquility status fetched at {status['fetched_at']} from the snapshot.")
+
+    async def poll_status(self):
+        """Refresh the Tranquility status on ESI's cache cadence."""
+        await self.bot.wait_until_ready()
+        loopmon.mark("loop:poll_status")
+        # A status restored from the snapshot is good until ESI's cache expires.
+        if self.next_refresh_at and self.next_refresh_at > self.clock.time():
+            await asyncio.sleep(self.next_refresh_at - self.clock.time())
+        timeout = aiohttp.ClientTimeout(total=10)
+        async with aiohttp.ClientSession(timeout=timeout, trace_configs=metrics.trace_configs()) as session:
+            while True:
+                delay = await self.refresh_status(session)
+                self.next_refresh_at = self.clock.time() + delay
+                await asyncio.sleep(delay)
+
+    async def refresh_status(self, session):
+        """Fetch the server status once and return the number of seconds until the next refresh."""
+        try:
+            async with session.get(STATUS_URL) as resp:
+                if resp.status != 200:
+                    raise aiohttp.ClientResponseError(resp.request_info, resp.history, status=resp.status)
+                data = await resp.json()
+                expires = resp.headers.get('Expires')
+            # A body that isn't JSON (ValueError) or isn't an object (AttributeError) is a failed refresh too.
+            players, server_version, vip = data.get('players'), data.get('server_version'), bool(data.get('vip'))
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, AttributeError) as e:
+            self.status_failures += 1
+            self.status['stale'] = True
+            self.status['version'] += 1
+            logging.error(f"Failed to refresh Tranquility status: {e}")
+            return min(STATUS_MAX_REFRESH, STATUS_MIN_REFRESH * 2 ** min(self.status_failures, 4))
+
+        now = self.clock.utcnow()
+        self.status = {
+            'players': players,
+            'server_version': server_version,
+            'vip': vip,
+            'fetched_at': now,
+            'stale': False,
+            'version': self.status['version'] + 1
+        }
+        self.status_failures = 0
+
+        delay = STATUS_MIN_REFRESH
+        if expires:
+            try:
+                expires_at = parsedate_to_datetime(expires).replace(tzinfo=None)
+                delay = (expires_at - now).total_seconds()
+            except (TypeError, ValueError):
+                pass
+        return max(STATUS_MIN_REFRESH, min(STATUS_MAX_REFRESH, delay))
 
 async def setup(bot):
     await bot.add_cog(TimeCog(bot))
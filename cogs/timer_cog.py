@@ -1,22 +1,27 @@
 import discord
 import sqlite3
+import asyncio
 import logging
-import re
 from discord.ext import commands, tasks
 from discord import app_commands
-from datetime import datetime, timedelta
-from decouple import config
+from datetime import datetime, timezone
+from utils.ratelimit import rate_limited
+from utils.outbound import DUE_BATCH, QueueFull, is_transient
+from utils import metrics
+from utils.recurrence import Recurrence
+from utils.timeparse import parse_when
 
 class TimerCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.conn = sqlite3.connect('chuck.db')
+        self.conn = metrics.connect('chuck.db')
         self.conn.row_factory = sqlite3.Row
         self.cursor = self.conn.cursor()
         self._create_tables()
         self._initialize_statistics()
 
-        self.admin_user_id = int(config('ADMIN_USER_ID'))
+        self.settings = bot.settings
+        self.clock = bot.clock
 
         logging.info("Connected to the timers database successfully.")
 
@@ -35,8 +40,13 @@ class TimerCog(commands.Cog):
                                duration INTEGER,
                                start_time DATETIME,
                                end_time DATETIME,
-                               label TEXT
+                               label TEXT,
+                               recurrence TEXT
                                )''')
+        self.cursor.execute('PRAGMA table_info(timers)')
+        if 'recurrence' not in {column['name'] for column in self.cursor.fetchall()}:
+            self.cursor.execute('ALTER TABLE timers ADD COLUMN recurrence TEXT')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_timers_end_time ON timers(end_time)')
         
         self.cursor.execute('''CREATE TABLE IF NOT EXISTS timer_statistics (
                                id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -53,27 +63,35 @@ class TimerCog(commands.Cog):
             self.cursor.execute('INSERT INTO timer_statistics (created_timers, processed_timers) VALUES (0, 0)')
             self.conn.commit()
 
-    def _update_statistics(self, column_name):
+    def _update_statistics(self, column_name, amount=1):
         """Update the count of timers in the statistics table."""
-        self.cursor.execute(f'UPDATE timer_statistics SET {column_name} = {column_name} + 1')
+        self.cursor.execute(f'UPDATE timer_statistics SET {column_name} = {column_name} + ?', (amount,))
         self.conn.commit()
 
     @app_commands.command(name="start_timer", description="Starts a timer for the specified duration with a label (e.g., '10s workout').")
-    async def start_timer(self, interaction: discord.Interaction, duration: str, label: str):
-        delta = self._parse_duration(duration)
-        if delta is None:
+    @app_commands.describe(duration="How long the timer runs (e.g., 10s, 1h30m) or when it ends (e.g., at 18:00 EVE)",
+                           repeat="Restart the timer when it ends (e.g., every 6h, weekly, every sat at 18:00 EVE until 2025-12-31)")
+    @rate_limited()
+    async def start_timer(self, interaction: discord.Interaction, duration: str, label: str, repeat: str = None):
+        start_time = self.clock.utcnow()
+        try:
+            end_time, _ = parse_when(duration, start_time.replace(tzinfo=timezone.utc))
+            recurrence = Recurrence.parse(repeat).anchored(end_time) if repeat else None
+            if recurrence and recurrence.until and recurrence.until <= end_time:
+                raise ValueError("The repeat ends before the timer does.")
+        except ValueError as e:
             embed = discord.Embed(
                 title="Invalid Duration Format",
-                description="Please use a format like `10s`, `5m`, `1h`, or `2d`.",
+                description=str(e),
                 color=discord.Color.red()
             )
             await interaction.response.send_message(embed=embed, ephemeral=True)
             return
+        end_time = end_time.replace(tzinfo=None)
+        delta = end_time - start_time
 
-        start_time = datetime.utcnow()
-        end_time = start_time + delta
-
-        timer_id = self._add_timer(interaction.user.id, interaction.channel_id, int(delta.total_seconds()), start_time, end_time, label)
+        timer_id = self._add_timer(interaction.user.id, interaction.channel_id, int(delta.total_seconds()), start_time, end_time, label,
+                                   recurrence.dumps() if recurrence else None)
         self._update_statistics('created_timers')
         logging.info(f"Timer set for user {interaction.user.id} with label '{label}' ending at {end_time}")
 
@@ -85,6 +103,8 @@ class TimerCog(commands.Cog):
         embed.add_field(name="Label", value=label, inline=True)
         embed.add_field(name="Duration", value=duration, inline=True)
         embed.add_field(name="End Time", value=end_time.strftime('%Y-%m-%d %H:%M:%S UTC'), inline=False)
+        if recurrence:
+            embed.add_field(name="Repeats", value=recurrence.describe(), inline=False)
         embed.add_field(name="Timer ID", value=str(timer_id), inline=True)
         embed.add_field(name="Delete Timer", value=f"To delete this timer, use: `/cancel_timer {timer_id}`", inline=False)
         embed.set_footer(text="You can cancel the timer anytime using the provided ID.")
@@ -125,7 +145,7 @@ class TimerCog(commands.Cog):
 
     @app_commands.command(name="timer_stats", description="View timer statistics (Admin only).")
     async def timer_stats(self, interaction: discord.Interaction):
-        if interaction.user.id != self.admin_user_id:
+        if not self.settings.is_bot_admin(interaction.user.id):
             embed = discord.Embed(
                 title="Permission Denied",
                 description="You do not have the required permissions to view timer statistics.",
@@ -156,67 +176,53 @@ class TimerCog(commands.Cog):
         await interaction.followup.send(embed=embed, ephemeral=True)
 
     @tasks.loop(seconds=10)
+    @metrics.timed_loop('check_timers')
     async def check_timers(self):
-        now = datetime.utcnow()
-        logging.info(f"Checking for expired timers at {now}")
-
+        if not self.bot.cluster.is_leader:
+            return
+        now = self.clock.utcnow()
         due_timers = self._get_due_timers(now)
-        logging.info(f"Found {len(due_timers)} timers to notify.")
-
-        for timer in due_timers:
-            timer_id = timer['id']
-            user_id = timer['user_id']
-            label = timer['label']
-
-            logging.info(f"Timer {timer_id} with label '{label}' has expired. Notifying user {user_id}.")
-            user = self.bot.get_user(user_id)
-
-            if not user:
-                try:
-                    user = await self.bot.fetch_user(user_id)
-                    logging.info(f"Fetched user {user_id} from API.")
-                except discord.NotFound:
-                    logging.error(f"User {user_id} not found. Unable to send notification for timer {timer_id} with label '{label}'.")
-                    continue
-                except discord.HTTPException as e:
-                    logging.error(f"Failed to fetch user {user_id}: {e}")
-                    continue
+        if not due_timers:
+            logging.info("No timers due.", extra={'idle': True})
+            return
+        logging.info("Found %d timers to notify.", len(due_timers), extra={'due': len(due_timers)})
 
-            if user:
-                await self._notify_user(user, timer_id, label)
+        # Queue every notification in the batch at once; the outbound queue
+        # spreads them over its workers ahead of any kill or news backlog.
+        processed = await asyncio.gather(*(self._process_timer(timer, now) for timer in due_timers))
+        self._finish_timers([result for result in processed if result is not None])
 
-            self._delete_timer(timer_id)
-            self._update_statistics('processed_timers')
+    def _next_occurrence(self, timer, now):
+        """The naive UTC end of a repeating timer's next run, or None when it doesn't repeat again."""
+        recurrence = Recurrence.loads(timer['recurrence'])
+        if recurrence is None:
+            return None
+        end_time = datetime.fromisoformat(timer['end_time']).replace(tzinfo=timezone.utc)
+        next_end = recurrence.next_after(end_time, now.replace(tzinfo=timezone.utc))
+        return next_end.replace(tzinfo=None) if next_end else None
+
+    async def _process_timer(self, timer, now):
+        """Notify the timer's owner; returns the timer ID and its next end, if any, once it has been handled."""
+        timer_id = timer['id']
+        user_id = timer['user_id']
+        label = timer['label']
+        next_end = self._next_occurrence(timer, now)
+
+        logging.info("Timer %s with label '%s' has expired. Notifying user %s.", timer_id, label, user_id,
+                     extra={'timer_id': timer_id, 'user_id': user_id})
+        if not await self._notify_user(user_id, timer_id, label, next_end):
+            # Not delivered yet; the timer stays due and is retried next tick.
+            return
+        return timer_id, next_end
 
     @check_timers.before_loop
     async def before_check_timers(self):
         await self.bot.wait_until_ready()
 
-    def _parse_duration(self, duration):
-        """Parse the duration string into a timedelta object."""
-        time_pattern = r'(?P<value>\d+)\s*(?P<unit>s|sec|seconds?|m|min|minutes?|h|hours?|d|days?)'
-        matches = re.match(time_pattern, duration, re.IGNORECASE)
-        if not matches:
-            return None
-
-        value = int(matches.group('value'))
-        unit = matches.group('unit').lower()
-
-        if unit in ['s', 'sec', 'second', 'seconds']:
-            return timedelta(seconds=value)
-        elif unit in ['m', 'min', 'minute', 'minutes']:
-            return timedelta(minutes=value)
-        elif unit in ['h', 'hour', 'hours']:
-            return timedelta(hours=value)
-        elif unit in ['d', 'day', 'days']:
-            return timedelta(days=value)
-
-        return None
-
-    def _add_timer(self, user_id, channel_id, duration, start_time, end_time, label):
+    def _add_timer(self, user_id, channel_id, duration, start_time, end_time, label, recurrence=None):
         """Add a timer to the database with a label and return the timer ID."""
-        self.cursor.execute('INSERT INTO timers (user_id, channel_id, duration, start_time, end_time, label) VALUES (?, ?, ?, ?, ?, ?)',
-                            (user_id, channel_id, duration, start_time, end_time, label))
+        self.cursor.execute('INSERT INTO timers (user_id, channel_id, duration, start_time, end_time, label, recurrence) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                            (user_id, channel_id, duration, start_time, end_time, label, recurrence))
         self.conn.commit()
         return self.cursor.lastrowid
 
@@ -231,18 +237,18 @@ class TimerCog(commands.Cog):
         self.conn.commit()
 
     def _get_due_timers(self, now):
-        """Retrieve all timers that are due."""
-        self.cursor.execute('SELECT * FROM timers WHERE end_time <= ?', (now,))
+        """Retrieve the oldest due timers, at most one batch."""
+        self.cursor.execute('SELECT * FROM timers WHERE end_time <= ? ORDER BY end_time LIMIT ?', (now, DUE_BATCH))
         return self.cursor.fetchall()
 
     def _count_pending_timers(self):
         """Count all pending timers."""
-        now = datetime.utcnow()
+        now = self.clock.utcnow()
         self.cursor.execute('SELECT COUNT(*) FROM timers WHERE end_time > ?', (now,))
         return self.cursor.fetchone()[0]
 
-    async def _notify_user(self, user, timer_id, label):
-        """Notify the user via DM that their timer has ended."""
+    async def _notify_user(self, user_id, timer_id, label, next_end=None):
+        """Notify the user via DM that their timer has ended; False if it should be retried."""
         try:
             embed = discord.Embed(
                 title="Timer Ended",
@@ -251,18 +257,27 @@ class TimerCog(commands.Cog):
             )
             embed.add_field(name="Label", value=f"{label}", inline=False)
             embed.add_field(name="Timer ID", value=str(timer_id), inline=False)
+            if next_end:
+                embed.add_field(name="Next Run Ends", value=f"<t:{int(next_end.replace(tzinfo=timezone.utc).timestamp())}:F>", inline=False)
             
-            await user.send(embed=embed)
-            logging.info(f"Timer {timer_id} notification with label '{label}' sent to user {user.id}.")
+            await self.bot.outbound.send_dm('timer', self.bot, user_id, embed=embed)
+            logging.info(f"Timer {timer_id} notification with label '{label}' sent to user {user_id}.")
         except discord.Forbidden:
-            logging.error(f"Cannot send DM to user {user.id}. Permission denied.")
-        except discord.HTTPException as e:
+            logging.error(f"Cannot send DM to user {user_id}. Permission denied.")
+        except (discord.HTTPException, QueueFull) as e:
             logging.error(f"Failed to send timer notification for timer {timer_id} with label '{label}': {e}")
+            return not is_transient(e)
+        return True
 
-    def _delete_timer(self, timer_id):
-        """Delete a timer from the database."""
-        self.cursor.execute('DELETE FROM timers WHERE id = ?', (timer_id,))
-        self.conn.commit()
+    def _finish_timers(self, processed):
+        """Restart repeating timers, delete the rest and count them all, in one transaction per batch."""
+        if not processed:
+            return
+        self.cursor.executemany('''UPDATE timers SET start_time = end_time, end_time = ?,
+                                   duration = CAST(strftime('%s', ?) - strftime('%s', end_time) AS INTEGER) WHERE id = ?''',
+                                [(next_end, next_end, timer_id) for timer_id, next_end in processed if next_end])
+        self.cursor.executemany('DELETE FROM timers WHERE id = ?', [(timer_id,) for timer_id, next_end in processed if not next_end])
+        self._update_statistics('processed_timers', len(processed))
 
 async def setup(bot):
     await bot.add_cog(TimerCog(bot))
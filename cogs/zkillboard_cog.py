@@ -1,314 +1,209 @@
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from decouple import config
-import aiohttp
 import asyncio
+import os
 import sqlite3
+import sys
 import logging
-import json
 from datetime import datetime
+from utils import metrics
+from utils.cluster import messageable
+from utils.killfeed import KillEventQueue, KillIngestor, connect, run_forever
+from utils.outbound import QueueFull, is_transient
+
+# inline: ingest on the bot's event loop; worker: the bot runs killworker.py as
+# a child process; external: killworker.py is run separately (or several times).
+KILL_INGEST_MODE = config('KILL_INGEST_MODE', default='inline')
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'killworker.py')
+WORKER_RESTART_MAX = 300
 
 log = logging.getLogger(__name__)
 
 class ZKillboardCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.region_ids = list(map(int, config('REGION_ID').split(',')))  
-        self.min_value = int(config('MIN_VALUE'))  
-        self.kills_channel_id = int(config('KILLS_CHANNEL_ID'))
-
-        self.kills_processed = set()
+        self.settings = bot.settings
+        self.mode = KILL_INGEST_MODE
+        self.ingest_task = None
+        self.worker_process = None
 
         try:
-            self.conn = sqlite3.connect('chuck.db')
-            self.cursor = self.conn.cursor()
-            self.cursor.execute('''CREATE TABLE IF NOT EXISTS processed_kills (
-                                   kill_id INTEGER PRIMARY KEY,
-                                   processed_at DATETIME
-                                   )''')
-            self.cursor.execute('''CREATE TABLE IF NOT EXISTS metadata (
-                                   key TEXT PRIMARY KEY,
-                                   value TEXT
-                                   )''')
-
-            self.cursor.execute('SELECT value FROM metadata WHERE key = "last_processed_time"')
-            row = self.cursor.fetchone()
-            self.last_processed_time = row[0] if row else None
-
-            self.conn.commit()
-            log.info(f"Connected to the kills database successfully. Last processed killmail time: {self.last_processed_time}")
+            self.conn = connect('chuck.db')
+            self.queue = KillEventQueue(self.conn)
         except sqlite3.Error as e:
             log.error(f"Database connection error: {e}")
-
-        self.listen_for_kills_task = self.bot.loop.create_task(self.listen_for_kills())
+            raise
+
+        if self.mode == 'inline':
+            self.ingestor = KillIngestor(self.conn, self.queue, self.settings)
+            state = self.bot.snapshot.restore('killfeed')
+            if state:
+                self.ingestor.restore_state(state)
+            self.bot.snapshot.register('killfeed', self.ingestor.snapshot_state)
+            self.ingest_task = self.bot.loop.create_task(self.listen_for_kills())
+        elif self.mode == 'worker':
+            self.ingest_task = self.bot.loop.create_task(self.supervise_worker())
+        elif self.mode != 'external':
+            raise ValueError(f"Unknown KILL_INGEST_MODE {self.mode!r}; use inline, worker or external.")
+
+        metrics.registry.gauge_callback('kill_events_pending', self.queue.pending, help_text="Kill events waiting to be posted")
+        log.info(f"Kill feed running in {self.mode} mode.")
+        self.deliver_kills.start()
 
     async def listen_for_kills(self):
-        log.debug("Starting to listen for killmails.")
+        await self.bot.wait_until_ready()
+        await run_forever(self.ingestor, is_active=lambda: self.bot.cluster.is_leader)
+
+    async def supervise_worker(self):
+        """Keep a killworker.py child process running while this process leads the cluster.
+
+        The worker is restarted with backoff if it dies, and stopped if
+        another process takes over leadership.
+        """
+        await self.bot.wait_until_ready()
+        cluster = self.bot.cluster
+        delay = 5
         while True:
-            try:
-                log.info("Starting a new cycle of killmail checks.")
-                await self.get_new_killmails()
-                log.info("Completed a cycle of killmail checks.")
-                await asyncio.sleep(60)
-            except (json.JSONDecodeError, KeyError) as e:
-                log.exception("Error in killmail data structure: %s", e)
-                await asyncio.sleep(10)
-            except aiohttp.ClientError as e:
-                log.exception("Network error when requesting new mails: %s", e)
-                await asyncio.sleep(10)
-            except Exception as e:
-                log.exception("Unexpected error: %s", e)
-                await asyncio.sleep(10)
-
-    async def get_new_killmails(self):
-        for region_id in self.region_ids:
-            log.info(f"Processing region ID: {region_id}")
-            url = f"https://zkillboard.com/api/kills/regionID/{region_id}/"
-            log.info(f"Fetching killmails from URL: {url}")
-            async with aiohttp.ClientSession() as session:
-                try:
-                    async with session.get(url) as resp:
-                        content_type = resp.headers.get('Content-Type', '').lower()
-
-                        if 'application/json' not in content_type:
-                            log.error(f"Unexpected Content-Type {content_type} from URL {url}")
-                            content = await resp.text()
-                            log.debug(f"Response content: {content[:500]}")
-                            continue
-
-                        if resp.status != 200:
-                            log.error(f"Failed to fetch killmails for region {region_id}: HTTP {resp.status}")
-                            continue
-
-                        try:
-                            data = await resp.json()
-                            log.debug(f"Fetched data: {json.dumps(data, indent=4)}")
-
-                            processed_count = 0
-
-                            for package in data:
-                                killmail_id = package.get('killmail_id')
-                                zkb = package.get('zkb', {})
-                                hash_value = zkb.get('hash')
-
-                                if not killmail_id or not hash_value:
-                                    log.warning(f"Missing or invalid killmail ID or hash for package: {json.dumps(package)}")
-                                    continue
-
-                                self.cursor.execute('SELECT * FROM processed_kills WHERE kill_id = ?', (killmail_id,))
-                                if self.cursor.fetchone():
-                                    log.info(f"Killmail ID {killmail_id} already processed, stopping further checks for region {region_id}.")
-                                    break
-
-                                detailed_killmail = await self.fetch_killmail_details(killmail_id, hash_value)
-                                if not detailed_killmail:
-                                    continue
-
-                                killmail_time = detailed_killmail.get('killmail_time')
-                                if not killmail_time:
-                                    log.warning(f"Missing killmail_time for detailed killmail ID {killmail_id}")
-                                    continue
-
-                                killmail_time_dt = datetime.strptime(killmail_time, "%Y-%m-%dT%H:%M:%SZ")
-
-                                if self.last_processed_time:
-                                    last_processed_dt = datetime.strptime(self.last_processed_time, "%Y-%m-%dT%H:%M:%SZ")
-                                    if killmail_time_dt <= last_processed_dt:
-                                        log.info(f"Skipping old killmail ID {killmail_id} with timestamp {killmail_time}, stopping further checks for region {region_id}.")
-                                        break
-
-                                if processed_count < 50:
-                                    await self.process_killmail(detailed_killmail, zkb, killmail_time_dt)
-                                    processed_count += 1
-
-                            log.info(f"Processed {processed_count} killmails for region {region_id}")
-                        except json.JSONDecodeError as e:
-                            log.error(f"JSON decode error for URL {url}: {e}")
-                except Exception as e:
-                    log.exception(f"Unexpected error fetching killmails: {e}")
-
-    async def fetch_killmail_details(self, killmail_id, hash_value):
-        url = f"https://esi.evetech.net/latest/killmails/{killmail_id}/{hash_value}/"
-        log.info(f"Fetching detailed killmail data from URL: {url}")
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                if resp.status != 200:
-                    log.error(f"Failed to fetch killmail details for {killmail_id}: HTTP {resp.status}")
-                    return None
-                data = await resp.json()
-                log.info(f"Fetched details for killmail {killmail_id}")
-                return data
-
-    async def process_killmail(self, detailed_killmail, zkb, killmail_time_dt):
-        killmail_id = detailed_killmail.get('killmail_id')
-        system_id = detailed_killmail['solar_system_id']
-        total_value = zkb.get('totalValue')
-
-        try:
-            region_id = await self.fetch_region_id(system_id)
-
-            if region_id in self.region_ids and total_value >= self.min_value:
-                self.cursor.execute('SELECT * FROM processed_kills WHERE kill_id = ?', (killmail_id,))
-                if not self.cursor.fetchone():
-                    self.cursor.execute('INSERT INTO processed_kills (kill_id, processed_at) VALUES (?, ?)', (killmail_id, datetime.utcnow()))
-                    self.conn.commit()
-                    await self.send_kill_notification(detailed_killmail, zkb, region_id)
-
-                    killmail_time = detailed_killmail['killmail_time']
-                    await self.update_last_processed_time(killmail_time)
-                    return False
-                else:
-                    log.debug(f"Killmail {killmail_id} already processed.")
-                    return True
-            else:
-                log.debug(f"Killmail {killmail_id} does not match any of the specified regions or value threshold.")
-                return False
-        except Exception as e:
-            log.exception(f"Unexpected error during killmail processing: {e}")
-            return False
-
-    async def fetch_region_id(self, solar_system_id):
-        url = f"https://esi.evetech.net/latest/universe/systems/{solar_system_id}/"
-        log.info(f"Fetching region ID for solar system {solar_system_id} from URL: {url}")
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                if resp.status != 200:
-                    log.error(f"Failed to fetch region data for system {solar_system_id}: HTTP {resp.status}")
-                    return None
-                data = await resp.json()
-                constellation_id = data.get('constellation_id')
-                if not constellation_id:
-                    log.error(f"Constellation ID not found for solar system {solar_system_id}")
-                    return None
-
-                constellation_url = f"https://esi.evetech.net/latest/universe/constellations/{constellation_id}/"
-                async with session.get(constellation_url) as const_resp:
-                    if const_resp.status != 200:
-                        log.error(f"Failed to fetch constellation data for {constellation_id}: HTTP {const_resp.status}")
-                        return None
-                    constellation_data = await const_resp.json()
-                    region_id = constellation_data.get('region_id')
-                    log.info(f"Fetched region ID {region_id} for solar system {solar_system_id}")
-                    return region_id
-
-    async def send_kill_notification(self, killmail, zkb, region_id):
-        channel = self.bot.get_channel(self.kills_channel_id)
-        if not channel:
-            log.error(f"Channel with ID {self.kills_channel_id} not found.")
+            if not cluster.is_leader:
+                await cluster.wait_for_change()
+                continue
+            self.worker_process = await asyncio.create_subprocess_exec(sys.executable, WORKER_SCRIPT, '--supervised')
+            log.info(f"Started kill worker process {self.worker_process.pid}.")
+            started = asyncio.get_running_loop().time()
+            exited = asyncio.ensure_future(self.worker_process.wait())
+            changed = asyncio.ensure_future(cluster.wait_for_change())
+            await asyncio.wait({exited, changed}, return_when=asyncio.FIRST_COMPLETED)
+            changed.cancel()
+            if not exited.done():
+                log.info("No longer the cluster leader, stopping the kill worker.")
+                self.worker_process.terminate()
+                await exited
+                continue
+            code = exited.result()
+            metrics.registry.inc('kill_worker_restarts', help_text="Kill worker process exits")
+            if asyncio.get_running_loop().time() - started > WORKER_RESTART_MAX:
+                delay = 5
+            log.error(f"Kill worker exited with code {code}, restarting in {delay}s.")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, WORKER_RESTART_MAX)
+
+    @tasks.loop(seconds=2)
+    @metrics.timed_loop('deliver_kills')
+    async def deliver_kills(self):
+        if not self.bot.cluster.is_leader:
             return
-
+        events = self.queue.claim()
+        if not events:
+            return
+        results = await asyncio.gather(*(self.send_kill_notification(event) for _, event in events))
+        for (event_id, _), delivered in zip(events, results):
+            if delivered:
+                self.queue.ack(event_id)
+
+    @deliver_kills.before_loop
+    async def before_deliver_kills(self):
+        await self.bot.wait_until_ready()
+        self.queue.prune()
+
+    def build_kill_embed(self, event):
+        kill_id = event['kill_id']
+        total_value = event['total_value']
+        character_id = event['character_id']
+        corporation_id = event['corporation_id']
+        alliance_id = event['alliance_id']
+        solar_system_name = event['solar_system_name']
+        region_name = event['region_name']
+        killmail_time = event['killmail_time']
+        link = f"https://zkillboard.com/kill/{kill_id}/"
+
+        character_link = f"[{event['character_name']}](https://zkillboard.com/character/{character_id}/)" if character_id else 'Unknown'
+        corporation_link = f"[{event['corporation_name']}](https://zkillboard.com/corporation/{corporation_id}/)" if corporation_id else 'Unknown'
+        alliance_link = f"[{event['alliance_name']}](https://zkillboard.com/alliance/{alliance_id}/)" if alliance_id else 'None'
+        location_link = f"[{solar_system_name}](https://evemaps.dotlan.net/system/{solar_system_name})"
+        region_link = f"[{region_name}](https://evemaps.dotlan.net/map/{region_name.replace(' ', '_')})"
+
+        ship_icon_url = f"https://images.evetech.net/types/{event['ship_type_id']}/render"
+
+        killer = event['killer']
+        if killer:
+            killer_link = f"[{killer['character_name']}](https://zkillboard.com/character/{killer['character_id']}/)" if killer['character_id'] else 'Unknown'
+            killer_corp_link = f"[{killer['corporation_name']}](https://zkillboard.com/corporation/{killer['corporation_id']}/)" if killer['corporation_id'] else 'Unknown'
+            killer_alliance_link = f"[{killer['alliance_name']}](https://zkillboard.com/alliance/{killer['alliance_id']}/)" if killer['alliance_id'] else 'None'
+            killer_ship_name = killer['ship_name']
+        else:
+            killer_link = killer_corp_link = killer_alliance_link = killer_ship_name = 'Unknown'
+
+        embed = discord.Embed(
+            title="Valuable Kill Detected!",
+            description=f"[Killmail {kill_id}]({link})\nValue: {total_value:,} ISK",
+            color=0xFF0000,
+            timestamp=datetime.strptime(killmail_time, "%Y-%m-%dT%H:%M:%SZ")
+        )
+        embed.add_field(name="Victim's Ship", value=event['ship_name'], inline=True)
+        embed.add_field(name="Victim's Character", value=character_link, inline=True)
+        embed.add_field(name="Victim's Corporation", value=corporation_link, inline=True)
+        embed.add_field(name="Victim's Alliance", value=alliance_link, inline=True)
+        embed.add_field(name="Location", value=location_link, inline=True)
+        embed.add_field(name="Region", value=region_link, inline=True)
+        embed.add_field(name="Kill Time", value=killmail_time, inline=True)
+        embed.add_field(name="Killer's Name", value=killer_link, inline=True)
+        embed.add_field(name="Killer's Corporation", value=killer_corp_link, inline=True)
+        embed.add_field(name="Killer's Alliance", value=killer_alliance_link, inline=True)
+        embed.add_field(name="Killer's Ship", value=killer_ship_name, inline=True)
+        embed.add_field(name="Total Attackers", value=str(event['total_attackers']), inline=True)
+        embed.set_thumbnail(url=ship_icon_url)
+        embed.set_footer(text="Reported by Chuck Norris Bot")
+        return embed
+
+    def kill_channels(self, event):
+        """Kills channels of every guild watching this kill's region at this value."""
+        region_id = event.get('region_id')
+        channel_ids = []
+        for guild_id, channel_id in self.settings.guilds_with('kills_channel_id').items():
+            # Events queued before region_id was recorded go to every kills channel.
+            if region_id is not None and region_id not in self.settings.get(guild_id, 'region_ids', ()):
+                continue
+            if event['total_value'] < self.settings.get(guild_id, 'min_value', 0):
+                continue
+            channel_ids.append(channel_id)
+        return channel_ids
+
+    async def send_to_channel(self, channel_id, event, embed):
+        kill_id = event['kill_id']
         try:
-            kill_id = killmail['killmail_id']
-            total_value = zkb.get('totalValue')
-            link = f"https://zkillboard.com/kill/{kill_id}/"
-
-            victim_info = killmail['victim']
-            ship_type_id = victim_info['ship_type_id']
-            character_id = victim_info.get('character_id')
-            corporation_id = victim_info.get('corporation_id')
-            alliance_id = victim_info.get('alliance_id')
-            solar_system_id = killmail['solar_system_id']
-            killmail_time = killmail['killmail_time']
-
-            ship_name = await self.fetch_name('type', ship_type_id)
-            character_name = await self.fetch_name('character', character_id) if character_id else 'Unknown'
-            corporation_name = await self.fetch_name('corporation', corporation_id) if corporation_id else 'Unknown'
-            alliance_name = await self.fetch_name('alliance', alliance_id) if alliance_id else 'None'
-            solar_system_name = await self.fetch_name('system', solar_system_id)
-            region_name = await self.fetch_name('region', region_id)
-
-            character_link = f"[{character_name}](https://zkillboard.com/character/{character_id}/)" if character_id else 'Unknown'
-            corporation_link = f"[{corporation_name}](https://zkillboard.com/corporation/{corporation_id}/)" if corporation_id else 'Unknown'
-            alliance_link = f"[{alliance_name}](https://zkillboard.com/alliance/{alliance_id}/)" if alliance_id else 'None'
-            location_link = f"[{solar_system_name}](https://evemaps.dotlan.net/system/{solar_system_name})"
-            region_link = f"[{region_name}](https://evemaps.dotlan.net/map/{region_name.replace(' ', '_')})"
-
-            ship_icon_url = f"https://images.evetech.net/types/{ship_type_id}/render"
-
-            attackers = killmail.get('attackers', [])
-            total_attackers = len(attackers)
-            final_blow = None
-
-            for attacker in attackers:
-                if attacker.get('final_blow'):
-                    final_blow = attacker
-                    break
-
-            if final_blow:
-                killer_name = await self.fetch_name('character', final_blow['character_id']) if final_blow.get('character_id') else 'Unknown'
-                killer_corp_name = await self.fetch_name('corporation', final_blow['corporation_id']) if final_blow.get('corporation_id') else 'Unknown'
-                killer_alliance_name = await self.fetch_name('alliance', final_blow['alliance_id']) if final_blow.get('alliance_id') else 'None'
-                killer_ship_name = await self.fetch_name('type', final_blow['ship_type_id']) if final_blow.get('ship_type_id') else 'Unknown'
-                killer_link = f"[{killer_name}](https://zkillboard.com/character/{final_blow['character_id']}/)" if final_blow.get('character_id') else 'Unknown'
-                killer_corp_link = f"[{killer_corp_name}](https://zkillboard.com/corporation/{final_blow['corporation_id']}/)" if final_blow.get('corporation_id') else 'Unknown'
-                killer_alliance_link = f"[{killer_alliance_name}](https://zkillboard.com/alliance/{final_blow['alliance_id']}/)" if final_blow.get('alliance_id') else 'None'
-            else:
-                killer_link = killer_corp_link = killer_alliance_link = killer_ship_name = 'Unknown'
-
-            log.debug(f"Kill ID: {kill_id}, Total Value: {total_value:,} ISK")
-            log.debug(f"Ship: {ship_name}, Character: {character_name}, Corporation: {corporation_name}, Alliance: {alliance_name}")
-            log.debug(f"Killer: {killer_name}, Killer Ship: {killer_ship_name}, Killer Corporation: {killer_corp_name}, Killer Alliance: {killer_alliance_name}")
-            log.debug(f"Location: {solar_system_name}, Region: {region_name}, Time: {killmail_time}")
-
-            embed = discord.Embed(
-                title="Valuable Kill Detected!",
-                description=f"[Killmail {kill_id}]({link})\nValue: {total_value:,} ISK",
-                color=0xFF0000,
-                timestamp=datetime.strptime(killmail_time, "%Y-%m-%dT%H:%M:%SZ") 
-            )
-            embed.add_field(name="Victim's Ship", value=ship_name, inline=True)
-            embed.add_field(name="Victim's Character", value=character_link, inline=True)
-            embed.add_field(name="Victim's Corporation", value=corporation_link, inline=True)
-            embed.add_field(name="Victim's Alliance", value=alliance_link, inline=True)
-            embed.add_field(name="Location", value=location_link, inline=True)
-            embed.add_field(name="Region", value=region_link, inline=True)
-            embed.add_field(name="Kill Time", value=killmail_time, inline=True)
-            embed.add_field(name="Killer's Name", value=killer_link, inline=True)
-            embed.add_field(name="Killer's Corporation", value=killer_corp_link, inline=True)
-            embed.add_field(name="Killer's Alliance", value=killer_alliance_link, inline=True)
-            embed.add_field(name="Killer's Ship", value=killer_ship_name, inline=True)
-            embed.add_field(name="Total Attackers", value=str(total_attackers), inline=True)
-            embed.set_thumbnail(url=ship_icon_url) 
-            embed.set_footer(text="Reported by Chuck Norris Bot")
-
-            await channel.send(embed=embed)
-            log.info(f"Sent kill notification for kill ID {kill_id} with value {total_value:,} ISK.")
-        except Exception as e:
-            log.error(f"Failed to send kill notification: {e}")
-
-    async def fetch_name(self, category, id):
-        url_map = {
-            'type': f"https://esi.evetech.net/latest/universe/types/{id}/",
-            'character': f"https://esi.evetech.net/latest/characters/{id}/",
-            'corporation': f"https://esi.evetech.net/latest/corporations/{id}/",
-            'alliance': f"https://esi.evetech.net/latest/alliances/{id}/",
-            'system': f"https://esi.evetech.net/latest/universe/systems/{id}/",
-            'region': f"https://esi.evetech.net/latest/universe/regions/{id}/"
-        }
-        url = url_map.get(category)
-        if not url:
-            log.error(f"Unknown category {category} for fetching name.")
-            return 'Unknown'
-
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                if resp.status != 200:
-                    log.error(f"Failed to fetch {category} name for ID {id}: {resp.status}")
-                    return 'Unknown'
-                data = await resp.json()
-                return data.get('name', 'Unknown')
-
-    async def update_last_processed_time(self, killmail_time):
+            await self.bot.outbound.send('kill', messageable(self.bot, channel_id), embed=embed)
+            log.info("Sent kill notification for kill ID %s with value %s ISK.", kill_id, f"{event['total_value']:,}",
+                     extra={'kill_id': kill_id, 'value': event['total_value'], 'channel_id': channel_id})
+            return True
+        except (discord.HTTPException, QueueFull) as e:
+            log.error(f"Failed to send kill notification for kill ID {kill_id} to channel {channel_id}: {e}")
+            # A deleted channel or missing permissions won't fix itself; count it as done so the event is acked.
+            return not is_transient(e)
+
+    async def send_kill_notification(self, event):
+        """Post one kill event to every interested guild; returns True once it is safe to acknowledge."""
+        kill_id = event.get('kill_id')
         try:
-            self.cursor.execute('REPLACE INTO metadata (key, value) VALUES (?, ?)', ('last_processed_time', killmail_time))
-            self.conn.commit()
-            log.info(f"Updated last processed killmail time to {killmail_time}")
-        except sqlite3.Error as e:
-            log.error(f"Failed to update last processed killmail time: {e}")
+            channel_ids = self.kill_channels(event)
+            embed = self.build_kill_embed(event)
+        except (KeyError, TypeError, ValueError) as e:
+            # A malformed event will never post; acknowledge it so it doesn't retry forever.
+            log.error(f"Dropping malformed kill event {kill_id}: {e}")
+            return True
+        if not channel_ids:
+            return True
+        results = await asyncio.gather(*(self.send_to_channel(channel_id, event, embed) for channel_id in channel_ids))
+        # Retrying would repost to the guilds that did get it, so only retry when nobody did.
+        return any(results)
 
     def cog_unload(self):
-        if self.listen_for_kills_task:
-            self.listen_for_kills_task.cancel()
+        self.bot.snapshot.unregister('killfeed')
+        self.deliver_kills.cancel()
+        if self.ingest_task:
+            self.ingest_task.cancel()
+        if self.worker_process and self.worker_process.returncode is None:
+            self.worker_process.terminate()
         if self.conn:
             self.conn.close()
 
@@ -0,0 +1,73 @@
+"""Killmail ingestion worker.
+
+Polls zKillboard and ESI outside the bot process and hands ready-to-post
+kill events to the bot through the kill_events table in chuck.db. Run it
+next to the bot with KILL_INGEST_MODE=external, or let the bot start it
+with KILL_INGEST_MODE=worker. Regions and value thresholds come from the
+guild settings; to spread the load, run several workers, each with its
+own --regions.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+from utils import logsetup
+from utils.killfeed import KillEventQueue, KillIngestor, connect, run_forever
+from utils.settings import GuildSettings
+from utils.snapshot import Snapshot
+
+log = logging.getLogger('killworker')
+
+def parse_regions(value):
+    return [int(region_id) for region_id in value.split(',') if region_id.strip()]
+
+async def watch_parent(parent_pid):
+    # When started by the bot, don't outlive it.
+    while os.getppid() == parent_pid:
+        await asyncio.sleep(5)
+    log.info("Parent process exited, stopping the kill worker.")
+
+async def main(args):
+    conn = connect(args.db)
+    queue = KillEventQueue(conn)
+    settings = GuildSettings(args.db)
+    ingestor = KillIngestor(conn, queue, settings, args.regions)
+    snapshot = Snapshot(args.snapshot)
+    state = snapshot.restore('killfeed')
+    if state:
+        ingestor.restore_state(state)
+    snapshot.register('killfeed', ingestor.snapshot_state)
+    snapshot.start()
+    log.info(f"Kill worker {os.getpid()} ingesting {f'regions {args.regions}' if args.regions else 'every watched region'}.")
+
+    ingest = asyncio.create_task(run_forever(ingestor, args.interval))
+    tasks = [ingest]
+    if args.supervised:
+        tasks.append(asyncio.create_task(watch_parent(os.getppid())))
+    # The supervising bot stops the worker with SIGTERM; exit through the cleanup below.
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, ingest.cancel)
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        snapshot.stop()
+        settings.close()
+        conn.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--regions', type=parse_regions, default=None,
+                        help="Only ingest these comma separated region IDs (default: every region a guild watches)")
+    parser.add_argument('--interval', type=int, default=60, help="Seconds between polling cycles")
+    parser.add_argument('--db', default='chuck.db')
+    parser.add_argument('--snapshot', default='killworker_snapshot.bin', help="Warm-start cache file for names and regions")
+    parser.add_argument('--supervised', action='store_true', help="Exit when the parent process exits")
+    args = parser.parse_args()
+
+    logsetup.setup_logging()
+    try:
+        asyncio.run(main(args))
+    except KeyboardInterrupt:
+        pass
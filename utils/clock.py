@@ -0,0 +1,40 @@
+import time
+from datetime import datetime, timezone
+
+class Clock:
+    """Wall-clock time for the schedulers.
+
+    Time-based cogs read the time from ``bot.clock`` rather than the
+    datetime module, so a bench can run them under a VirtualClock.
+    """
+
+    def time(self):
+        return time.time()
+
+    def utcnow(self):
+        """Naive UTC datetime, as stored by the timer, poll and news tables."""
+        return datetime.utcnow()
+
+    def now(self, tz):
+        return datetime.now(tz)
+
+class VirtualClock(Clock):
+    """A clock that only moves when told to."""
+
+    def __init__(self, start=None):
+        self.current = time.time() if start is None else start
+
+    def time(self):
+        return self.current
+
+    def utcnow(self):
+        return datetime.fromtimestamp(self.current, timezone.utc).replace(tzinfo=None)
+
+    def now(self, tz):
+        return datetime.fromtimestamp(self.current, tz)
+
+    def set(self, timestamp):
+        self.current = timestamp
+
+    def advance(self, seconds):
+        self.current += seconds
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import os
+import socket
+import sqlite3
+import time
+from decouple import config, Csv
+from utils import metrics
+
+# Total shards across the cluster, and which of them this process runs.
+# Leave SHARD_COUNT unset to run a single unsharded process as before.
+SHARD_COUNT = config('SHARD_COUNT', default=0, cast=int)
+SHARD_IDS = config('SHARD_IDS', default='', cast=Csv(int))
+CLUSTER_DB = config('CLUSTER_DB', default='chuck.db')
+
+LEASE_TTL = 30
+RENEW_EVERY = 10
+# Stop acting as leader this long before the lease runs out, so a slow
+# renewal can't leave two processes both believing they lead.
+SAFETY_MARGIN = 5
+LEADER_LEASE = 'background'
+
+log = logging.getLogger(__name__)
+
+def messageable(bot, channel_id):
+    """The cached channel, or a REST-only handle when another process's shard owns its guild.
+
+    Sending a message is a plain HTTP call that any process can make, so
+    the leader delivers to every guild directly rather than relaying the
+    message to the owning process.
+    """
+    return bot.get_channel(channel_id) or bot.get_partial_messageable(channel_id)
+
+class Cluster:
+    """Leader election over a leases table in the shared database.
+
+    Background duties (kill feed, news, timers, reminders, poll expiry) run
+    only on the leader. Every process runs its own shards and answers its
+    own interactions. When clustering is off, this process is always the
+    leader and nothing touches the database.
+    """
+
+    def __init__(self, db_path=CLUSTER_DB, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS, clock=time.time):
+        self.enabled = shard_count > 0
+        self.shard_count = shard_count or None
+        self.shard_ids = list(shard_ids) or None
+        self.clock = clock
+        self.node_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_until = 0.0
+        self.conn = None
+        self.task = None
+        self.leader_changed = asyncio.Event()
+
+        if self.enabled:
+            self.conn = metrics.connect(db_path, timeout=10)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS leases (
+                                 name TEXT PRIMARY KEY,
+                                 holder TEXT,
+                                 expires_at REAL
+                                 )''')
+            self.conn.commit()
+        metrics.registry.gauge_callback('cluster_leader', lambda: int(self.is_leader), help_text="1 if this process runs background duties")
+
+    @property
+    def is_leader(self):
+        if not self.enabled:
+            return True
+        return self.clock() < self.lease_until - SAFETY_MARGIN
+
+    def bot_options(self):
+        """Keyword arguments for AutoShardedBot, or an empty dict when not sharding."""
+        if not self.enabled:
+            return {}
+        return {'shard_count': self.shard_count, 'shard_ids': self.shard_ids}
+
+    def try_acquire(self):
+        """Take or renew the leader lease; returns whether this process holds it."""
+        now = self.clock()
+        expires_at = now + LEASE_TTL
+        try:
+            self.conn.execute('''INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+                                 ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+                                 WHERE leases.holder = excluded.holder OR leases.expires_at < ?''',
+                              (LEADER_LEASE, self.node_id, expires_at, now))
+            self.conn.commit()
+            holder, = self.conn.execute('SELECT holder FROM leases WHERE name = ?', (LEADER_LEASE,)).fetchone()
+        except sqlite3.Error as e:
+            log.error(f"Leader lease renewal failed: {e}")
+            return self.is_leader
+
+        was_leader = self.is_leader
+        self.lease_until = expires_at if holder == self.node_id else 0.0
+        if self.is_leader != was_leader:
+            log.info(f"{self.node_id} {'is now' if self.is_leader else 'is no longer'} the cluster leader.")
+            self.leader_changed.set()
+            self.leader_changed = asyncio.Event()
+        return self.is_leader
+
+    def release(self):
+        if not self.enabled:
+            return
+        try:
+            self.conn.execute('DELETE FROM leases WHERE name = ? AND holder = ?', (LEADER_LEASE, self.node_id))
+            self.conn.commit()
+        except sqlite3.Error as e:
+            log.error(f"Could not release the leader lease: {e}")
+        self.lease_until = 0.0
+
+    def start(self):
+        if not self.enabled:
+            return
+        self.try_acquire()
+        self.task = asyncio.create_task(self.renew_forever())
+        log.info(f"Cluster node {self.node_id} running shards {self.shard_ids or 'all'} of {self.shard_count}.")
+
+    async def renew_forever(self):
+        while True:
+            await asyncio.sleep(RENEW_EVERY)
+            self.try_acquire()
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+        self.release()
+        if self.conn:
+            self.conn.close()
+
+    async def wait_for_change(self):
+        await self.leader_changed.wait()
@@ -0,0 +1,44 @@
+import logging
+import discord
+from decouple import config
+
+# lean: only the intents and caches the loaded cogs need; full: discord.py's
+# defaults plus message content, as the bot ran before.
+CACHE_PROFILE = config('CACHE_PROFILE', default='lean')
+
+# Gateway intents each cog relies on beyond the guilds intent, which every
+# profile keeps for the channel cache and slash commands.
+COG_INTENTS = {
+    'cogs.ping': ('guild_messages', 'dm_messages', 'message_content'),
+    'cogs.poll_cog': ('guild_reactions', 'dm_reactions')
+}
+
+log = logging.getLogger(__name__)
+
+def intents_for(cogs):
+    intents = discord.Intents.none()
+    intents.guilds = True
+    for cog in cogs:
+        for flag in COG_INTENTS.get(cog, ()):
+            setattr(intents, flag, True)
+    return intents
+
+def client_options(cogs, profile=CACHE_PROFILE):
+    """Keyword arguments for the bot's intents and caches under a cache profile."""
+    if profile == 'full':
+        intents = discord.Intents.default()
+        intents.message_content = True
+        return {'intents': intents}
+    if profile != 'lean':
+        raise ValueError(f"Unknown CACHE_PROFILE {profile!r}; use lean or full.")
+
+    intents = intents_for(cogs)
+    log.info(f"Lean cache profile, gateway intents: {', '.join(name for name, enabled in intents if enabled)}")
+    return {
+        'intents': intents,
+        # Nothing looks members up from the cache; interactions carry their own member.
+        'member_cache_flags': discord.MemberCacheFlags.none(),
+        'chunk_guilds_at_startup': False,
+        # No cog reads cached messages; reactions arrive as raw events.
+        'max_messages': None
+    }
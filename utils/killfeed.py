@@ -0,0 +1,346 @@
+import aiohttp
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from datetime import datetime
+from utils import loopmon, metrics, profiling
+
+KILL_EVENT_LEASE = 60
+MAX_KILLS_PER_REGION = 50
+DELIVERED_RETENTION_DAYS = 7
+NAME_CACHE_SIZE = 20000
+
+ZKILL_REGION_URL = "https://zkillboard.com/api/kills/regionID/{region_id}/"
+ESI_URL = "https://esi.evetech.net/latest"
+NAME_URLS = {
+    'type': ESI_URL + "/universe/types/{id}/",
+    'character': ESI_URL + "/characters/{id}/",
+    'corporation': ESI_URL + "/corporations/{id}/",
+    'alliance': ESI_URL + "/alliances/{id}/",
+    'system': ESI_URL + "/universe/systems/{id}/",
+    'region': ESI_URL + "/universe/regions/{id}/"
+}
+
+log = logging.getLogger(__name__)
+
+def connect(db_path):
+    """Connection suitable for sharing chuck.db between the bot and worker processes."""
+    conn = metrics.connect(db_path, timeout=30)
+    # WAL lets the bot read the queue while a worker is writing to it.
+    conn.execute('PRAGMA journal_mode=WAL')
+    return conn
+
+class KillEventQueue:
+    """SQLite-backed hand-off of ready-to-post kill events with claim and acknowledge.
+
+    Producers put() events; the consumer claim()s a batch, posts them and
+    ack()s each one. A claimed event that is never acknowledged (the bot
+    crashed mid-post, or the send failed) becomes claimable again once its
+    lease expires, so delivery is at least once.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS kill_events (
+                             id INTEGER PRIMARY KEY AUTOINCREMENT,
+                             kill_id INTEGER UNIQUE,
+                             payload TEXT,
+                             created_at REAL,
+                             claimed_at REAL,
+                             delivered_at REAL
+                             )''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_kill_events_pending ON kill_events(delivered_at, id)')
+        self.conn.commit()
+
+    def put(self, event, commit=True):
+        """Queue an event; returns False if this kill was already queued.
+
+        With ``commit=False`` the insert joins the caller's transaction.
+        """
+        cursor = self.conn.execute('INSERT OR IGNORE INTO kill_events (kill_id, payload, created_at) VALUES (?, ?, ?)',
+                                   (event['kill_id'], json.dumps(event), time.time()))
+        if commit:
+            self.conn.commit()
+        return cursor.rowcount > 0
+
+    def claim(self, limit=10, lease=KILL_EVENT_LEASE, now=None):
+        now = time.time() if now is None else now
+        cursor = self.conn.execute('''SELECT id, payload FROM kill_events
+                                      WHERE delivered_at IS NULL AND (claimed_at IS NULL OR claimed_at < ?)
+                                      ORDER BY id LIMIT ?''', (now - lease, limit))
+        rows = cursor.fetchall()
+        if rows:
+            self.conn.executemany('UPDATE kill_events SET claimed_at = ? WHERE id = ?', [(now, row[0]) for row in rows])
+            self.conn.commit()
+        return [(row[0], json.loads(row[1])) for row in rows]
+
+    def ack(self, event_id):
+        self.conn.execute('UPDATE kill_events SET delivered_at = ? WHERE id = ?', (time.time(), event_id))
+        self.conn.commit()
+
+    def pending(self):
+        return self.conn.execute('SELECT COUNT(*) FROM kill_events WHERE delivered_at IS NULL').fetchone()[0]
+
+    def prune(self, retention_days=DELIVERED_RETENTION_DAYS):
+        self.conn.execute('DELETE FROM kill_events WHERE delivered_at < ?', (time.time() - retention_days * 86400,))
+        self.conn.commit()
+
+class KillIngestor:
+    """Polls zKillboard per region, enriches matching kills from ESI and queues them.
+
+    Shared by the bot (inline mode) and killworker.py, so both produce
+    exactly the same events. The regions and value threshold come from the
+    guild settings each cycle; ``regions`` optionally limits this ingestor
+    to a subset of them.
+    """
+
+    def __init__(self, conn, queue, settings, regions=None):
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.queue = queue
+        self.settings = settings
+        self.regions = set(regions) if regions else None
+        self.watch = {}
+        self.system_regions = {}
+        # "category:id" -> name, least recently used first
+        self.names = OrderedDict()
+
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS processed_kills (
+                               kill_id INTEGER PRIMARY KEY,
+                               processed_at DATETIME
+                               )''')
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS metadata (
+                               key TEXT PRIMARY KEY,
+                               value TEXT
+                               )''')
+        self.cursor.execute('SELECT value FROM metadata WHERE key = ?', ('last_processed_time',))
+        row = self.cursor.fetchone()
+        self.last_processed_time = row[0] if row else None
+        self.conn.commit()
+        log.info(f"Connected to the kills database successfully. Last processed killmail time: {self.last_processed_time}")
+
+    def refresh_watch(self):
+        """Region -> minimum value, from every guild that has a kills channel."""
+        self.settings.refresh_if_changed()
+        watch = self.settings.kill_watch()
+        if self.regions is not None:
+            watch = {region_id: min_value for region_id, min_value in watch.items() if region_id in self.regions}
+        self.watch = watch
+
+    async def run_cycle(self):
+        self.refresh_watch()
+        if not self.watch:
+            log.info("No guild is watching any region for kills.", extra={'idle': True})
+            return
+        async with aiohttp.ClientSession(trace_configs=metrics.trace_configs()) as session:
+            for region_id in self.watch:
+                try:
+                    await self.ingest_region(session, region_id)
+                except Exception as e:
+                    log.exception(f"Unexpected error fetching killmails: {e}")
+
+    async def ingest_region(self, session, region_id):
+        url = ZKILL_REGION_URL.format(region_id=region_id)
+        log.debug("Fetching killmails for region %s from URL: %s", region_id, url)
+        async with session.get(url) as resp:
+            content_type = resp.headers.get('Content-Type', '').lower()
+            if 'application/json' not in content_type:
+                log.error(f"Unexpected Content-Type {content_type} from URL {url}")
+                content = await resp.text()
+                log.debug("Response content: %s", content[:500])
+                return
+            if resp.status != 200:
+                log.error(f"Failed to fetch killmails for region {region_id}: HTTP {resp.status}")
+                return
+            try:
+                data = await resp.json()
+            except json.JSONDecodeError as e:
+                log.error(f"JSON decode error for URL {url}: {e}")
+                return
+
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Fetched data: %s", json.dumps(data, indent=4))
+
+        last_processed = self.last_processed_time
+        last_processed_dt = datetime.strptime(last_processed, "%Y-%m-%dT%H:%M:%SZ") if last_processed else None
+        processed_count = 0
+
+        for package in data:
+            killmail_id = package.get('killmail_id')
+            zkb = package.get('zkb', {})
+            hash_value = zkb.get('hash')
+
+            if not killmail_id or not hash_value:
+                log.warning("Missing or invalid killmail ID or hash for package: %s", package)
+                continue
+
+            self.cursor.execute('SELECT 1 FROM processed_kills WHERE kill_id = ?', (killmail_id,))
+            if self.cursor.fetchone():
+                log.info("Killmail ID %s already processed, stopping further checks for region %s.", killmail_id, region_id,
+                         extra={'idle': True})
+                break
+
+            detailed_killmail = await self.fetch_json(session, f"{ESI_URL}/killmails/{killmail_id}/{hash_value}/")
+            if not detailed_killmail:
+                continue
+
+            killmail_time = detailed_killmail.get('killmail_time')
+            if not killmail_time:
+                log.warning(f"Missing killmail_time for detailed killmail ID {killmail_id}")
+                continue
+
+            killmail_time_dt = datetime.strptime(killmail_time, "%Y-%m-%dT%H:%M:%SZ")
+            if last_processed_dt and killmail_time_dt <= last_processed_dt:
+                log.info(f"Skipping old killmail ID {killmail_id} with timestamp {killmail_time}, stopping further checks for region {region_id}.")
+                break
+
+            if processed_count < MAX_KILLS_PER_REGION:
+                await self.process_killmail(session, detailed_killmail, zkb)
+                processed_count += 1
+
+        if processed_count:
+            log.info("Processed %d killmails for region %s", processed_count, region_id,
+                     extra={'region_id': region_id, 'processed': processed_count})
+
+    async def fetch_json(self, session, url):
+        async with session.get(url) as resp:
+            if resp.status != 200:
+                log.error(f"Failed to fetch {url}: HTTP {resp.status}")
+                return None
+            return await resp.json()
+
+    async def fetch_region_id(self, session, solar_system_id):
+        # Systems never change region; remember the answer.
+        region_id = self.system_regions.get(solar_system_id)
+        if region_id is not None:
+            return region_id
+        system = await self.fetch_json(session, NAME_URLS['system'].format(id=solar_system_id))
+        constellation_id = system.get('constellation_id') if system else None
+        if not constellation_id:
+            log.error(f"Constellation ID not found for solar system {solar_system_id}")
+            return None
+        constellation = await self.fetch_json(session, f"{ESI_URL}/universe/constellations/{constellation_id}/")
+        region_id = constellation.get('region_id') if constellation else None
+        if region_id is not None:
+            self.system_regions[solar_system_id] = region_id
+        log.debug("Fetched region ID %s for solar system %s", region_id, solar_system_id)
+        return region_id
+
+    async def fetch_name(self, session, category, id):
+        key = f"{category}:{id}"
+        name = self.names.get(key)
+        if name is not None:
+            self.names.move_to_end(key)
+            return name
+        data = await self.fetch_json(session, NAME_URLS[category].format(id=id))
+        if not data or 'name' not in data:
+            return 'Unknown'
+        self.names[key] = data['name']
+        if len(self.names) > NAME_CACHE_SIZE:
+            self.names.popitem(last=False)
+        return data['name']
+
+    def snapshot_state(self):
+        return {
+            'names': list(self.names.items()),
+            'system_regions': list(self.system_regions.items())
+        }
+
+    def restore_state(self, state):
+        self.names.update((key, name) for key, name in state.get('names', ()))
+        self.system_regions.update((int(system_id), region_id) for system_id, region_id in state.get('system_regions', ()))
+        log.info(f"Restored {len(self.names)} names and {len(self.system_regions)} system regions from the snapshot.")
+
+    async def process_killmail(self, session, killmail, zkb):
+        killmail_id = killmail.get('killmail_id')
+        total_value = zkb.get('totalValue')
+        try:
+            region_id = await self.fetch_region_id(session, killmail['solar_system_id'])
+            if region_id not in self.watch or total_value < self.watch[region_id]:
+                log.debug("Killmail %s does not match any of the specified regions or value threshold.", killmail_id)
+                return
+
+            self.cursor.execute('SELECT 1 FROM processed_kills WHERE kill_id = ?', (killmail_id,))
+            if self.cursor.fetchone():
+                log.debug("Killmail %s already processed.", killmail_id)
+                return
+
+            event = await self.build_event(session, killmail, zkb, region_id)
+            # Marking the kill processed and queueing it commit together, so a
+            # failure before this point leaves the kill to be picked up again.
+            with self.conn:
+                self.cursor.execute('INSERT OR IGNORE INTO processed_kills (kill_id, processed_at) VALUES (?, ?)', (killmail_id, datetime.utcnow()))
+                if not self.cursor.rowcount:
+                    log.debug("Killmail %s already processed.", killmail_id)
+                    return
+                self.queue.put(event, commit=False)
+                self.cursor.execute('REPLACE INTO metadata (key, value) VALUES (?, ?)', ('last_processed_time', killmail['killmail_time']))
+            log.info("Queued kill %s with value %s ISK.", killmail_id, f"{total_value:,}",
+                     extra={'kill_id': killmail_id, 'value': total_value})
+        except Exception as e:
+            log.exception(f"Unexpected error during killmail processing: {e}")
+
+    async def build_event(self, session, killmail, zkb, region_id):
+        """Resolve every name the notification needs, so the bot only has to format it."""
+        victim = killmail['victim']
+
+        async def name(category, id, default):
+            return await self.fetch_name(session, category, id) if id else default
+
+        final_blow = next((attacker for attacker in killmail.get('attackers', []) if attacker.get('final_blow')), None)
+        killer = None
+        if final_blow:
+            killer = {
+                'character_id': final_blow.get('character_id'),
+                'character_name': await name('character', final_blow.get('character_id'), 'Unknown'),
+                'corporation_id': final_blow.get('corporation_id'),
+                'corporation_name': await name('corporation', final_blow.get('corporation_id'), 'Unknown'),
+                'alliance_id': final_blow.get('alliance_id'),
+                'alliance_name': await name('alliance', final_blow.get('alliance_id'), 'None'),
+                'ship_name': await name('type', final_blow.get('ship_type_id'), 'Unknown')
+            }
+
+        return {
+            'kill_id': killmail['killmail_id'],
+            'total_value': zkb.get('totalValue'),
+            'killmail_time': killmail['killmail_time'],
+            'ship_type_id': victim['ship_type_id'],
+            'ship_name': await name('type', victim['ship_type_id'], 'Unknown'),
+            'character_id': victim.get('character_id'),
+            'character_name': await name('character', victim.get('character_id'), 'Unknown'),
+            'corporation_id': victim.get('corporation_id'),
+            'corporation_name': await name('corporation', victim.get('corporation_id'), 'Unknown'),
+            'alliance_id': victim.get('alliance_id'),
+            'alliance_name': await name('alliance', victim.get('alliance_id'), 'None'),
+            'solar_system_name': await name('system', killmail['solar_system_id'], 'Unknown'),
+            'region_id': region_id,
+            'region_name': await name('region', region_id, 'Unknown'),
+            'total_attackers': len(killmail.get('attackers', [])),
+            'killer': killer
+        }
+
+async def run_forever(ingestor, interval=60, is_active=lambda: True):
+    """The polling loop shared by inline mode and the worker process."""
+    loopmon.mark("loop:listen_for_kills")
+    while True:
+        if not is_active():
+            await asyncio.sleep(interval)
+            continue
+        try:
+            log.debug("Starting a new cycle of killmail checks.")
+            started = time.perf_counter()
+            profile = profiling.begin("loop:listen_for_kills")
+            try:
+                await ingestor.run_cycle()
+            finally:
+                profiling.finish(profile)
+            elapsed = time.perf_counter() - started
+            metrics.registry.observe('loop_iteration_seconds', elapsed, loop='listen_for_kills')
+            log.info("Completed a cycle of killmail checks in %.0f ms.", elapsed * 1000, extra={'idle': True})
+            await asyncio.sleep(interval)
+        except (sqlite3.Error, aiohttp.ClientError) as e:
+            log.exception("Error during killmail ingestion: %s", e)
+            await asyncio.sleep(10)
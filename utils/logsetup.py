@@ -0,0 +1,94 @@
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import time
+from decouple import config
+
+LOG_LEVEL = config('LOG_LEVEL', default='INFO')
+LOG_FORMAT = config('LOG_FORMAT', default='json')
+IDLE_LOG_INTERVAL = config('IDLE_LOG_INTERVAL', default=600, cast=int)
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has; anything else was passed through ``extra``.
+_STANDARD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'idle'}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message plus any ``extra`` fields."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Queues records without formatting them; the listener thread does all the work.
+
+    The stock QueueHandler renders the message on the calling thread, which
+    is the event loop here.
+    """
+
+    def prepare(self, record):
+        return record
+
+class IdleThrottle(logging.Filter):
+    """Lets a record logged with ``extra={'idle': True}`` through once per interval.
+
+    Records are keyed on their logger and message template, so idle-cycle
+    messages should use %-style arguments. The next record that gets
+    through carries the number it stands in for as ``suppressed``.
+    """
+
+    def __init__(self, interval=IDLE_LOG_INTERVAL, clock=time.monotonic):
+        super().__init__()
+        self.interval = interval
+        self.clock = clock
+        self.last = {}
+        self.suppressed = {}
+
+    def filter(self, record):
+        if not getattr(record, 'idle', False):
+            return True
+        key = (record.name, record.msg)
+        now = self.clock()
+        if now - self.last.get(key, -self.interval) < self.interval:
+            self.suppressed[key] = self.suppressed.get(key, 0) + 1
+            return False
+        self.last[key] = now
+        suppressed = self.suppressed.pop(key, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT):
+    """Route all logging through a queue so handler I/O happens on a background thread."""
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT))
+
+    queue_handler = DeferredQueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(IdleThrottle())
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(queue_handler.queue, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+import weakref
+from collections import deque
+from contextlib import contextmanager
+from decouple import config
+
+LOOP_MONITOR_ENABLED = config('LOOP_MONITOR_ENABLED', default=True, cast=bool)
+LOOP_STALL_THRESHOLD = config('LOOP_STALL_THRESHOLD', default=0.25, cast=float)
+LOOP_STRICT = config('LOOP_STRICT', default=False, cast=bool)
+
+HEARTBEAT_INTERVAL = 0.05
+MAX_STALLS_KEPT = 50
+
+log = logging.getLogger(__name__)
+
+# task -> "cog:command" or "loop:name" for whatever that task is running.
+_activities = weakref.WeakKeyDictionary()
+# Every label ever marked; small, since there is one per command and loop.
+labels = set()
+
+def mark(label):
+    """Tag the current task so stalls and blocking calls can be attributed to it."""
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        return
+    if task is not None:
+        _activities[task] = label
+        labels.add(label)
+
+def activity_of(loop):
+    task = asyncio.current_task(loop)
+    if task is None:
+        return 'unknown'
+    return _activities.get(task, task.get_name())
+
+class LoopMonitor:
+    """Measures event-loop lag and captures the stack of callbacks that block it.
+
+    A heartbeat coroutine reschedules itself every HEARTBEAT_INTERVAL; a
+    helper thread notices when it stops beating and snapshots the loop
+    thread's stack while the offending callback is still running.
+    """
+
+    def __init__(self, threshold=LOOP_STALL_THRESHOLD, registry=None):
+        self.threshold = threshold
+        self.registry = registry
+        self.stalls = deque(maxlen=MAX_STALLS_KEPT)
+        self.max_lag = 0.0
+        self.last_beat = time.monotonic()
+        self.loop = None
+        self.loop_thread_id = None
+        self.heartbeat_task = None
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self.heartbeat_task = self.loop.create_task(self.heartbeat())
+        self.thread = threading.Thread(target=self.watch, name='loop-watchdog', daemon=True)
+        self.thread.start()
+        log.info(f"Event loop monitor started (stall threshold {self.threshold * 1000:.0f} ms).")
+
+    def stop(self):
+        self.stopping.set()
+        if self.heartbeat_task:
+            self.heartbeat_task.cancel()
+
+    async def heartbeat(self):
+        while True:
+            expected = time.monotonic() + HEARTBEAT_INTERVAL
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self.last_beat = now
+            self.max_lag = max(self.max_lag, lag)
+            if self.registry is not None:
+                self.registry.observe('event_loop_lag_seconds', lag, help_text="Event loop scheduling lag",
+                                      buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+
+    def watch(self):
+        reported_beat = None
+        while not self.stopping.wait(self.threshold / 2):
+            beat = self.last_beat
+            blocked_for = time.monotonic() - beat
+            if blocked_for < self.threshold + HEARTBEAT_INTERVAL or beat == reported_beat:
+                continue
+            # One report per stall: wait for the next beat before reporting again.
+            reported_beat = beat
+            self.record_stall(blocked_for)
+
+    def record_stall(self, blocked_for):
+        frame = sys._current_frames().get(self.loop_thread_id)
+        stack = ''.join(traceback.format_stack(frame)) if frame else ''
+        activity = activity_of(self.loop)
+        self.stalls.append({
+            'at': time.time(),
+            'blocked_for': blocked_for,
+            'activity': activity,
+            'stack': stack
+        })
+        if self.registry is not None:
+            self.registry.inc('event_loop_stalls', help_text="Event loop stalls over the threshold", activity=activity)
+        log.warning(f"Event loop blocked for {blocked_for * 1000:.0f} ms in {activity}:\n{stack}")
+
+class BlockingCallError(RuntimeError):
+    """Raised in strict mode when a coroutine performs blocking I/O on the event loop thread."""
+
+_strict = False
+_hook_installed = False
+
+# Audit events that mean blocking work. Non-blocking socket connects made by
+# asyncio itself are filtered out in the hook. time.sleep is only audited on
+# Python 3.12+.
+BLOCKING_EVENTS = {'socket.connect', 'socket.getaddrinfo', 'sqlite3.connect', 'open', 'time.sleep', 'subprocess.Popen'}
+
+def _audit_hook(event, args):
+    if not _strict or event not in BLOCKING_EVENTS:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    if event == 'socket.connect' and args and getattr(args[0], 'gettimeout', lambda: None)() == 0.0:
+        return
+    raise BlockingCallError(f"Blocking call {event}{args!r} inside {activity_of(loop)} on the event loop")
+
+def enable_strict_mode():
+    """Make blocking I/O inside coroutines raise BlockingCallError. Meant for tests."""
+    global _strict, _hook_installed
+    if not _hook_installed:
+        # Audit hooks can't be removed, so install once and gate on the flag.
+        sys.addaudithook(_audit_hook)
+        _hook_installed = True
+    _strict = True
+
+def disable_strict_mode():
+    global _strict
+    _strict = False
+
+@contextmanager
+def strict_mode():
+    enable_strict_mode()
+    try:
+        yield
+    finally:
+        disable_strict_mode()
+
+if LOOP_STRICT:
+    enable_strict_mode()
@@ -0,0 +1,257 @@
+import bisect
+import contextvars
+import functools
+import logging
+import sqlite3
+import time
+from aiohttp import web, TraceConfig
+from decouple import config
+from utils import loopmon, profiling
+
+METRICS_ENABLED = config('METRICS_ENABLED', default=True, cast=bool)
+METRICS_HOST = config('METRICS_HOST', default='127.0.0.1')
+METRICS_PORT = config('METRICS_PORT', default=9108, cast=int)
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+log = logging.getLogger(__name__)
+
+# Callers that want the SQLite work done by the current task (the benches)
+# set this to a [seconds, statements] list; every statement adds to it.
+db_time = contextvars.ContextVar('db_time', default=None)
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'total', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+class Registry:
+    """In-process counters, gauges and histograms rendered in Prometheus text format."""
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.help = {}
+        self.types = {}
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.gauge_callbacks = {}
+
+    def _declare(self, name, kind, help_text):
+        if name not in self.types:
+            self.types[name] = kind
+            self.help[name] = help_text or name.replace('_', ' ')
+
+    def inc(self, name, amount=1, help_text=None, **labels):
+        if not self.enabled:
+            return
+        self._declare(name, 'counter', help_text)
+        key = (name, _label_key(labels))
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set(self, name, value, help_text=None, **labels):
+        if not self.enabled:
+            return
+        self._declare(name, 'gauge', help_text)
+        self.gauges[(name, _label_key(labels))] = value
+
+    def gauge_callback(self, name, callback, help_text=None, **labels):
+        """Register a gauge whose value is read from ``callback()`` at scrape time."""
+        if not self.enabled:
+            return
+        self._declare(name, 'gauge', help_text)
+        self.gauge_callbacks[(name, _label_key(labels))] = callback
+
+    def observe(self, name, value, help_text=None, buckets=DEFAULT_BUCKETS, **labels):
+        if not self.enabled:
+            return
+        self._declare(name, 'histogram', help_text)
+        key = (name, _label_key(labels))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+    def render(self):
+        lines = []
+        samples = {}
+        for (name, key), value in self.counters.items():
+            samples.setdefault(name, []).append(f"{name}_total{_format_labels(key)} {value}")
+        for (name, key), value in self.gauges.items():
+            samples.setdefault(name, []).append(f"{name}{_format_labels(key)} {value}")
+        for (name, key), callback in list(self.gauge_callbacks.items()):
+            try:
+                value = callback()
+            except Exception as e:
+                log.debug(f"Gauge callback for {name} failed: {e}")
+                continue
+            samples.setdefault(name, []).append(f"{name}{_format_labels(key)} {value}")
+        for (name, key), histogram in self.histograms.items():
+            series = samples.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                series.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+            series.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {histogram.count}")
+            series.append(f"{name}_sum{_format_labels(key)} {histogram.total}")
+            series.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+
+        for name in sorted(samples):
+            lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} {self.types[name]}")
+            lines.extend(samples[name])
+        return '\n'.join(lines) + '\n'
+
+registry = Registry(enabled=METRICS_ENABLED)
+
+def timed_loop(loop_name):
+    """Record each iteration of a tasks.loop body in loop_iteration_seconds.
+
+    Also tags the loop's task for the event-loop monitor, so stalls inside the
+    body are attributed to the loop by name, and lets /profile target it.
+    """
+    def decorator(func):
+        label = f"loop:{loop_name}"
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            loopmon.mark(label)
+            profile = profiling.begin(label)
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                profiling.finish(profile)
+                registry.observe('loop_iteration_seconds', time.perf_counter() - started,
+                                 help_text="Duration of background loop iterations", loop=loop_name)
+        return wrapper
+    return decorator
+
+def _observe_statement(sql, elapsed):
+    registry.observe('db_query_seconds', elapsed,
+                     help_text="SQLite statement latency", statement=sql.lstrip().split(None, 1)[0].upper())
+    spent = db_time.get()
+    if spent is not None:
+        spent[0] += elapsed
+        spent[1] += 1
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _observe_statement(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _observe_statement(sql, time.perf_counter() - started)
+
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+def connect(path, **kwargs):
+    """sqlite3.connect that records statement timings when metrics are enabled."""
+    if registry.enabled:
+        kwargs.setdefault('factory', TimedConnection)
+    return sqlite3.connect(path, **kwargs)
+
+def trace_configs():
+    """aiohttp trace configs that record per-upstream request latency and status."""
+    if not registry.enabled:
+        return []
+
+    async def on_request_start(session, context, params):
+        context.started = time.perf_counter()
+
+    async def on_request_end(session, context, params):
+        upstream = params.url.host
+        registry.observe('http_request_seconds', time.perf_counter() - context.started,
+                         help_text="Outbound HTTP request latency", upstream=upstream)
+        registry.inc('http_requests', help_text="Outbound HTTP requests", upstream=upstream, status=params.response.status)
+
+    async def on_request_exception(session, context, params):
+        registry.inc('http_requests', help_text="Outbound HTTP requests", upstream=params.url.host, status='error')
+
+    trace_config = TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_exception)
+    return [trace_config]
+
+class RateLimitLogCounter(logging.Handler):
+    """Counts discord.py's rate-limit warnings, which is the only place it reports 429s."""
+
+    def emit(self, record):
+        message = record.getMessage().lower()
+        if 'rate limit' in message:
+            registry.inc('discord_rate_limited', help_text="Discord 429 responses and global rate limits hit")
+
+def instrument_discord_http(http):
+    """Wrap discord.py's HTTPClient.request to time and count every Discord API call by route."""
+    if not registry.enabled:
+        return
+    original_request = http.request
+
+    async def request(route, **kwargs):
+        started = time.perf_counter()
+        status = 'ok'
+        try:
+            return await original_request(route, **kwargs)
+        except Exception as e:
+            status = getattr(e, 'status', 'error')
+            raise
+        finally:
+            registry.observe('discord_request_seconds', time.perf_counter() - started,
+                             help_text="Discord API request latency", method=route.method, route=route.path)
+            registry.inc('discord_requests', help_text="Discord API requests", method=route.method, route=route.path, status=status)
+
+    http.request = request
+    logging.getLogger('discord.http').addHandler(RateLimitLogCounter(level=logging.WARNING))
+
+async def start_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Serve /metrics on a local port; returns the runner so the caller can clean it up."""
+    if not registry.enabled:
+        return None
+
+    async def handle_metrics(request):
+        return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    log.info(f"Metrics available at http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+import discord
+from decouple import config
+from utils import metrics
+from utils.ratelimit import TokenBucket
+
+OUTBOUND_WORKERS = config('OUTBOUND_WORKERS', default=4, cast=int)
+
+# kind -> (priority, queue bound, drop oldest when full). Lower priority goes first.
+# Time-critical DMs are never dropped to make room; kills and news shed their
+# oldest backlog instead of growing without bound.
+CLASSES = {
+    'timer': (0, 5000, False),
+    'reminder': (0, 5000, False),
+    'poll': (1, 500, False),
+    'confession': (1, 500, False),
+    'kill': (2, 200, True),
+    'news': (3, 200, True)
+}
+# Schedulers queue at most this many due timers, reminders or poll results
+# per tick, so a backlog (after downtime, say) drains over several ticks
+# instead of overflowing their queues.
+DUE_BATCH = 1000
+PRIORITIES = sorted({priority for priority, _, _ in CLASSES.values()})
+
+# Discord allows roughly 5 messages per 5 seconds per channel and 50 requests
+# per second globally. Staying under both keeps us out of its 429 handling,
+# which would otherwise stall whichever message hit it regardless of priority.
+ROUTE_BURST = 5
+ROUTE_PER_SECONDS = 5
+GLOBAL_BURST = 50
+GLOBAL_PER_SECONDS = 1
+SCAN_LIMIT = 64
+MAX_ROUTES = 10000
+# DM channel ids remembered for send_dm(), least recently used dropped first.
+DM_CHANNEL_CACHE_SIZE = config('DM_CHANNEL_CACHE_SIZE', default=50000, cast=int)
+
+log = logging.getLogger(__name__)
+
+class QueueFull(Exception):
+    """Raised to the sender when its message was rejected or dropped by a full queue."""
+
+class OutboundMessage:
+    __slots__ = ('kind', 'route', 'send', 'future', 'enqueued_at')
+
+    def __init__(self, kind, route, send, future, enqueued_at):
+        self.kind = kind
+        self.route = route
+        self.send = send
+        self.future = future
+        self.enqueued_at = enqueued_at
+
+def is_transient(error):
+    """Whether a failed send is worth retrying: a full queue or a Discord server error."""
+    if isinstance(error, QueueFull):
+        return True
+    return getattr(error, 'status', 0) >= 500
+
+def route_of(destination):
+    """Rate-limit bucket for a channel or user; DMs are limited per recipient."""
+    if hasattr(destination, 'dm_channel'):
+        return ('user', destination.id)
+    return ('channel', destination.id)
+
+class OutboundQueue:
+    """Single delivery service for bot-initiated messages.
+
+    Messages wait in one bounded queue per class and are sent by a small
+    worker pool. Workers always take the highest priority message whose
+    route (channel or DM recipient) has a free token and no send in flight,
+    so a burst to the kills channel can only ever occupy one worker.
+    """
+
+    def __init__(self, workers=OUTBOUND_WORKERS, clock=time.monotonic):
+        self.clock = clock
+        self.worker_count = workers
+        self.queues = {priority: deque() for priority in PRIORITIES}
+        self.depths = {kind: 0 for kind in CLASSES}
+        self.routes = {}
+        self.busy = set()
+        self.global_bucket = TokenBucket(GLOBAL_BURST, GLOBAL_PER_SECONDS, clock())
+        self.wakeup = asyncio.Event()
+        self.workers = []
+        # user id -> DM channel id
+        self.dm_channels = OrderedDict()
+
+        for kind in CLASSES:
+            metrics.registry.gauge_callback('outbound_queue_depth', lambda kind=kind: self.depths[kind],
+                                            help_text="Messages waiting in the outbound queue", kind=kind)
+
+    def start(self):
+        self.workers = [asyncio.create_task(self.worker(), name=f'outbound-{index}') for index in range(self.worker_count)]
+
+    async def stop(self):
+        for task in self.workers:
+            task.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    async def send(self, kind, destination, *args, **kwargs):
+        """Queue ``destination.send(*args, **kwargs)`` and return the sent message."""
+        return await self.submit(kind, route_of(destination), lambda: destination.send(*args, **kwargs))
+
+    async def send_dm(self, kind, bot, user_id, *args, **kwargs):
+        """Queue a DM to a user by ID and return the sent message.
+
+        The lean gateway profile caches no users, so rather than fetching the
+        user on every delivery this remembers each user's DM channel. Opening
+        it, the first time, happens inside the queued send, so that REST call
+        is paced with the message under the recipient's route.
+        """
+        async def send():
+            channel_id = self.dm_channels.get(user_id)
+            if channel_id is None:
+                channel_id = (await bot.create_dm(discord.Object(id=user_id))).id
+            self.dm_channels[user_id] = channel_id
+            self.dm_channels.move_to_end(user_id)
+            if len(self.dm_channels) > DM_CHANNEL_CACHE_SIZE:
+                self.dm_channels.popitem(last=False)
+            return await bot.get_partial_messageable(channel_id, type=discord.ChannelType.private).send(*args, **kwargs)
+        return await self.submit(kind, ('user', user_id), send)
+
+    async def submit(self, kind, route, send):
+        """Queue an arbitrary send coroutine factory under ``route`` and await its result."""
+        priority, limit, drop_oldest = CLASSES[kind]
+        if self.depths[kind] >= limit:
+            if not drop_oldest:
+                metrics.registry.inc('outbound_dropped', help_text="Outbound messages dropped by full queues", kind=kind)
+                raise QueueFull(f"The {kind} queue is full.")
+            self._drop_oldest(kind, priority)
+
+        future = asyncio.get_running_loop().create_future()
+        self.queues[priority].append(OutboundMessage(kind, route, send, future, self.clock()))
+        self.depths[kind] += 1
+        self.wakeup.set()
+        return await future
+
+    def _drop_oldest(self, kind, priority):
+        queue = self.queues[priority]
+        for index, message in enumerate(queue):
+            if message.kind == kind:
+                del queue[index]
+                self.depths[kind] -= 1
+                if not message.future.done():
+                    message.future.set_exception(QueueFull(f"Dropped from the full {kind} queue."))
+                metrics.registry.inc('outbound_dropped', help_text="Outbound messages dropped by full queues", kind=kind)
+                log.warning("Outbound %s queue full, dropped its oldest message.", kind, extra={'kind': kind})
+                return
+
+    def _next(self, now):
+        """Pop the next deliverable message, or return the seconds to wait before trying again."""
+        bucket = self.global_bucket
+        available = min(bucket.capacity, bucket.tokens + (now - bucket.updated) * bucket.rate)
+        if available < 1:
+            return (1 - available) / bucket.rate
+
+        retry_in = None
+        for priority in PRIORITIES:
+            queue = self.queues[priority]
+            index = 0
+            while index < len(queue) and index < SCAN_LIMIT:
+                message = queue[index]
+                if message.future.done():
+                    # The sender gave up (cancelled); nothing to deliver.
+                    del queue[index]
+                    self.depths[message.kind] -= 1
+                    continue
+                if message.route not in self.busy:
+                    route_bucket = self.routes.get(message.route)
+                    if route_bucket is None:
+                        route_bucket = self.routes[message.route] = TokenBucket(ROUTE_BURST, ROUTE_PER_SECONDS, now)
+                    wait = route_bucket.consume(now)
+                    if not wait:
+                        del queue[index]
+                        self.depths[message.kind] -= 1
+                        bucket.consume(now)
+                        return message
+                    retry_in = wait if retry_in is None else min(retry_in, wait)
+                index += 1
+        return retry_in
+
+    async def worker(self):
+        while True:
+            message = self._next(self.clock())
+            if not isinstance(message, OutboundMessage):
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=message)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self.busy.add(message.route)
+            metrics.registry.observe('outbound_wait_seconds', self.clock() - message.enqueued_at,
+                                     help_text="Time messages spent queued before sending", kind=message.kind)
+            try:
+                result = await message.send()
+            except Exception as e:
+                if not message.future.done():
+                    message.future.set_exception(e)
+            else:
+                if not message.future.done():
+                    message.future.set_result(result)
+            finally:
+                self.busy.discard(message.route)
+                if len(self.routes) > MAX_ROUTES:
+                    self._prune(self.clock())
+                # A route just freed up; another worker may be able to use it.
+                self.wakeup.set()
+
+    def _prune(self, now):
+        self.routes = {route: bucket for route, bucket in self.routes.items()
+                       if bucket.tokens + (now - bucket.updated) * bucket.rate < bucket.capacity}
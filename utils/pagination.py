@@ -0,0 +1,61 @@
+import discord
+
+PAGE_SIZE = 10
+
+def fts_query(terms):
+    """Quote each search term so user input can't break FTS5 syntax; the last one matches as a prefix."""
+    tokens = ['"' + token.replace('"', '""') + '"' for token in terms.split()]
+    if tokens:
+        tokens[-1] += '*'
+    return ' '.join(tokens)
+
+class KeysetPageView(discord.ui.View):
+    """Previous/next buttons over a keyset-paginated query.
+
+    ``fetch_page(cursor)`` returns up to PAGE_SIZE + 1 rows after ``cursor``
+    and ``cursor_of(row)`` gives the key to continue from. Only the cursors
+    of pages already visited are kept, so paging never re-reads earlier rows.
+    """
+
+    def __init__(self, author_id, title, fetch_page, cursor_of, render_row):
+        super().__init__(timeout=300)
+        self.author_id = author_id
+        self.title = title
+        self.fetch_page = fetch_page
+        self.cursor_of = cursor_of
+        self.render_row = render_row
+        self.cursors = [None]
+        self.rows = []
+
+    def load(self):
+        rows = self.fetch_page(self.cursors[-1])
+        self.has_next = len(rows) > PAGE_SIZE
+        self.rows = rows[:PAGE_SIZE]
+        self.previous_page.disabled = len(self.cursors) == 1
+        self.next_page.disabled = not self.has_next
+
+    def embed(self):
+        embed = discord.Embed(title=self.title, color=0x3498db)
+        if self.rows:
+            embed.description = "\n".join(self.render_row(row) for row in self.rows)[:4000]
+        else:
+            embed.description = "Nothing found."
+        embed.set_footer(text=f"Page {len(self.cursors)}")
+        return embed
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        return interaction.user.id == self.author_id
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if len(self.cursors) > 1:
+            self.cursors.pop()
+        self.load()
+        await interaction.response.edit_message(embed=self.embed(), view=self)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.primary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if self.has_next:
+            self.cursors.append(self.cursor_of(self.rows[-1]))
+        self.load()
+        await interaction.response.edit_message(embed=self.embed(), view=self)
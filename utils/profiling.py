@@ -0,0 +1,161 @@
+import asyncio
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from decouple import config
+from utils import loopmon
+
+PROFILE_DIR = config('PROFILE_DIR', default='profiles')
+SAMPLE_INTERVAL = 0.005
+MAX_STACK_DEPTH = 64
+TOP_FUNCTIONS = 10
+
+# The one running session, or None. Hooks only check this, so profiling costs
+# nothing while it's off. cProfile can only profile one thing per thread, hence
+# a single session.
+session = None
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"
+
+class ProfileSession:
+    """Profiles one cog, command or loop until a time or invocation limit is reached.
+
+    ``target`` is matched against loopmon activity labels ("Cog:command" and
+    "loop:name"): a cog name, a command name or a loop name all match.
+    In cprofile mode the profiler is switched on only while a matching
+    invocation runs; await points still let other coroutines run under it.
+    In sampling mode a thread samples the loop thread's stack and keeps only
+    samples taken while the target's task is the one running.
+    """
+
+    def __init__(self, target, mode='sampling', seconds=30, invocations=0):
+        self.target = target
+        self.mode = mode
+        self.seconds = seconds
+        self.invocations = invocations
+        self.calls = 0
+        self.depth = 0
+        self.samples = Counter()
+        self.sample_count = 0
+        self.profile = cProfile.Profile() if mode == 'cprofile' else None
+        self.finished = asyncio.Event()
+        self.stopping = threading.Event()
+        self.loop = None
+        self.loop_thread_id = None
+        self.sampler = None
+        self.started = None
+
+    def matches(self, label):
+        kind, _, name = label.partition(':')
+        return self.target in (label, kind, name)
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.started = time.monotonic()
+        if self.mode == 'sampling':
+            self.sampler = threading.Thread(target=self.sample, name='profile-sampler', daemon=True)
+            self.sampler.start()
+
+    def begin(self):
+        if self.depth == 0 and self.profile is not None:
+            self.profile.enable()
+        self.depth += 1
+
+    def end(self):
+        self.depth -= 1
+        if self.depth == 0 and self.profile is not None:
+            self.profile.disable()
+        self.calls += 1
+        if self.invocations and self.calls >= self.invocations:
+            self.finished.set()
+
+    def sample(self):
+        while not self.stopping.wait(SAMPLE_INTERVAL):
+            if not self.matches(loopmon.activity_of(self.loop)):
+                continue
+            frame = sys._current_frames().get(self.loop_thread_id)
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+                self.sample_count += 1
+
+    def stop(self):
+        self.stopping.set()
+        if self.profile is not None and self.depth > 0:
+            self.profile.disable()
+        if self.sampler is not None:
+            self.sampler.join()
+
+    def write(self):
+        """Write the results under PROFILE_DIR and return the file path."""
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        safe_target = ''.join(c if c.isalnum() or c in '-_' else '_' for c in self.target)
+        base = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{safe_target}")
+        if self.profile is not None:
+            path = base + '.pstats'
+            self.profile.dump_stats(path)
+        else:
+            path = base + '.folded'
+            with open(path, 'w') as f:
+                for stack, count in self.samples.most_common():
+                    f.write(f"{stack} {count}\n")
+        return path
+
+    def top_functions(self, limit=TOP_FUNCTIONS):
+        """Return (function, detail) pairs for the most expensive functions."""
+        if self.profile is not None:
+            stats = pstats.Stats(self.profile)
+            rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+            return [(f"{os.path.basename(filename)}:{line}({name})",
+                     f"{calls} calls, {total * 1000:.1f} ms self, {cumulative * 1000:.1f} ms total")
+                    for (filename, line, name), (_, calls, total, cumulative, _) in rows]
+
+        inclusive = Counter()
+        own = Counter()
+        for stack, count in self.samples.items():
+            frames = [frame.rsplit(':', 1)[0] for frame in stack.split(';')]
+            own[frames[-1]] += count
+            for frame in set(frames):
+                inclusive[frame] += count
+        total = self.sample_count or 1
+        return [(frame, f"{count / total:.0%} self, {inclusive[frame] / total:.0%} including callees")
+                for frame, count in own.most_common(limit)]
+
+def begin(label):
+    """Hook at the start of a command or loop iteration; returns a token for finish()."""
+    current = session
+    if current is None or not current.matches(label):
+        return None
+    current.begin()
+    return current
+
+def finish(token):
+    if token is not None:
+        token.end()
+
+async def run(target, mode='sampling', seconds=30, invocations=0):
+    """Profile ``target`` and return the finished session once it's written to disk."""
+    global session
+    if session is not None:
+        raise RuntimeError(f"Already profiling {session.target}.")
+    current = session = ProfileSession(target, mode, seconds, invocations)
+    current.start()
+    try:
+        await asyncio.wait_for(current.finished.wait(), timeout=seconds)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        session = None
+        current.stop()
+    current.path = await asyncio.to_thread(current.write)
+    return current
@@ -0,0 +1,144 @@
+import hashlib
+import logging
+import sqlite3
+import time
+from collections import Counter
+from discord import app_commands
+from utils import metrics
+
+# command -> (burst, seconds to refill the whole burst)
+DEFAULT_LIMITS = {
+    'confess': (3, 600),
+    'remind': (5, 60),
+    'start_timer': (5, 60),
+    'create_poll': (2, 300),
+    'jokeschuck': (5, 30)
+}
+
+DUPLICATE_TTL = 120
+PRUNE_EVERY = 1024
+
+class RateLimited(app_commands.CheckFailure):
+    """Raised from a command check when a user is throttled or repeats themselves."""
+
+    def __init__(self, command, retry_after, duplicate=False):
+        self.command = command
+        self.retry_after = retry_after
+        self.duplicate = duplicate
+        reason = "duplicate request" if duplicate else f"retry in {retry_after:.0f}s"
+        super().__init__(f"Rate limited on /{command}: {reason}")
+
+class TokenBucket:
+    __slots__ = ('capacity', 'rate', 'tokens', 'updated')
+
+    def __init__(self, capacity, per_seconds, now):
+        self.capacity = capacity
+        self.rate = capacity / per_seconds
+        self.tokens = capacity
+        self.updated = now
+
+    def consume(self, now):
+        """Take one token; return 0 on success or the seconds until one is available."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+class RateLimiter:
+    """Per-user, per-command token buckets plus a TTL set of recent payload hashes.
+
+    Per-guild overrides live in the rate_limits table and are cached in memory,
+    so a check never touches the database.
+    """
+
+    def __init__(self, db_path='chuck.db', clock=time.monotonic):
+        self.clock = clock
+        self.limits = {}
+        self.buckets = {}
+        self.recent = {}
+        self.stats = Counter()
+        self.checks = 0
+
+        try:
+            self.conn = metrics.connect(db_path)
+            self.cursor = self.conn.cursor()
+            self.cursor.execute('''CREATE TABLE IF NOT EXISTS rate_limits (
+                                   guild_id INTEGER,
+                                   command TEXT,
+                                   burst INTEGER,
+                                   per_seconds INTEGER,
+                                   PRIMARY KEY(guild_id, command)
+                                   )''')
+            self.conn.commit()
+            self.cursor.execute('SELECT guild_id, command, burst, per_seconds FROM rate_limits')
+            for guild_id, command, burst, per_seconds in self.cursor.fetchall():
+                self.limits[(guild_id, command)] = (burst, per_seconds)
+        except sqlite3.Error as e:
+            logging.error(f"Failed to load rate limits: {e}")
+
+    def close(self):
+        self.conn.close()
+
+    def limit_for(self, guild_id, command):
+        return self.limits.get((guild_id, command)) or DEFAULT_LIMITS.get(command)
+
+    def set_limit(self, guild_id, command, burst, per_seconds):
+        """Store a guild override; a burst of 0 removes it."""
+        if burst > 0:
+            self.cursor.execute('INSERT OR REPLACE INTO rate_limits (guild_id, command, burst, per_seconds) VALUES (?, ?, ?, ?)',
+                                (guild_id, command, burst, per_seconds))
+            self.limits[(guild_id, command)] = (burst, per_seconds)
+        else:
+            self.cursor.execute('DELETE FROM rate_limits WHERE guild_id = ? AND command = ?', (guild_id, command))
+            self.limits.pop((guild_id, command), None)
+        self.conn.commit()
+        # Existing buckets were sized for the old limit.
+        self.buckets = {key: bucket for key, bucket in self.buckets.items() if key[0] != guild_id or key[2] != command}
+
+    def check(self, guild_id, user_id, command, payload=None):
+        """Raise RateLimited if this call should be dropped, otherwise record it."""
+        now = self.clock()
+        self.checks += 1
+        if self.checks % PRUNE_EVERY == 0:
+            self._prune(now)
+
+        limit = self.limit_for(guild_id, command)
+        if limit:
+            key = (guild_id, user_id, command)
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = TokenBucket(limit[0], limit[1], now)
+            retry_after = bucket.consume(now)
+            if retry_after:
+                self.stats[(command, 'throttled')] += 1
+                raise RateLimited(command, retry_after)
+
+        if payload:
+            digest = hashlib.blake2b(f"{user_id}\0{command}\0{payload}".encode('utf-8'), digest_size=8).digest()
+            expires = self.recent.get(digest)
+            if expires is not None and expires > now:
+                self.stats[(command, 'duplicate')] += 1
+                raise RateLimited(command, expires - now, duplicate=True)
+            self.recent[digest] = now + DUPLICATE_TTL
+
+        self.stats[(command, 'allowed')] += 1
+
+    def _prune(self, now):
+        self.recent = {digest: expires for digest, expires in self.recent.items() if expires > now}
+        # A bucket that has refilled completely carries no state worth keeping.
+        self.buckets = {key: bucket for key, bucket in self.buckets.items()
+                        if bucket.tokens + (now - bucket.updated) * bucket.rate < bucket.capacity}
+
+def rate_limited(dedupe=True):
+    """App command check that enforces the bot's RateLimiter before the command body runs."""
+    async def predicate(interaction):
+        limiter = getattr(interaction.client, 'rate_limiter', None)
+        if limiter is None:
+            return True
+        options = interaction.data.get('options')
+        payload = repr(options) if dedupe and options else None
+        limiter.check(interaction.guild_id, interaction.user.id, interaction.command.name, payload)
+        return True
+    return app_commands.check(predicate)
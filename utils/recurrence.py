@@ -0,0 +1,159 @@
+import json
+import re
+from datetime import date, datetime, time, timedelta, timezone
+import pytz
+from utils.timeparse import parse_duration, resolve_zone
+
+# Shortest gap between occurrences, so a typo can't become a DM every minute forever.
+MIN_INTERVAL = timedelta(minutes=10)
+
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+DAY_GROUPS = {
+    'day': range(7), 'days': range(7),
+    'weekday': range(5), 'weekdays': range(5),
+    'weekend': (5, 6), 'weekends': (5, 6)
+}
+NAMED_INTERVALS = {'hourly': 3600, 'daily': 86400, 'weekly': 7 * 86400,
+                   'every hour': 3600, 'every day': 86400, 'every week': 7 * 86400}
+
+UNTIL = re.compile(r'^(?P<rule>.+?)\s+until\s+(?P<until>\d{4}-\d{2}-\d{2})$', re.IGNORECASE)
+DAY_RULE = re.compile(r'^(?:every|weekly(?:\s+on)?|on)\s+(?P<days>.+?)'
+                      r'(?:\s+(?:at\s+)?(?P<hour>\d{1,2}):(?P<minute>\d{2})(?:\s+(?P<zone>.+))?)?$', re.IGNORECASE)
+DAILY_AT = re.compile(r'^daily\s+(?:at\s+)?(?P<hour>\d{1,2}):(?P<minute>\d{2})(?:\s+(?P<zone>.+))?$', re.IGNORECASE)
+
+FORMAT_HELP = ("Use `every 6h`, `daily`, `weekly`, `every mon,thu at 19:00 EVE` or `every weekday 18:00 CET`, "
+               "optionally followed by `until 2025-12-31`.")
+
+def _weekdays(text):
+    days = set()
+    for word in re.split(r'\s*(?:,|\band\b|\s)\s*', text.lower()):
+        if not word:
+            continue
+        if word in DAY_GROUPS:
+            days.update(DAY_GROUPS[word])
+            continue
+        # Any prefix of three letters or more: mon, thurs, fridays.
+        matches = [index for index, name in enumerate(WEEKDAYS) if len(word) >= 3 and (name.startswith(word) or word == name + 's')]
+        if not matches:
+            raise ValueError(f"'{word}' is not a day of the week. {FORMAT_HELP}")
+        days.update(matches)
+    return tuple(sorted(days))
+
+class Recurrence:
+    """How a reminder or timer repeats: a fixed interval, or given weekdays at a wall-clock time.
+
+    Stored as JSON in the row's recurrence column; the row itself only ever
+    holds the next occurrence, which next_after() computes when the current
+    one fires.
+    """
+
+    def __init__(self, every=None, weekdays=None, at=None, zone='UTC', until=None):
+        self.every = every
+        self.weekdays = tuple(weekdays) if weekdays else None
+        self.at = at
+        self.zone = zone
+        self.until = until
+
+    @classmethod
+    def parse(cls, text):
+        text = ' '.join(text.split())
+        until = None
+        match = UNTIL.match(text)
+        if match:
+            text = match.group('rule')
+            try:
+                until = date.fromisoformat(match.group('until'))
+            except ValueError:
+                raise ValueError(f"'{match.group('until')}' is not a valid date.")
+
+        rule = cls._parse_rule(text)
+        if until:
+            # The whole end day counts, in the rule's own zone.
+            tz = pytz.timezone(rule.zone)
+            rule.until = tz.localize(datetime.combine(until + timedelta(days=1), time())).astimezone(timezone.utc)
+        return rule
+
+    @classmethod
+    def _parse_rule(cls, text):
+        lowered = text.lower()
+        if lowered in NAMED_INTERVALS:
+            return cls(every=NAMED_INTERVALS[lowered])
+
+        if lowered.startswith('every '):
+            try:
+                delta, _ = parse_duration(text[6:])
+            except ValueError:
+                pass
+            else:
+                if delta < MIN_INTERVAL:
+                    raise ValueError(f"Repeats must be at least {MIN_INTERVAL.seconds // 60} minutes apart.")
+                return cls(every=int(delta.total_seconds()))
+
+        match = DAY_RULE.match(text) or DAILY_AT.match(text)
+        if not match:
+            raise ValueError(f"Can't read the repeat rule '{text}'. {FORMAT_HELP}")
+        weekdays = _weekdays(match.group('days')) if 'days' in match.groupdict() else tuple(range(7))
+        at = None
+        if match.group('hour'):
+            at = (int(match.group('hour')), int(match.group('minute')))
+            if at[0] > 23 or at[1] > 59:
+                raise ValueError("The hour or minute is out of range.")
+        return cls(weekdays=weekdays, at=at, zone=resolve_zone(match.group('zone')).zone)
+
+    def anchored(self, first):
+        """This rule with its time of day taken from the first occurrence, when it didn't give one."""
+        if self.weekdays and self.at is None:
+            local = first.astimezone(pytz.timezone(self.zone))
+            self.at = (local.hour, local.minute)
+        return self
+
+    def next_after(self, due, now):
+        """The first occurrence after both the one that just fired and now, or None once the rule has ended.
+
+        Occurrences missed while the bot was down are skipped, not delivered in a burst.
+        """
+        if self.every:
+            missed = int((now - due).total_seconds() // self.every) + 1 if now >= due else 1
+            occurrence = due + timedelta(seconds=missed * self.every)
+        else:
+            after = max(due, now)
+            tz = pytz.timezone(self.zone)
+            local_day = after.astimezone(tz).date()
+            occurrence = None
+            for offset in range(8):
+                day = local_day + timedelta(days=offset)
+                if day.weekday() not in self.weekdays:
+                    continue
+                candidate = tz.localize(datetime.combine(day, time(*self.at))).astimezone(timezone.utc)
+                if candidate > after:
+                    occurrence = candidate
+                    break
+        if occurrence is None or (self.until and occurrence >= self.until):
+            return None
+        return occurrence
+
+    def describe(self):
+        if self.every:
+            text = f"every {self.every // 3600} hours" if self.every % 3600 == 0 else f"every {self.every // 60} minutes"
+            text = {3600: "every hour", 86400: "daily", 7 * 86400: "weekly"}.get(self.every, text)
+            if self.every % 86400 == 0 and self.every not in (86400, 7 * 86400):
+                text = f"every {self.every // 86400} days"
+        else:
+            days = "every day" if len(self.weekdays) == 7 else "every " + ', '.join(WEEKDAYS[day][:3].capitalize() for day in self.weekdays)
+            zone = 'EVE' if self.zone == 'UTC' else self.zone
+            text = f"{days} at {self.at[0]:02d}:{self.at[1]:02d} {zone}" if self.at else days
+        if self.until:
+            text += f" until {self.until.astimezone(pytz.timezone(self.zone)).date() - timedelta(days=1)}"
+        return text
+
+    def dumps(self):
+        return json.dumps({'every': self.every, 'weekdays': self.weekdays, 'at': self.at, 'zone': self.zone,
+                           'until': self.until.isoformat() if self.until else None})
+
+    @classmethod
+    def loads(cls, text):
+        if not text:
+            return None
+        data = json.loads(text)
+        return cls(every=data['every'], weekdays=data['weekdays'], at=tuple(data['at']) if data['at'] else None,
+                   zone=data['zone'], until=datetime.fromisoformat(data['until']) if data['until'] else None)
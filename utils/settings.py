@@ -0,0 +1,203 @@
+import logging
+import re
+import sqlite3
+from decouple import config
+from utils import metrics
+
+HOME_GUILD_ID = config('GUILD_ID', default=0, cast=int)
+# Every watched region adds a zKillboard poll shared by all guilds, so each guild gets only a few.
+MAX_REGIONS = config('MAX_REGIONS', default=10, cast=int)
+# Known space, wormhole, Abyssal and Pochven regions all have ids in this block.
+REGION_IDS = range(10000000, 15000000)
+
+def parse_id(value):
+    """Accept a raw ID or a channel/user/role mention."""
+    match = re.fullmatch(r'<[#@][!&]?(\d+)>|(\d+)', value.strip())
+    if not match:
+        raise ValueError(f"'{value}' is not an ID or a mention.")
+    return int(match.group(1) or match.group(2))
+
+def parse_id_list(value):
+    ids = [parse_id(part) for part in value.split(',') if part.strip()]
+    if not ids:
+        raise ValueError("Give at least one ID.")
+    return ids
+
+def parse_region_ids(value):
+    ids = list(dict.fromkeys(parse_id_list(value)))
+    for region_id in ids:
+        if region_id not in REGION_IDS:
+            raise ValueError(f"{region_id} is not an EVE region ID.")
+    if len(ids) > MAX_REGIONS:
+        raise ValueError(f"Watch at most {MAX_REGIONS} regions.")
+    return ids
+
+def parse_isk(value):
+    try:
+        amount = int(value.replace(',', '').replace('_', '').strip())
+    except ValueError:
+        raise ValueError(f"'{value}' is not a whole ISK amount.")
+    if amount < 0:
+        raise ValueError("The value can't be negative.")
+    return amount
+
+def format_id_list(ids):
+    return ','.join(map(str, ids))
+
+# key -> (env var seeding the home guild, parse, format, description)
+SETTINGS = {
+    'allowed_channel_id': ('ALLOWED_CHANNEL_ID', parse_id, str, "Channel confessions are posted to"),
+    'kills_channel_id': ('KILLS_CHANNEL_ID', parse_id, str, "Channel kill notifications are posted to"),
+    'admin_user_id': ('ADMIN_USER_ID', parse_id, str, "User allowed to run admin commands"),
+    'region_ids': ('REGION_ID', parse_region_ids, format_id_list, "Regions watched for kills, comma separated"),
+    'min_value': ('MIN_VALUE', parse_isk, str, "Minimum kill value in ISK")
+}
+# Settings holding a channel of the guild they are set for.
+CHANNEL_SETTINGS = ('allowed_channel_id', 'kills_channel_id')
+
+log = logging.getLogger(__name__)
+
+class GuildSettings:
+    """Per-guild settings, kept entirely in memory and written through to SQLite.
+
+    Reads are dict lookups. Writes update the table and the cache together
+    and bump a version number, which other processes sharing the database
+    (cluster nodes, kill workers) check in refresh_if_changed().
+    On first run the home guild (GUILD_ID) is seeded from the environment.
+    """
+
+    def __init__(self, db_path='chuck.db', home_guild_id=HOME_GUILD_ID):
+        self.home_guild_id = home_guild_id
+        self.cache = {}
+        self.version = None
+
+        self.conn = metrics.connect(db_path, timeout=10)
+        self.cursor = self.conn.cursor()
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS guild_settings (
+                               guild_id INTEGER,
+                               key TEXT,
+                               value TEXT,
+                               PRIMARY KEY(guild_id, key)
+                               )''')
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS metadata (
+                               key TEXT PRIMARY KEY,
+                               value TEXT
+                               )''')
+        self.conn.commit()
+        self._seed_from_env()
+        self.reload()
+
+    def close(self):
+        self.conn.close()
+
+    def _seed_from_env(self):
+        self.cursor.execute('SELECT 1 FROM guild_settings LIMIT 1')
+        if self.cursor.fetchone() or not self.home_guild_id:
+            return
+        rows = []
+        for key, (env_var, parse, fmt, _) in SETTINGS.items():
+            value = config(env_var, default='')
+            if not value:
+                continue
+            try:
+                rows.append((self.home_guild_id, key, fmt(parse(value))))
+            except ValueError as e:
+                log.error(f"Ignoring {env_var}: {e}")
+        self.cursor.executemany('INSERT INTO guild_settings (guild_id, key, value) VALUES (?, ?, ?)', rows)
+        self._bump_version()
+        self.conn.commit()
+        log.info(f"Seeded {len(rows)} settings for guild {self.home_guild_id} from the environment.")
+
+    def _current_version(self):
+        self.cursor.execute('SELECT value FROM metadata WHERE key = ?', ('settings_version',))
+        row = self.cursor.fetchone()
+        return row[0] if row else None
+
+    def _bump_version(self):
+        self.cursor.execute('''INSERT INTO metadata (key, value) VALUES ('settings_version', '1')
+                               ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1''')
+
+    def reload(self):
+        cache = {}
+        self.cursor.execute('SELECT guild_id, key, value FROM guild_settings')
+        for guild_id, key, value in self.cursor.fetchall():
+            if key not in SETTINGS:
+                continue
+            try:
+                cache.setdefault(guild_id, {})[key] = SETTINGS[key][1](value)
+            except ValueError as e:
+                log.error(f"Bad stored setting {key} for guild {guild_id}: {e}")
+        self.cache = cache
+        self.version = self._current_version()
+
+    def refresh_if_changed(self):
+        """Reload if another process changed settings; one indexed lookup otherwise."""
+        try:
+            if self._current_version() != self.version:
+                self.reload()
+                log.info("Guild settings changed elsewhere, reloaded.")
+        except sqlite3.Error as e:
+            log.error(f"Could not check for settings changes: {e}")
+
+    def get(self, guild_id, key, default=None):
+        return self.cache.get(guild_id, {}).get(key, default)
+
+    def guilds_with(self, key):
+        """Map every guild that has ``key`` set to its value."""
+        return {guild_id: values[key] for guild_id, values in self.cache.items() if key in values}
+
+    def set(self, guild_id, key, raw_value):
+        """Parse and store a setting; raises ValueError if the value is invalid."""
+        _, parse, fmt, _ = SETTINGS[key]
+        value = parse(raw_value)
+        self.cursor.execute('INSERT OR REPLACE INTO guild_settings (guild_id, key, value) VALUES (?, ?, ?)',
+                            (guild_id, key, fmt(value)))
+        self._bump_version()
+        self.conn.commit()
+        self.cache.setdefault(guild_id, {})[key] = value
+        self.version = self._current_version()
+        return value
+
+    def reset(self, guild_id, key):
+        self.cursor.execute('DELETE FROM guild_settings WHERE guild_id = ? AND key = ?', (guild_id, key))
+        self._bump_version()
+        self.conn.commit()
+        self.cache.get(guild_id, {}).pop(key, None)
+        self.version = self._current_version()
+
+    def is_admin(self, interaction):
+        """Guild-level admin: the guild's configured admin, a server administrator or the bot admin."""
+        user = interaction.user
+        if interaction.guild_id and user.id == self.get(interaction.guild_id, 'admin_user_id'):
+            return True
+        permissions = getattr(user, 'guild_permissions', None)
+        if permissions is not None and permissions.administrator:
+            return True
+        return self.is_bot_admin(user.id)
+
+    def may_change(self, interaction, key):
+        """Whether the user may change ``key`` in this guild.
+
+        The home guild's admin_user_id is the bot admin, so once it is set
+        only the bot admin may change it, not every home guild administrator.
+        """
+        if not self.is_admin(interaction):
+            return False
+        if key == 'admin_user_id' and interaction.guild_id == self.home_guild_id and self.get(self.home_guild_id, key) is not None:
+            return self.is_bot_admin(interaction.user.id)
+        return True
+
+    def is_bot_admin(self, user_id):
+        """Bot-wide admin (jokes, feeds, profiling, global stats): the home guild's admin."""
+        return user_id == self.get(self.home_guild_id, 'admin_user_id')
+
+    def kill_watch(self):
+        """Map each watched region to the lowest minimum value any guild posting kills wants."""
+        watch = {}
+        for guild_id, values in self.cache.items():
+            if 'kills_channel_id' not in values:
+                continue
+            min_value = values.get('min_value', 0)
+            for region_id in values.get('region_ids', ()):
+                watch[region_id] = min(min_value, watch.get(region_id, min_value))
+        return watch
@@ -0,0 +1,156 @@
+import asyncio
+import json
+import logging
+import os
+import struct
+import time
+import zlib
+from decouple import config
+from utils import metrics
+
+SNAPSHOT_PATH = config('SNAPSHOT_PATH', default='cache_snapshot.bin')
+SNAPSHOT_INTERVAL = config('SNAPSHOT_INTERVAL', default=300, cast=int)
+# Snapshots older than this are ignored entirely; sections can ask for less.
+SNAPSHOT_MAX_AGE = config('SNAPSHOT_MAX_AGE', default=7 * 86400, cast=int)
+
+MAGIC = b'CHKSNAP'
+FORMAT_VERSION = 1
+# magic, format version, CRC32 of the compressed payload
+HEADER = struct.Struct('>7sHI')
+
+log = logging.getLogger(__name__)
+
+class SnapshotError(Exception):
+    """The snapshot file is missing, corrupt or from an incompatible version."""
+
+def encode(sections, saved_at):
+    payload = zlib.compress(json.dumps({'saved_at': saved_at, 'sections': sections}, separators=(',', ':')).encode('utf-8'))
+    return HEADER.pack(MAGIC, FORMAT_VERSION, zlib.crc32(payload)) + payload
+
+def decode(blob):
+    if len(blob) < HEADER.size:
+        raise SnapshotError("file is truncated")
+    magic, version, checksum = HEADER.unpack_from(blob)
+    payload = blob[HEADER.size:]
+    if magic != MAGIC:
+        raise SnapshotError("not a snapshot file")
+    if version != FORMAT_VERSION:
+        raise SnapshotError(f"format version {version}, expected {FORMAT_VERSION}")
+    if zlib.crc32(payload) != checksum:
+        raise SnapshotError("checksum mismatch")
+    try:
+        data = json.loads(zlib.decompress(payload))
+    except (zlib.error, ValueError) as e:
+        raise SnapshotError(f"undecodable payload: {e}")
+    return data['saved_at'], data['sections']
+
+class Snapshot:
+    """Warm-start file for in-memory caches.
+
+    The file is read once when this is created, before any cog loads.
+    Cogs take their section with restore() while they initialise and
+    register() a function returning the section's current JSON-able state.
+    Every registered section is written every SNAPSHOT_INTERVAL seconds
+    and on shutdown. A missing, corrupt or outdated file just means a cold
+    start.
+    """
+
+    def __init__(self, path=SNAPSHOT_PATH, interval=SNAPSHOT_INTERVAL, max_age=SNAPSHOT_MAX_AGE, clock=time.time):
+        self.path = path
+        self.interval = interval
+        self.clock = clock
+        self.providers = {}
+        self.sections = {}
+        self.saved_at = None
+        self.task = None
+
+        try:
+            with open(path, 'rb') as f:
+                saved_at, sections = decode(f.read())
+        except FileNotFoundError:
+            log.info(f"No cache snapshot at {path}, starting cold.")
+            return
+        except (OSError, SnapshotError) as e:
+            log.warning(f"Ignoring cache snapshot {path}: {e}")
+            return
+        age = clock() - saved_at
+        if age > max_age:
+            log.warning(f"Ignoring cache snapshot {path}: it is {age / 3600:.1f} hours old.")
+            return
+        self.saved_at = saved_at
+        self.sections = sections
+        log.info(f"Loaded cache snapshot {path} from {age:.0f}s ago with sections {', '.join(sections) or 'none'}.")
+
+    def age(self):
+        return None if self.saved_at is None else self.clock() - self.saved_at
+
+    def restore(self, name, max_age=None):
+        """The saved state of one section, or None if there is none or it is older than max_age."""
+        data = self.sections.pop(name, None)
+        if data is None:
+            return None
+        if max_age is not None and self.age() > max_age:
+            log.info(f"Snapshot section {name} is too old to use.")
+            return None
+        return data
+
+    def register(self, name, dump):
+        self.providers[name] = dump
+
+    def unregister(self, name):
+        self.providers.pop(name, None)
+
+    def collect(self):
+        sections = {}
+        for name, dump in list(self.providers.items()):
+            try:
+                sections[name] = dump()
+            except Exception as e:
+                log.exception(f"Could not snapshot {name}: {e}")
+        return sections
+
+    def write(self, sections):
+        blob = encode(sections, self.clock())
+        # Write aside and rename, so a crash mid-write never leaves a torn file.
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(blob)
+        os.replace(temp_path, self.path)
+        return len(blob)
+
+    def save(self):
+        """Write the snapshot from the calling thread; used at shutdown."""
+        started = time.perf_counter()
+        try:
+            size = self.write(self.collect())
+        except OSError as e:
+            log.error(f"Could not write cache snapshot {self.path}: {e}")
+            return
+        elapsed = time.perf_counter() - started
+        metrics.registry.observe('snapshot_save_seconds', elapsed, help_text="Time to write the cache snapshot")
+        log.info(f"Wrote cache snapshot {self.path} ({size:,} bytes) in {elapsed * 1000:.0f} ms.")
+
+    async def save_periodically(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            started = time.perf_counter()
+            # Collecting reads live cache objects, so it stays on the loop;
+            # compressing and writing the file does not.
+            sections = self.collect()
+            try:
+                size = await asyncio.to_thread(self.write, sections)
+            except OSError as e:
+                log.error(f"Could not write cache snapshot {self.path}: {e}")
+                continue
+            metrics.registry.observe('snapshot_save_seconds', time.perf_counter() - started, help_text="Time to write the cache snapshot")
+            log.debug("Wrote cache snapshot %s (%d bytes).", self.path, size)
+
+    def start(self):
+        if self.interval > 0:
+            self.task = asyncio.create_task(self.save_periodically())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        self.save()
@@ -0,0 +1,161 @@
+import re
+from datetime import date, datetime, time, timedelta, timezone
+from functools import lru_cache
+import pytz
+from decouple import config
+from utils.tz_index import ALIASES
+
+PARSE_CACHE_SIZE = config('PARSE_CACHE_SIZE', default=4096, cast=int)
+
+# Tranquility goes down daily at 11:00 EVE time and is normally back within 15 minutes.
+DOWNTIME_START = time(11, 0)
+DOWNTIME_LENGTH = timedelta(minutes=15)
+# Nothing the bot schedules is useful further out than this.
+MAX_AHEAD = timedelta(days=3650)
+
+# Unit aliases, matched case-insensitively except for the lone 'M', which means months.
+UNITS = {
+    'second': (1, ('s', 'sec', 'secs', 'second', 'seconds')),
+    'minute': (60, ('m', 'mn', 'min', 'mins', 'minute', 'minutes')),
+    'hour': (3600, ('h', 'hr', 'hrs', 'hour', 'hours')),
+    'day': (86400, ('d', 'day', 'days')),
+    'week': (7 * 86400, ('w', 'wk', 'wks', 'week', 'weeks')),
+    'month': (30 * 86400, ('mo', 'mon', 'month', 'months')),
+    'year': (365 * 86400, ('y', 'yr', 'yrs', 'year', 'years'))
+}
+UNIT_ALIASES = {alias: name for name, (_, aliases) in UNITS.items() for alias in aliases}
+
+DURATION_TOKEN = re.compile(r'\s*(?:(?P<value>\d+)\s*(?P<unit>[a-z]+)|(?P<separator>,|and\b))\s*', re.IGNORECASE)
+DOWNTIME = re.compile(r'^(?:(?P<after>after)\s+)?(?:downtime|dt)$', re.IGNORECASE)
+CLOCK_TIME = re.compile(
+    r'^(?:(?P<day>today|tomorrow|\d{4}-\d{2}-\d{2})\s+)?(?P<at>at\s+)?(?P<hour>\d{1,2})(?::(?P<minute>\d{2}))?'
+    r'\s*(?P<ampm>am|pm)?(?:\s+(?P<zone>[a-z_/+\-\s]+))?$', re.IGNORECASE)
+
+FORMAT_HELP = "Use a duration like `10m`, `1h30m` or `2 days 4h`, or a time like `at 18:00 EVE`, `tomorrow 11:00` or `after downtime`."
+
+def _plural(value, name):
+    return f"{value} {name}{'' if value == 1 else 's'}"
+
+def describe(delta):
+    """'1 Day 2 Hours 5 Minutes' for a timedelta, to the second."""
+    seconds = int(delta.total_seconds())
+    parts = []
+    for name, size in (('Day', 86400), ('Hour', 3600), ('Minute', 60), ('Second', 1)):
+        value, seconds = divmod(seconds, size)
+        if value:
+            parts.append(_plural(value, name))
+    return ' '.join(parts) or "0 Seconds"
+
+def resolve_zone(name):
+    if not name:
+        return pytz.utc
+    name = ' '.join(name.split())
+    try:
+        return pytz.timezone(ALIASES.get(name.upper(), name))
+    except pytz.UnknownTimeZoneError:
+        raise ValueError(f"Unknown time zone '{name}'.")
+
+def _compile_duration(text):
+    position, seconds, amounts = 0, 0, {}
+    while position < len(text):
+        match = DURATION_TOKEN.match(text, position)
+        if not match or match.end() == position:
+            raise ValueError(f"Can't read '{text[position:].strip()}'. {FORMAT_HELP}")
+        position = match.end()
+        if match.group('separator'):
+            continue
+        value, unit = int(match.group('value')), match.group('unit')
+        name = 'month' if unit == 'M' else UNIT_ALIASES.get(unit.lower())
+        if name is None:
+            raise ValueError(f"Unknown time unit '{unit}'. {FORMAT_HELP}")
+        seconds += value * UNITS[name][0]
+        amounts[name] = amounts.get(name, 0) + value
+    if not amounts:
+        raise ValueError(f"No duration given. {FORMAT_HELP}")
+    if seconds <= 0:
+        raise ValueError("The duration must be longer than zero.")
+    if seconds > MAX_AHEAD.total_seconds():
+        raise ValueError(f"That is more than {MAX_AHEAD.days // 365} years away.")
+    # Largest unit first, each unit once, zero amounts left out: '1m0s' is '1 Minute'.
+    parts = [_plural(amounts[name], name.capitalize()) for name in reversed(UNITS) if amounts.get(name)]
+    return 'duration', seconds, ' '.join(parts)
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def compile_expression(text):
+    """The time expression reduced to a form that only needs 'now' to resolve.
+
+    Cached, since people type the same handful of expressions over and over.
+    """
+    text = text.strip()
+    if text.lower().startswith('in '):
+        return _compile_duration(text[3:])
+
+    match = DOWNTIME.match(text)
+    if match:
+        return 'downtime', bool(match.group('after'))
+
+    match = CLOCK_TIME.match(text)
+    # A bare number is a duration missing its unit, not a time of day.
+    if match and (match.group('day') or match.group('at') or match.group('minute') or match.group('ampm')):
+        hour, minute = int(match.group('hour')), int(match.group('minute') or 0)
+        if match.group('ampm'):
+            if not 1 <= hour <= 12:
+                raise ValueError("The hour must be 1-12 with am/pm.")
+            hour = hour % 12 + (12 if match.group('ampm').lower() == 'pm' else 0)
+        if hour > 23 or minute > 59:
+            raise ValueError("The hour or minute is out of range.")
+        day = (match.group('day') or '').lower() or None
+        if day and day not in ('today', 'tomorrow'):
+            try:
+                day = date.fromisoformat(day)
+            except ValueError:
+                raise ValueError(f"'{day}' is not a valid date.")
+        return 'clock', day, hour, minute, resolve_zone(match.group('zone')).zone
+
+    return _compile_duration(text)
+
+def parse_duration(text):
+    """(timedelta, description) for a plain duration such as '1h 30m'."""
+    compiled = compile_expression(text)
+    if compiled[0] != 'duration':
+        raise ValueError(f"Expected a duration, not a time of day. {FORMAT_HELP}")
+    return timedelta(seconds=compiled[1]), compiled[2]
+
+def parse_when(text, now):
+    """The UTC instant a time expression refers to, and a description of how far off it is.
+
+    ``now`` is an aware datetime, normally ``bot.clock.now(timezone.utc)``.
+    Durations count from ``now``; times of day without a date mean their
+    next occurrence; EVE time is UTC.
+    """
+    compiled = compile_expression(text)
+    now = now.astimezone(timezone.utc)
+    kind = compiled[0]
+    if kind == 'duration':
+        return now + timedelta(seconds=compiled[1]), compiled[2]
+
+    if kind == 'downtime':
+        at = datetime.combine(now.date(), DOWNTIME_START, timezone.utc)
+        if compiled[1]:
+            at += DOWNTIME_LENGTH
+        if at <= now:
+            at += timedelta(days=1)
+    else:
+        _, day, hour, minute, zone_name = compiled
+        tz = pytz.timezone(zone_name)
+        local_today = now.astimezone(tz).date()
+        if day is None or day == 'today':
+            local_day = local_today
+        elif day == 'tomorrow':
+            local_day = local_today + timedelta(days=1)
+        else:
+            local_day = day
+        at = tz.localize(datetime.combine(local_day, time(hour, minute))).astimezone(timezone.utc)
+        if at <= now:
+            if day is not None:
+                raise ValueError("That time has already passed.")
+            at = tz.localize(datetime.combine(local_day + timedelta(days=1), time(hour, minute))).astimezone(timezone.utc)
+
+    if at - now > MAX_AHEAD:
+        raise ValueError(f"That is more than {MAX_AHEAD.days // 365} years away.")
+    return at, describe(at - now)
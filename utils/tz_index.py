@@ -0,0 +1,130 @@
+import bisect
+import pytz
+from collections import Counter
+from functools import lru_cache
+
+# EVE community shorthands on top of the IANA names. "EVE" is server time.
+ALIASES = {
+    'EVE': 'UTC',
+    'EVE TIME': 'UTC',
+    'UTC': 'UTC',
+    'GMT': 'Europe/London',
+    'ET': 'America/New_York',
+    'EST': 'America/New_York',
+    'EDT': 'America/New_York',
+    'CT': 'America/Chicago',
+    'CST': 'America/Chicago',
+    'CDT': 'America/Chicago',
+    'MT': 'America/Denver',
+    'MST': 'America/Denver',
+    'MDT': 'America/Denver',
+    'PT': 'America/Los_Angeles',
+    'PST': 'America/Los_Angeles',
+    'PDT': 'America/Los_Angeles',
+    'US TZ': 'America/New_York',
+    'USTZ': 'America/New_York',
+    'EU TZ': 'Europe/Berlin',
+    'EUTZ': 'Europe/Berlin',
+    'BST': 'Europe/London',
+    'CET': 'Europe/Berlin',
+    'CEST': 'Europe/Berlin',
+    'MSK': 'Europe/Moscow',
+    'AU TZ': 'Australia/Sydney',
+    'AUTZ': 'Australia/Sydney',
+    'AEST': 'Australia/Sydney',
+    'AEDT': 'Australia/Sydney',
+    'AWST': 'Australia/Perth',
+    'NZST': 'Pacific/Auckland',
+    'CN TZ': 'Asia/Shanghai',
+    'JST': 'Asia/Tokyo',
+}
+
+MAX_RESULTS = 25
+
+
+def _normalize(text):
+    return ' '.join(text.replace('_', ' ').replace('/', ' / ').lower().split())
+
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ZoneIndex:
+    """Prefix and trigram index over IANA zone names and EVE shorthands.
+
+    Built once at startup; lookups are a bisect over sorted keys, falling
+    back to trigram overlap for typos and mid-word matches.
+    """
+
+    def __init__(self, zone_names=None, aliases=None):
+        aliases = ALIASES if aliases is None else aliases
+        zone_names = pytz.all_timezones if zone_names is None else zone_names
+
+        # Each entry is (label shown to the user, IANA zone it resolves to).
+        self.entries = [(alias, tz) for alias, tz in aliases.items()]
+        self.entries += [(name, name) for name in zone_names]
+
+        self.by_label = {}
+        keys = []
+        self.trigrams = {}
+        for entry_id, (label, tz) in enumerate(self.entries):
+            normalized = _normalize(label)
+            self.by_label.setdefault(normalized, entry_id)
+            # Index the full name and every word in it, so "york" finds
+            # America/New_York as well as "new y" does.
+            words = normalized.replace(' / ', ' ').split(' ')
+            keys.append((normalized, entry_id))
+            for position in range(1, len(words)):
+                keys.append((' '.join(words[position:]), entry_id))
+            for gram in _trigrams(normalized):
+                self.trigrams.setdefault(gram, []).append(entry_id)
+
+        keys.sort()
+        self.keys = [key for key, _ in keys]
+        self.key_ids = [entry_id for _, entry_id in keys]
+        # Per instance, so the cache doesn't keep every index alive through self.
+        self._search = lru_cache(maxsize=4096)(self._search_uncached)
+
+    def resolve(self, name):
+        """Return the IANA zone for an exact label or alias, or None."""
+        if not name:
+            return None
+        entry_id = self.by_label.get(_normalize(name))
+        if entry_id is None:
+            return None
+        return self.entries[entry_id][1]
+
+    def search(self, query, limit=MAX_RESULTS):
+        """Return up to ``limit`` (label, zone) pairs matching ``query``."""
+        return self._search(_normalize(query), limit)
+
+    def _search_uncached(self, query, limit):
+        if not query:
+            return tuple(self.entries[:limit])
+
+        found = []
+        seen = set()
+        start = bisect.bisect_left(self.keys, query)
+        for position in range(start, len(self.keys)):
+            if not self.keys[position].startswith(query) or len(found) >= limit:
+                break
+            entry_id = self.key_ids[position]
+            if entry_id not in seen:
+                seen.add(entry_id)
+                found.append(entry_id)
+
+        if len(found) < limit and len(query) >= 3:
+            scores = Counter()
+            for gram in _trigrams(query):
+                for entry_id in self.trigrams.get(gram, ()):
+                    if entry_id not in seen:
+                        scores[entry_id] += 1
+            threshold = max(1, len(_trigrams(query)) // 2)
+            for entry_id, score in scores.most_common(limit - len(found)):
+                if score < threshold:
+                    break
+                found.append(entry_id)
+
+        return tuple(self.entries[entry_id] for entry_id in found)